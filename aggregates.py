@@ -0,0 +1,535 @@
+import os
+import re
+import sqlite3
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from athletes import athlete_keys
+from storage import season_of
+
+# Where the aggregate tables are kept unless told otherwise
+DEFAULT_AGGREGATES_PATH = '~/projects/ifsc-scraper/data/aggregates.sqlite'
+
+# Columns of the stored results the aggregates are computed from
+SOURCE_COLUMNS = ['Competition Title', 'Competition Date', 'LAST', 'FIRST', 'Nation', 'Rank']
+
+# Counters kept per athlete and per nation, all of them can be added and subtracted
+COUNTERS = ['starts', 'wins', 'podiums', 'top8', 'rank_sum']
+
+
+def comp_end_date(date, title=''):
+    """
+    Last day of a competition, used to put competitions in order for the ratings
+    input:
+        date - Competition date string, e.g. '27  - 28 July 2018' or '18 May 2019'
+        title - Competition title, used for the year if the date can't be read
+    output:
+        'YYYY-MM-DD' string
+    """
+    for day, month, year in reversed(re.findall(r'(\d{1,2})\s+([A-Za-z]+)\s+((?:19|20)\d\d)', str(date))):
+        for fmt in ('%d %B %Y', '%d %b %Y'):
+            try:
+                return datetime.strptime(day + ' ' + month + ' ' + year, fmt).strftime('%Y-%m-%d')
+            except ValueError:
+                pass
+
+    season = season_of(date, title)
+
+    return (str(season) if season is not None else '0000') + '-12-31'
+
+
+def placings(df):
+    """
+    One row per athlete and competition, from stored results
+    Men's and women's (and age group) results of a competition share a category, each one is
+    a separate field. Rows are stored in page order with ranks going up within a page, so a
+    new field starts wherever the rank goes back down
+    input:
+        df - Results with at least the SOURCE_COLUMNS, rows in the order they were stored
+    output:
+        DataFrame with competition, ended, season, field, athlete, last, first, nation, and rank columns,
+        rows without a rank are left out
+    """
+    titles = df['Competition Title'].astype(str)
+    rank = pd.to_numeric(df['Rank'], errors='coerce')
+
+    out = pd.DataFrame({
+        'competition': titles.to_numpy(),
+        'athlete': athlete_keys(df).to_numpy(),
+        'last': df['LAST'].astype(object).to_numpy(),
+        'first': df['FIRST'].astype(object).to_numpy(),
+        'nation': df['Nation'].astype(object).where(df['Nation'].notna(), '').astype(str).str.strip().str.upper().to_numpy(),
+        'rank': rank.to_numpy(dtype=float),
+    })
+
+    # Ranks going back down start a new field, counted per competition
+    previous = out.groupby('competition', sort=False)['rank'].shift()
+    out['field'] = (out['rank'] < previous).astype(int).groupby(out['competition'], sort=False).cumsum()
+
+    # Date and season once per competition
+    comps = pd.DataFrame({'competition': titles, 'date': df['Competition Date'].astype(str)}).drop_duplicates('competition')
+    ended = {x: comp_end_date(d, x) for x, d in zip(comps['competition'], comps['date'])}
+    seasons = {x: season_of(d, x) for x, d in zip(comps['competition'], comps['date'])}
+    out['ended'] = out['competition'].map(ended)
+    out['season'] = out['competition'].map(seasons).fillna(0).astype(int)
+
+    out = out[out['rank'].notna()]
+    out['rank'] = out['rank'].astype(int)
+
+    # An athlete only counts once per field
+    out = out.sort_values('rank', kind='stable').drop_duplicates(['competition', 'field', 'athlete'])
+
+    return out.sort_index()
+
+
+def counters(places, keys):
+    """
+    Sum the counters over groups of placings
+    input:
+        places - DataFrame from placings()
+        keys - Columns to group by
+    output:
+        DataFrame of keys and COUNTERS
+    """
+    flags = places[keys].copy()
+    flags['starts'] = 1
+    flags['wins'] = (places['rank'] == 1).astype(int)
+    flags['podiums'] = (places['rank'] <= 3).astype(int)
+    flags['top8'] = (places['rank'] <= 8).astype(int)
+    flags['rank_sum'] = places['rank']
+
+    return flags.groupby(keys, as_index=False)[COUNTERS].sum()
+
+
+def pairs(places, max_rank):
+    """
+    Head to head meetings between athletes in the same field who both placed in the top max_rank
+    output:
+        DataFrame with athlete_a < athlete_b, meetings, a_ahead, and b_ahead columns, summed over competitions
+    """
+    top = places.loc[places['rank'] <= max_rank, ['competition', 'field', 'athlete', 'rank']]
+    matched = top.merge(top, on=['competition', 'field'], suffixes=('_a', '_b'))
+    matched = matched[matched['athlete_a'] < matched['athlete_b']]
+
+    counts = pd.DataFrame({
+        'athlete_a': matched['athlete_a'],
+        'athlete_b': matched['athlete_b'],
+        'meetings': 1,
+        'a_ahead': (matched['rank_a'] < matched['rank_b']).astype(int),
+        'b_ahead': (matched['rank_a'] > matched['rank_b']).astype(int),
+    })
+
+    return counts.groupby(['athlete_a', 'athlete_b'], as_index=False)[['meetings', 'a_ahead', 'b_ahead']].sum()
+
+
+def elo_changes(ratings, ranks, k):
+    """
+    Rating changes from one field, treating it as a match between every pair of athletes
+    input:
+        ratings - numpy array of the athletes' ratings before the competition
+        ranks - numpy array of their ranks
+        k - Most a rating can move from a single competition
+    output:
+        numpy array of rating changes
+    """
+    n = len(ratings)
+    if n < 2:
+        return np.zeros(n)
+
+    expected = 1 / (1 + 10 ** ((ratings[None, :] - ratings[:, None]) / 400))
+    actual = (ranks[:, None] < ranks[None, :]) + 0.5 * (ranks[:, None] == ranks[None, :])
+    np.fill_diagonal(expected, 0)
+    np.fill_diagonal(actual, 0)
+
+    return k * (actual - expected).sum(axis=1) / (n - 1)
+
+
+class AggregateStore():
+    """
+    Precomputed stats kept next to the results, so dashboards don't rescan the history:
+    per athlete, per nation and per season counters, head to head records, and Elo ratings
+    Each competition's placings are kept too, so when a competition is stored again its old
+    contribution is subtracted before the new one is added, and only the competitions that
+    were written are ever processed
+    """
+
+    def __init__(self, path=DEFAULT_AGGREGATES_PATH, k=32, initial_rating=1500, h2h_max_rank=20):
+        """
+        input:
+            path - Path of the sqlite database
+            k - Elo K factor, the most a rating moves from one competition
+            initial_rating - Rating of an athlete's first competition
+            h2h_max_rank - Head to heads are kept between athletes who both placed this high
+        """
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.k = k
+        self.initial_rating = initial_rating
+        self.h2h_max_rank = h2h_max_rank
+
+        counter_columns = ', '.join(x + ' INTEGER NOT NULL' for x in COUNTERS)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS placings (
+                category TEXT NOT NULL,
+                competition TEXT NOT NULL,
+                ended TEXT NOT NULL,
+                season INTEGER NOT NULL,
+                field INTEGER NOT NULL,
+                athlete TEXT NOT NULL,
+                nation TEXT,
+                rank INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS placings_comp ON placings (category, competition);
+            CREATE INDEX IF NOT EXISTS placings_order ON placings (category, ended, competition);
+            CREATE INDEX IF NOT EXISTS placings_athlete ON placings (category, athlete, season);
+            CREATE TABLE IF NOT EXISTS names (
+                athlete TEXT PRIMARY KEY,
+                last TEXT,
+                first TEXT,
+                nation TEXT
+            );
+            CREATE TABLE IF NOT EXISTS athlete_stats (
+                category TEXT NOT NULL, athlete TEXT NOT NULL, season INTEGER NOT NULL,
+                """ + counter_columns + """, best_rank INTEGER,
+                PRIMARY KEY (category, athlete, season)
+            );
+            CREATE TABLE IF NOT EXISTS nation_stats (
+                category TEXT NOT NULL, nation TEXT NOT NULL, season INTEGER NOT NULL,
+                """ + counter_columns + """,
+                PRIMARY KEY (category, nation, season)
+            );
+            CREATE TABLE IF NOT EXISTS season_stats (
+                category TEXT NOT NULL, season INTEGER NOT NULL,
+                competitions INTEGER NOT NULL, results INTEGER NOT NULL, athletes INTEGER NOT NULL,
+                PRIMARY KEY (category, season)
+            );
+            CREATE TABLE IF NOT EXISTS head_to_head (
+                category TEXT NOT NULL, athlete_a TEXT NOT NULL, athlete_b TEXT NOT NULL,
+                meetings INTEGER NOT NULL, a_ahead INTEGER NOT NULL, b_ahead INTEGER NOT NULL,
+                PRIMARY KEY (category, athlete_a, athlete_b)
+            );
+            CREATE TABLE IF NOT EXISTS ratings (
+                category TEXT NOT NULL, athlete TEXT NOT NULL,
+                rating REAL NOT NULL, competitions INTEGER NOT NULL, last_ended TEXT,
+                PRIMARY KEY (category, athlete)
+            );
+            CREATE TABLE IF NOT EXISTS rated (
+                category TEXT NOT NULL, competition TEXT NOT NULL, ended TEXT NOT NULL,
+                PRIMARY KEY (category, competition)
+            );
+        """)
+        self.db.commit()
+
+    def add_counters(self, table, key_columns, df, sign):
+        """
+        Add (sign 1) or subtract (sign -1) summed counters from a stats table
+        """
+        if len(df) == 0:
+            return
+
+        columns = key_columns + COUNTERS
+        updates = ', '.join(x + ' = ' + x + ' + excluded.' + x for x in COUNTERS)
+        values = df[columns].copy()
+        values[COUNTERS] = values[COUNTERS] * sign
+
+        self.db.executemany(
+            "INSERT INTO " + table + " (" + ', '.join(columns) + ") VALUES (" + ', '.join('?' * len(columns)) + ")"
+            " ON CONFLICT (" + ', '.join(key_columns) + ") DO UPDATE SET " + updates,
+            values.astype(object).itertuples(index=False, name=None))
+
+    def add_pairs(self, category, df, sign):
+        """
+        Add or subtract head to head counts
+        """
+        if len(df) == 0:
+            return
+
+        self.db.executemany("""
+            INSERT INTO head_to_head VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (category, athlete_a, athlete_b) DO UPDATE SET
+                meetings = meetings + excluded.meetings, a_ahead = a_ahead + excluded.a_ahead,
+                b_ahead = b_ahead + excluded.b_ahead
+            """, ((category, a, b, sign * m, sign * x, sign * y)
+                  for a, b, m, x, y in df[['athlete_a', 'athlete_b', 'meetings', 'a_ahead', 'b_ahead']]
+                  .astype(object).itertuples(index=False, name=None)))
+
+    def stored_placings(self, category, competitions=None):
+        """
+        Placings kept for a category, optionally only some competitions
+        """
+        query = "SELECT competition, ended, season, field, athlete, nation, rank FROM placings WHERE category = ?"
+        params = [category]
+        if competitions is not None:
+            query += " AND competition IN (SELECT value FROM json_each(?))"
+            params.append(pd.Series(list(competitions), dtype=object).to_json(orient='values'))
+
+        return pd.read_sql_query(query + " ORDER BY ended, competition, field, rank", self.db, params=params)
+
+    def update(self, category, df):
+        """
+        Bring the aggregates up to date with newly stored results
+        Every competition in df replaces what was counted for it before
+        input:
+            category - Result category
+            df - Every stored row of the competitions that were written, see update_partitions
+        output:
+            Number of placings counted
+        """
+        if df is None or len(df) == 0:
+            return 0
+
+        new = placings(df)
+        self.replace(category, df['Competition Title'].astype(str).unique(), new)
+
+        return len(new)
+
+    def remove(self, category, competitions):
+        """
+        Take competitions out of the aggregates
+        """
+        self.replace(category, competitions, None)
+
+    def replace(self, category, competitions, new):
+        """
+        Subtract what some competitions added before, then add their new placings
+        input:
+            category - Result category
+            competitions - Competition titles being replaced
+            new - DataFrame from placings(), None to only take the competitions out
+        """
+        old = self.stored_placings(category, competitions)
+        if new is None:
+            new = old.iloc[:0].assign(last=None, first=None)
+
+        # Take out what the old version of these competitions added, then add the new version
+        for places, sign in ((old, -1), (new, 1)):
+            if len(places) == 0:
+                continue
+            athletes = counters(places, ['athlete', 'season'])
+            athletes.insert(0, 'category', category)
+            self.add_counters('athlete_stats', ['category', 'athlete', 'season'], athletes, sign)
+
+            nations = counters(places, ['nation', 'season'])
+            nations.insert(0, 'category', category)
+            self.add_counters('nation_stats', ['category', 'nation', 'season'], nations, sign)
+
+            self.add_pairs(category, pairs(places, self.h2h_max_rank), sign)
+
+        self.db.execute("DELETE FROM placings WHERE category = ? AND competition IN (SELECT value FROM json_each(?))",
+                        (category, pd.Series(list(competitions), dtype=object).to_json(orient='values')))
+        self.db.executemany("INSERT INTO placings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            ((category,) + x for x in new[['competition', 'ended', 'season', 'field', 'athlete', 'nation', 'rank']]
+                             .astype(object).itertuples(index=False, name=None)))
+        self.db.executemany("INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)",
+                            new.drop_duplicates('athlete')[['athlete', 'last', 'first', 'nation']]
+                            .astype(object).where(lambda x: x.notna(), None).itertuples(index=False, name=None))
+
+        # Drop rows that went back to nothing
+        self.db.execute("DELETE FROM athlete_stats WHERE starts <= 0")
+        self.db.execute("DELETE FROM nation_stats WHERE starts <= 0")
+        self.db.execute("DELETE FROM head_to_head WHERE meetings <= 0")
+
+        self.refresh_seasons(category, set(old['season']) | set(new['season']))
+        self.refresh_best_ranks(category, set(old['athlete']) | set(new['athlete']))
+        self.update_ratings(category, new, set(old['competition']))
+
+        self.db.commit()
+
+    def refresh_seasons(self, category, seasons):
+        """
+        Recount the season table for some seasons, distinct athletes can't be added up
+        """
+        for season in seasons:
+            self.db.execute("DELETE FROM season_stats WHERE category = ? AND season = ?", (category, int(season)))
+            self.db.execute("""
+                INSERT INTO season_stats
+                SELECT category, season, COUNT(DISTINCT competition), COUNT(*), COUNT(DISTINCT athlete)
+                FROM placings WHERE category = ? AND season = ? GROUP BY category, season
+                """, (category, int(season)))
+
+    def refresh_best_ranks(self, category, athletes):
+        """
+        Best rank can't be subtracted either, look it up again for the athletes that changed
+        """
+        self.db.execute("""
+            UPDATE athlete_stats SET best_rank = (
+                SELECT MIN(rank) FROM placings p
+                WHERE p.category = athlete_stats.category AND p.athlete = athlete_stats.athlete
+                    AND p.season = athlete_stats.season)
+            WHERE category = ? AND athlete IN (SELECT value FROM json_each(?))
+            """, (category, pd.Series(list(athletes), dtype=object).to_json(orient='values')))
+
+    def update_ratings(self, category, new, replaced):
+        """
+        Apply new competitions to the Elo ratings, in date order
+        Ratings depend on the order competitions happened in, so if a competition that was
+        already rated changed, or one is older than the last rated competition, the category's
+        ratings are recomputed from the stored placings
+        input:
+            category - Result category
+            new - Placings that were just added
+            replaced - Competitions that had been counted before
+        """
+        rated = {x[0]: x[1] for x in self.db.execute("SELECT competition, ended FROM rated WHERE category = ?", (category,))}
+        latest = max(((x[1], x[0]) for x in rated.items()), default=None)
+        earliest = min(zip(new['ended'], new['competition']), default=None)
+
+        if (replaced & set(rated)) or (latest is not None and earliest is not None and earliest < latest):
+            self.db.execute("DELETE FROM ratings WHERE category = ?", (category,))
+            self.db.execute("DELETE FROM rated WHERE category = ?", (category,))
+            new = self.stored_placings(category)
+
+        if len(new) == 0:
+            return
+
+        current = {x[0]: (x[1], x[2]) for x in
+                   self.db.execute("SELECT athlete, rating, competitions FROM ratings WHERE category = ?", (category,))}
+        changed = {}
+        last_ended = {}
+
+        new = new.sort_values(['ended', 'competition', 'field', 'rank'], kind='stable')
+        for (ended, competition, _), field in new.groupby(['ended', 'competition', 'field'], sort=False):
+            athletes = field['athlete'].to_numpy()
+            ratings = np.array([current.get(x, (self.initial_rating, 0))[0] for x in athletes], dtype=float)
+
+            for athlete, rating in zip(athletes, ratings + elo_changes(ratings, field['rank'].to_numpy(dtype=float), self.k)):
+                current[athlete] = (rating, current.get(athlete, (0, 0))[1] + 1)
+                changed[athlete] = True
+                last_ended[athlete] = ended
+
+        self.db.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?)",
+                            ((category, x, float(current[x][0]), int(current[x][1]), last_ended[x]) for x in changed))
+        self.db.executemany("INSERT OR REPLACE INTO rated VALUES (?, ?, ?)",
+                            ((category,) + x for x in new[['competition', 'ended']].drop_duplicates()
+                             .itertuples(index=False, name=None)))
+
+    def update_partitions(self, store, entries):
+        """
+        Update from the partitions a PartitionedStore has just written
+        input:
+            store - PartitionedStore the partitions are in
+            entries - Manifest entries returned by PartitionedStore.append
+        output:
+            Number of placings counted
+        """
+        frames = {}
+        for entry in entries:
+            frames.setdefault(entry['category'], []).append(
+                pd.read_parquet(os.path.join(store.root, entry['path']), columns=SOURCE_COLUMNS))
+
+        count = 0
+        for category, parts in frames.items():
+            count += self.update(category, pd.concat(parts, ignore_index=True))
+
+        self.prune(store)
+
+        return count
+
+    def prune(self, store):
+        """
+        Take out competitions whose partitions are no longer in the store, e.g. replaced by a
+        partition under another spelling of the title
+        """
+        stale = [x for x in self.db.execute("SELECT DISTINCT category, competition FROM placings").fetchall()
+                 if x not in store.manifest]
+
+        for category, competition in stale:
+            self.remove(category, [competition])
+
+    def build(self, store, categories=None):
+        """
+        Compute every table from scratch from what is in the store
+        input:
+            store - PartitionedStore to read
+            categories - Categories to build, None for all of them
+        output:
+            Number of placings counted
+        """
+        categories = sorted({x[0] for x in store.manifest}) if categories is None else categories
+        for table in ('placings', 'athlete_stats', 'nation_stats', 'season_stats', 'head_to_head', 'ratings', 'rated'):
+            self.db.executemany("DELETE FROM " + table + " WHERE category = ?", [(x,) for x in categories])
+        self.db.commit()
+
+        count = 0
+        for category in categories:
+            df = store.load(category, columns=SOURCE_COLUMNS)
+            count += self.update(category, df)
+
+        return count
+
+    def athlete_table(self, category, season=None):
+        """
+        Per athlete stats, for one season or summed over every season
+        output:
+            DataFrame with a row per athlete, most wins first
+        """
+        where = "s.category = ?" + (" AND s.season = ?" if season is not None else "")
+        params = [category] + ([int(season)] if season is not None else [])
+
+        return pd.read_sql_query("""
+            SELECT s.athlete, n.last, n.first, n.nation, SUM(s.starts) AS starts, SUM(s.wins) AS wins,
+                SUM(s.podiums) AS podiums, SUM(s.top8) AS top8, MIN(s.best_rank) AS best_rank,
+                1.0 * SUM(s.rank_sum) / SUM(s.starts) AS mean_rank
+            FROM athlete_stats s LEFT JOIN names n ON n.athlete = s.athlete
+            WHERE """ + where + """
+            GROUP BY s.athlete ORDER BY wins DESC, podiums DESC, mean_rank
+            """, self.db, params=params)
+
+    def nation_table(self, category, season=None):
+        """
+        Per nation stats, for one season or summed over every season
+        output:
+            DataFrame with a row per nation, most wins first
+        """
+        where = "category = ?" + (" AND season = ?" if season is not None else "")
+        params = [category] + ([int(season)] if season is not None else [])
+
+        return pd.read_sql_query("""
+            SELECT nation, SUM(starts) AS starts, SUM(wins) AS wins, SUM(podiums) AS podiums, SUM(top8) AS top8,
+                1.0 * SUM(rank_sum) / SUM(starts) AS mean_rank
+            FROM nation_stats WHERE """ + where + """
+            GROUP BY nation ORDER BY wins DESC, podiums DESC, mean_rank
+            """, self.db, params=params)
+
+    def season_table(self, category):
+        """
+        Competitions, results, and distinct athletes per season
+        """
+        return pd.read_sql_query("SELECT season, competitions, results, athletes FROM season_stats"
+                                 " WHERE category = ? ORDER BY season", self.db, params=[category])
+
+    def head_to_head(self, category, athlete, other):
+        """
+        Record of two athletes against each other
+        input:
+            category - Result category
+            athlete, other - Athlete keys, see athletes.athlete_key
+        output:
+            (meetings, times athlete placed ahead, times other placed ahead)
+        """
+        a, b = sorted((athlete, other))
+        row = self.db.execute("SELECT meetings, a_ahead, b_ahead FROM head_to_head"
+                              " WHERE category = ? AND athlete_a = ? AND athlete_b = ?", (category, a, b)).fetchone()
+        if row is None:
+            return 0, 0, 0
+
+        return (row[0], row[1], row[2]) if a == athlete else (row[0], row[2], row[1])
+
+    def ratings(self, category, limit=None):
+        """
+        Current Elo ratings, highest first
+        """
+        query = """
+            SELECT r.athlete, n.last, n.first, n.nation, r.rating, r.competitions, r.last_ended
+            FROM ratings r LEFT JOIN names n ON n.athlete = r.athlete
+            WHERE r.category = ? ORDER BY r.rating DESC"""
+        params = [category]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+
+        return pd.read_sql_query(query, self.db, params=params)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,247 @@
+import os
+import sqlite3
+import unicodedata
+import pandas as pd
+
+# Where the athlete index is kept unless told otherwise
+DEFAULT_ATHLETE_INDEX_PATH = '~/projects/ifsc-scraper/data/athletes.sqlite'
+
+
+def normalize_names(names):
+    """
+    Normalize a column of names so spelling variants of the same athlete match:
+    accents removed, lower case, whitespace collapsed
+    input:
+        names - Series of strings
+    output:
+        Series of normalized strings, '' for missing values
+    """
+    names = names.astype(object)
+
+    return (names.where(names.notna(), '').astype(str)
+            .str.normalize('NFKD')
+            .str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower()
+            .str.split().str.join(' '))
+
+
+def athlete_keys(df):
+    """
+    Normalized identity of the athlete on every row of a results df
+    input:
+        df - pandas dataframe with LAST, FIRST, and Nation columns
+    output:
+        Series of 'last|first|nation' keys
+    """
+    return normalize_names(df['LAST']) + '|' + normalize_names(df['FIRST']) + '|' + normalize_names(df['Nation'])
+
+
+def normalize_name(name):
+    """
+    Normalize a single name the same way as normalize_names, without going through pandas
+    """
+    if name is None:
+        return ''
+
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+
+    return ' '.join(text.lower().split())
+
+
+def athlete_key(last, first, nation):
+    """
+    Normalized identity of a single athlete, see athlete_keys
+    """
+    return normalize_name(last) + '|' + normalize_name(first) + '|' + normalize_name(nation)
+
+
+class AthleteIndex():
+    """
+    Persistent index from athletes to the rows holding their results in the PartitionedStore
+    Locations are (category, competition, row within that competition's partition), which
+    stay valid as other competitions are added, so the index is updated one partition at a time
+    """
+
+    def __init__(self, path=DEFAULT_ATHLETE_INDEX_PATH):
+        """
+        input:
+            path - Path of the sqlite database
+        """
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS athletes (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                last TEXT,
+                first TEXT,
+                nation TEXT
+            );
+            CREATE INDEX IF NOT EXISTS athletes_nation ON athletes (nation);
+            CREATE TABLE IF NOT EXISTS entries (
+                athlete INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                competition TEXT NOT NULL,
+                row INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_athlete ON entries (athlete);
+            CREATE INDEX IF NOT EXISTS entries_partition ON entries (category, competition);
+        """)
+        self.db.commit()
+
+    def update(self, category, df):
+        """
+        Index the rows of newly stored results, replacing the entries of any competition in df
+        Rows are numbered per competition in the same order PartitionedStore.append writes them
+        input:
+            category - Result category
+            df - Results as passed to PartitionedStore.append
+        output:
+            Number of rows indexed
+        """
+        if df is None or len(df) == 0:
+            return 0
+
+        df = df[['Competition Title', 'LAST', 'FIRST', 'Nation']].copy()
+        df['Competition Title'] = df['Competition Title'].astype(str)
+        df['key'] = athlete_keys(df)
+        df['row'] = df.groupby('Competition Title', sort=False).cumcount()
+
+        # Nation is kept normalized too so nation lookups don't depend on case
+        athletes = df.drop_duplicates('key')
+        nations = normalize_names(athletes['Nation'])
+        self.db.executemany("INSERT OR IGNORE INTO athletes (key, last, first, nation) VALUES (?, ?, ?, ?)",
+                            zip(athletes['key'], athletes['LAST'].astype(object), athletes['FIRST'].astype(object),
+                                nations))
+
+        ids = dict(self.db.execute("SELECT key, id FROM athletes WHERE key IN (SELECT value FROM json_each(?))",
+                                   (athletes['key'].to_json(orient='values'),)))
+
+        competitions = df['Competition Title']
+        self.db.executemany("DELETE FROM entries WHERE category = ? AND competition = ?",
+                            [(category, x) for x in competitions.unique()])
+        self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                            zip(df['key'].map(ids), [category] * len(df), competitions, df['row'].astype(int)))
+        self.db.commit()
+
+        return len(df)
+
+    def build(self, store):
+        """
+        Rebuild the whole index from a PartitionedStore
+        input:
+            store - PartitionedStore to index
+        output:
+            Number of rows indexed
+        """
+        self.db.execute("DELETE FROM entries")
+        self.db.execute("DELETE FROM athletes")
+
+        count = 0
+        for entry in store.partitions():
+            df = pd.read_parquet(os.path.join(store.root, entry['path']),
+                                 columns=['Competition Title', 'LAST', 'FIRST', 'Nation'])
+            count += self.update(entry['category'], df)
+
+        return count
+
+    def update_partitions(self, store, entries):
+        """
+        Index partitions a store has just written, and forget partitions it no longer has
+        Reads the rows back from the partitions, since the store drops duplicate rows
+        input:
+            store - PartitionedStore the partitions are in
+            entries - Manifest entries returned by PartitionedStore.append
+        output:
+            Number of rows indexed
+        """
+        count = 0
+        for entry in entries:
+            df = pd.read_parquet(os.path.join(store.root, entry['path']),
+                                 columns=['Competition Title', 'LAST', 'FIRST', 'Nation'])
+            count += self.update(entry['category'], df)
+
+        # Partitions replaced by one stored under another spelling of the title
+        stale = [x for x in self.db.execute("SELECT DISTINCT category, competition FROM entries").fetchall()
+                 if x not in store.manifest]
+        if stale:
+            self.db.executemany("DELETE FROM entries WHERE category = ? AND competition = ?", stale)
+            self.db.commit()
+
+        return count
+
+    def find(self, last, first, nation=None):
+        """
+        Athletes matching a name, optionally limited to one nation
+        input:
+            last, first - Athlete name, matched after normalizing
+            nation - Nation code, None for any
+        output:
+            List of (id, last, first, nation) touples
+        """
+        if nation is not None:
+            key = athlete_key(last, first, nation)
+            return self.db.execute("SELECT id, last, first, nation FROM athletes WHERE key = ?", (key,)).fetchall()
+
+        prefix = athlete_key(last, first, '')
+        return self.db.execute("SELECT id, last, first, nation FROM athletes WHERE key >= ? AND key < ?",
+                               (prefix, prefix + '\uffff')).fetchall()
+
+    def nation(self, nation):
+        """
+        Every athlete of a nation
+        output:
+            List of (id, last, first, nation) touples
+        """
+        return self.db.execute("SELECT id, last, first, nation FROM athletes WHERE nation = ?",
+                               (normalize_name(nation),)).fetchall()
+
+    def locations(self, athlete_ids, category=None):
+        """
+        Where the results of some athletes are stored
+        input:
+            athlete_ids - Iterable of athlete ids from find() or nation()
+            category - Only this category, None for all
+        output:
+            List of (category, competition, row) touples
+        """
+        ids = [x[0] if isinstance(x, tuple) else x for x in athlete_ids]
+        marks = ','.join('?' * len(ids))
+        query = "SELECT category, competition, row FROM entries WHERE athlete IN (" + marks + ")"
+        params = list(ids)
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+
+        return self.db.execute(query + " ORDER BY category, competition, row", params).fetchall()
+
+    def history(self, store, last, first, nation=None, category=None):
+        """
+        Every result of an athlete, reading only the partitions that hold them
+        input:
+            store - PartitionedStore the index was built from
+            last, first, nation - Athlete, see find()
+            category - Only this category, None for all
+        output:
+            Dict of category to DataFrame of that athlete's results
+        """
+        locations = self.locations(self.find(last, first, nation), category)
+
+        rows = {}
+        for cat, competition, row in locations:
+            rows.setdefault((cat, competition), []).append(row)
+
+        frames = {}
+        for (cat, competition), positions in rows.items():
+            entry = store.manifest.get((cat, competition))
+            if entry is None:
+                continue
+            part = pd.read_parquet(os.path.join(store.root, entry['path']))
+            frames.setdefault(cat, []).append(part.iloc[positions])
+
+        return {cat: pd.concat(x, ignore_index=True) for cat, x in frames.items()}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+from storage import CATEGORIES, PartitionedStore, season_of
+from athletes import AthleteIndex, normalize_name
+from aggregates import AggregateStore
+from ledger import ScrapeLedger
+from workqueue import worker_name
+from distributed import renew_lease
+
+# Where the backfill plan is kept unless told otherwise, so an interrupted backfill picks up where it left off
+DEFAULT_PLAN_PATH = '~/projects/ifsc-scraper/data/backfill.sqlite'
+
+# Where the coverage report is written unless told otherwise
+DEFAULT_REPORT_PATH = '~/projects/ifsc-scraper/data/backfill-report.json'
+
+
+def parse_seasons(text):
+    """
+    Read a season range from the command line
+    input:
+        text - e.g. '2010-2019', '2015,2017', or '2019'
+    output:
+        Sorted list of years
+    """
+    seasons = set()
+    for part in str(text).split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-', 1)
+            seasons.update(range(int(first), int(last) + 1))
+        elif part:
+            seasons.add(int(part))
+
+    return sorted(seasons)
+
+
+def enumerate_comps(scraper, seasons):
+    """
+    List the competitions of every season, once each
+    The page of a season can also list competitions of neighbouring seasons, those are kept
+    under the season their date belongs to
+    That the page picks its season from SEASON_FRAGMENT is an assumption that hasn't been checked
+    against the live site. If it doesn't, every season gets the default page, so a season whose
+    page lists none of its own competitions is warned about instead of silently left out
+    input:
+        scraper - IFSCScraper used to read the last result pages
+        seasons - List of years
+    output:
+        List of (season, (comp name, date, link)) touples
+    """
+    seen = set()
+    comps = []
+    for season in seasons:
+        listed = scraper.get_comp_links(season)
+        if not any(season_of(x[1], x[0]) == season for x in listed):
+            print('Warning: the page for season ' + str(season) + ' lists no comps dated in ' + str(season)
+                  + ', the site may be ignoring the season in the url (see scraper.SEASON_FRAGMENT)')
+
+        for comp in listed:
+            # The same comp can be listed under several seasons, or twice with different whitespace
+            key = normalize_name(comp[0])
+            if key in seen or comp[2] in seen:
+                continue
+            seen.update((key, comp[2]))
+
+            comp_season = season_of(comp[1], comp[0])
+            comps.append((season if comp_season is None else comp_season, comp))
+
+    return [x for x in comps if x[0] in seasons]
+
+
+def plan(scraper, queue, seasons, disciplines=None, only_new=True):
+    """
+    Build the work plan: one queue item per competition in the seasons that still needs scraping
+    Comps the ledger says are complete, or that an earlier plan finished for the same disciplines,
+    are left out, and comps already waiting in the plan aren't added twice, so planning again
+    after an interruption only adds what is new
+    input:
+        scraper - IFSCScraper used to read the last result pages
+        queue - WorkQueue the plan is kept in
+        seasons - List of years
+        disciplines - Categories to scrape, None for all of them
+        only_new - Leave out comps that are already complete
+    output:
+        Dict of how many comps were found, were already complete, and were added to the plan
+    """
+    if scraper.ledger is None:
+        scraper.ledger = ScrapeLedger()
+
+    disciplines = list(CATEGORIES) if disciplines is None else list(disciplines)
+    comps = enumerate_comps(scraper, seasons)
+
+    # Comps an earlier backfill already finished for these disciplines
+    finished = {key for key, payload, status, _ in queue.items()
+                if status == 'merged' and set(disciplines) <= set(payload['disciplines'])}
+
+    counts = {'found': len(comps), 'complete': 0, 'planned': 0}
+    for season, comp in comps:
+        if only_new and (comp[2] in finished or scraper.ledger.is_complete(comp[0])):
+            counts['complete'] += 1
+            continue
+
+        counts['planned'] += queue.push(comp[2], {'comp': list(comp), 'season': season, 'disciplines': disciplines})
+
+    return counts
+
+
+def keep_disciplines(scraper, comp, disciplines):
+    """
+    Drop the subcategories of a comp that aren't in the requested disciplines
+    """
+    subcats = []
+    for subcat in comp[3:]:
+        index, _ = scraper.category_of(subcat[0][:-16])
+        if index is not None and CATEGORIES[index] in disciplines:
+            subcats.append(tuple(subcat))
+
+    return tuple(comp[:3]) + tuple(subcats)
+
+
+def execute(scraper, queue, concurrency=4, worker=None, max_items=None, only_new=True):
+    """
+    Work through the plan a few comps at a time, saving each round's results before the next
+    At most concurrency comps are leased and scraped at once, their pages go through the
+    scraper's browser pool or http fetcher and scheduler, so the site never sees more than that.
+    Leases are renewed while the comps are scraped, and a comp with pages that failed every
+    retry goes back into the plan
+    input:
+        scraper - IFSCScraper to scrape with
+        queue - WorkQueue holding the plan
+        concurrency - Number of comps scraped at the same time
+        worker - Name of this process in the queue, defaults to the host name and process id
+        max_items - Stop after this many comps, None to finish the plan
+        only_new - Skip the subcategories the ledger says are complete, turn off to scrape everything planned again
+    output:
+        List of categories that had results saved
+    """
+    worker = worker_name() if worker is None else worker
+
+    if scraper.ledger is None:
+        scraper.ledger = ScrapeLedger()
+    if scraper.store is None:
+        scraper.store = PartitionedStore()
+    if scraper.athletes is None:
+        scraper.athletes = AthleteIndex()
+    if scraper.aggregates is None:
+        scraper.aggregates = AggregateStore()
+    scraper.only_new = only_new
+
+    changed = set()
+    completed = 0
+    while max_items is None or completed < max_items:
+        # Lease the next round of comps
+        leased = []
+        while len(leased) < concurrency:
+            item = queue.lease(worker)
+            if item is None:
+                break
+            leased.append(item)
+        if not leased:
+            break
+
+        stop = threading.Event()
+        heartbeats = [threading.Thread(target=renew_lease, args=(queue, x[0], worker, stop), daemon=True) for x in leased]
+        for heartbeat in heartbeats:
+            heartbeat.start()
+
+        try:
+            comps = scraper.get_complete_result_links([tuple(x[1]['comp']) for x in leased])
+            comps = [keep_disciplines(scraper, comp, payload['disciplines']) for comp, (_, payload) in zip(comps, leased)]
+
+            # Results are saved per category and comp, like scrape() does. A category that lost
+            # some of its pages is left out of the batch so its stored partition isn't replaced
+            # with part of it, and is written whole when its comp is retried
+            entries = scraper.save_results(scraper.make_df_from_data(scraper.get_sub_comp_info(comps)))
+            changed.update(x['category'] for x in entries)
+            scraper.record_saved(comps)
+
+            # Pages that failed every retry send their comp back into the plan
+            owners = {}
+            for i, comp in enumerate(comps):
+                owners[comp[2]] = i
+                owners.update((subcat[1], i) for subcat in comp[3:])
+            failed_comps = {}
+            for link, error in scraper.scheduler.requeue().items():
+                if link in owners:
+                    failed_comps.setdefault(owners[link], []).append(str(error))
+
+            for i, (item_id, payload) in enumerate(leased):
+                if i in failed_comps:
+                    queue.fail(item_id, worker, str(len(failed_comps[i])) + ' pages failed: ' + failed_comps[i][0])
+                elif queue.complete(item_id, worker, {'title': comps[i][0], 'subcategories': len(comps[i]) - 3}):
+                    queue.mark_merged([item_id])
+                    completed += 1
+        except Exception as e:
+            print('Failed to backfill ' + ', '.join(x[1]['comp'][0] for x in leased) + ': ' + repr(e))
+            for item_id, _ in leased:
+                queue.fail(item_id, worker, repr(e))
+        finally:
+            stop.set()
+            for heartbeat in heartbeats:
+                heartbeat.join()
+
+        print(str(completed) + ' comps backfilled, ' + str(queue.remaining()) + ' left')
+
+    return [x for x in CATEGORIES if x in changed]
+
+
+def coverage(queue, store, seasons, disciplines=None):
+    """
+    Report what the backfill has covered and what is still missing
+    input:
+        queue - WorkQueue holding the plan
+        store - PartitionedStore the results were saved to
+        seasons - List of years the backfill was for
+        disciplines - Categories the backfill was for, None for all of them
+    output:
+        Dict with per season plan status counts, stored partitions and rows per season and
+        discipline, and the gaps: comps not done yet, and season and discipline pairs with nothing stored
+    """
+    disciplines = list(CATEGORIES) if disciplines is None else list(disciplines)
+
+    plan_status = {str(x): {} for x in seasons}
+    gaps = []
+    for key, payload, status, error in queue.items():
+        season = str(payload['season'])
+        if season not in plan_status:
+            continue
+        plan_status[season][status] = plan_status[season].get(status, 0) + 1
+        if status != 'merged':
+            gaps.append({'season': payload['season'], 'competition': payload['comp'][0], 'link': key,
+                         'status': status, 'error': error})
+
+    stored = {str(x): {y: {'competitions': 0, 'rows': 0} for y in disciplines} for x in seasons}
+    for entry in store.partitions(seasons=seasons):
+        if entry['category'] in disciplines:
+            cell = stored[str(entry['season'])][entry['category']]
+            cell['competitions'] += 1
+            cell['rows'] += entry['rows']
+
+    empty = [{'season': int(season), 'discipline': category}
+             for season, categories in stored.items() for category, cell in categories.items()
+             if cell['competitions'] == 0]
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'seasons': seasons,
+        'disciplines': disciplines,
+        'plan': plan_status,
+        'stored': stored,
+        'missing_competitions': gaps,
+        'empty_seasons': empty,
+    }
+
+
+def write_report(report, path=DEFAULT_REPORT_PATH):
+    """
+    Save a coverage report as json
+    output:
+        Path written
+    """
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    return path
+
+
+def print_report(report):
+    """
+    Print a coverage report as a season by discipline table of stored competitions, then the gaps
+    """
+    print('season  ' + ''.join(x.rjust(10) for x in report['disciplines']) + '   planned: done/left/failed')
+    for season in report['seasons']:
+        stored = report['stored'][str(season)]
+        status = report['plan'][str(season)]
+        left = status.get('pending', 0) + status.get('leased', 0) + status.get('done', 0)
+        print(str(season).ljust(8) + ''.join(str(stored[x]['competitions']).rjust(10) for x in report['disciplines'])
+              + '   ' + str(status.get('merged', 0)) + '/' + str(left) + '/' + str(status.get('failed', 0)))
+
+    for gap in report['missing_competitions']:
+        print('missing: ' + str(gap['season']) + ' ' + gap['competition'] + ' (' + gap['status']
+              + (', ' + gap['error'] if gap['error'] else '') + ')')
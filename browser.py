@@ -0,0 +1,137 @@
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Requests the scraper never needs: images, fonts, media, stylesheets, and trackers
+# The results are rendered by the site's scripts, so scripts are always allowed
+DEFAULT_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.webp', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3',
+    '*.css',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+    '*facebook.com/tr*', '*hotjar.com*', '*youtube.com*',
+]
+
+# Chrome content settings, 2 = block
+BLOCKED_CONTENT = ['images', 'media_stream', 'notifications', 'geolocation']
+
+
+class BrowserProfile():
+    """
+    Settings for the Chrome instances the scraper launches, and when to replace them
+    Browsers run headless in incognito with non-essential resources blocked, and are recycled
+    after a number of pages or once they use too much memory, so long runs stay within a
+    fixed memory budget
+    """
+
+    def __init__(self, headless=True, incognito=True, blocked_urls=DEFAULT_BLOCKED_URLS, recycle_pages=200,
+                 max_memory_mb=1024, window_size=(1280, 1024)):
+        """
+        input:
+            headless - Run Chrome without a window
+            incognito - Run Chrome in incognito mode
+            blocked_urls - Url patterns that are never loaded, None or [] to load everything
+            recycle_pages - Replace the browser after loading this many pages, None to never recycle on count
+            max_memory_mb - Replace the browser once it uses more than this many MB, None to never recycle on memory
+                            Measured over all of Chrome's processes if psutil is installed, otherwise
+                            from the page's javascript heap
+            window_size - Width and height of the browser window
+        """
+        self.headless = headless
+        self.incognito = incognito
+        self.blocked_urls = list(blocked_urls) if blocked_urls else []
+        self.recycle_pages = recycle_pages
+        self.max_memory_mb = max_memory_mb
+        self.window_size = window_size
+
+    def options(self):
+        """
+        Chrome options for this profile
+        """
+        option = webdriver.ChromeOptions()
+
+        if self.incognito:
+            option.add_argument('--incognito')
+        if self.headless:
+            option.add_argument('--headless=new')
+        option.add_argument('--window-size=' + str(self.window_size[0]) + ',' + str(self.window_size[1]))
+
+        # Things a scraper has no use for
+        option.add_argument('--disable-extensions')
+        option.add_argument('--disable-gpu')
+        option.add_argument('--disable-dev-shm-usage')
+        option.add_argument('--mute-audio')
+        option.add_argument('--no-first-run')
+
+        if self.blocked_urls:
+            option.add_experimental_option('prefs', {
+                'profile.managed_default_content_settings.' + x: 2 for x in BLOCKED_CONTENT
+            })
+
+        return option
+
+    def launch(self):
+        """
+        Start a new Chrome instance with this profile
+        output:
+            Selenium webdriver
+        """
+        browser = webdriver.Chrome(options=self.options())
+
+        # Content settings only cover some resource types, block the rest by url
+        if self.blocked_urls:
+            try:
+                browser.execute_cdp_cmd('Network.enable', {})
+                browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_urls})
+            except (AttributeError, WebDriverException) as e:
+                print('Could not block resources: ' + str(e).strip())
+
+        return browser
+
+    def memory_mb(self, browser):
+        """
+        Memory used by a browser
+        input:
+            browser - Selenium webdriver launched by this profile
+        output:
+            MB used, None if it can't be measured
+        """
+        if psutil is not None:
+            try:
+                # chromedriver starts Chrome, which starts a process per renderer
+                driver = psutil.Process(browser.service.process.pid)
+                processes = driver.children(recursive=True)
+                return sum(x.memory_info().rss for x in processes) / 2 ** 20
+            except (AttributeError, psutil.Error):
+                pass
+
+        try:
+            used = browser.execute_script('return window.performance.memory && window.performance.memory.usedJSHeapSize')
+        except WebDriverException:
+            return None
+
+        return used / 2 ** 20 if used else None
+
+    def needs_recycle(self, browser, pages):
+        """
+        Check whether a browser should be replaced before loading another page
+        input:
+            browser - Selenium webdriver
+            pages - Pages loaded since the browser was launched
+        output:
+            Reason to recycle ('pages' or 'memory'), None to keep using it
+        """
+        if self.recycle_pages is not None and pages >= self.recycle_pages:
+            return 'pages'
+
+        if self.max_memory_mb is not None and pages > 0:
+            used = self.memory_mb(browser)
+            if used is not None and used > self.max_memory_mb:
+                return 'memory'
+
+        return None
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Where page snapshots are kept unless told otherwise
+DEFAULT_CACHE_DIR = '~/projects/ifsc-scraper/data/cache'
+
+
+class PageCache():
+    """
+    On-disk cache of raw page html keyed by the full url, including the #!comp= fragment
+    Page bodies are stored once per distinct content (named by their sha256) and a small
+    sqlite index maps urls to them, so identical snapshots of a page share storage
+    Entries expire after a time to live and the least recently used are evicted once the
+    cache grows past its size limit
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=None, max_bytes=None):
+        """
+        input:
+            directory - Directory holding the index and page bodies
+            ttl - Seconds an entry stays valid, None keeps entries forever
+            max_bytes - Total size of stored page bodies to keep, None for no limit
+        """
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+
+        # Pooled workers share one cache, so every index access goes through this lock
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self.db.commit()
+
+    def object_path(self, digest):
+        """
+        Path of the file holding the page body with this digest
+        """
+        return os.path.join(self.directory, 'objects', digest[:2], digest + '.html')
+
+    def get(self, url, expire=True):
+        """
+        Look up the cached html for a url
+        input:
+            url - Full page url
+            expire - Treat entries older than the ttl as missing
+        output:
+            html string, or None if the page isn't cached
+        """
+        with self.lock:
+            row = self.db.execute("SELECT digest, stored_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+
+            digest, stored_at = row
+            if expire and self.ttl is not None and time.time() - stored_at > self.ttl:
+                self.remove(url)
+                return None
+
+            try:
+                with open(self.object_path(digest), encoding='utf-8') as f:
+                    html = f.read()
+            except FileNotFoundError:
+                self.remove(url)
+                return None
+
+            self.db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+
+            return html
+
+    def put(self, url, html):
+        """
+        Store the html for a url, replacing any older snapshot
+        input:
+            url - Full page url
+            html - Page html
+        output:
+            sha256 digest the html was stored under
+        """
+        with self.lock:
+            body = html.encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()
+            path = self.object_path(digest)
+
+            # Content is already stored if another url (or an older snapshot) had the same body
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = path + '.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+
+            old = self.db.execute("SELECT digest FROM pages WHERE url = ?", (url,)).fetchone()
+
+            now = time.time()
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url, digest, len(body), now, now))
+            self.db.commit()
+
+            if old is not None and old[0] != digest:
+                self.release(old[0])
+
+            if self.max_bytes is not None:
+                self.evict()
+
+            return digest
+
+    def remove(self, url):
+        """
+        Drop the entry for a url
+        """
+        with self.lock:
+            row = self.db.execute("SELECT digest FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+
+            self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self.db.commit()
+            self.release(row[0])
+
+    def release(self, digest):
+        """
+        Delete a page body once no url refers to it any more
+        output:
+            True if the body is no longer stored
+        """
+        in_use = self.db.execute("SELECT 1 FROM pages WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        if in_use is None:
+            try:
+                os.remove(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+
+        return in_use is None
+
+    def total_bytes(self):
+        """
+        Size of all distinct page bodies in the cache
+        """
+        row = self.db.execute("SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM pages)").fetchone()
+
+        return row[0] or 0
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used ones until the cache fits in max_bytes
+        input:
+            N/A
+        output:
+            Number of entries removed
+        """
+        with self.lock:
+            removed = 0
+
+            if self.ttl is not None:
+                expired = self.db.execute("SELECT url FROM pages WHERE stored_at < ?",
+                                          (time.time() - self.ttl,)).fetchall()
+                for (url,) in expired:
+                    self.remove(url)
+                removed += len(expired)
+
+            if self.max_bytes is not None:
+                # Sizes are summed once and each freed body is taken off the running total
+                total = self.total_bytes()
+                while total > self.max_bytes:
+                    # Oldest entries a small batch at a time, straight off the accessed_at index
+                    oldest = self.db.execute("SELECT url, digest, size FROM pages ORDER BY accessed_at LIMIT 64").fetchall()
+                    if not oldest:
+                        break
+
+                    for url, digest, size in oldest:
+                        if total <= self.max_bytes:
+                            break
+                        self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+                        removed += 1
+
+                        # A body another url still refers to stays on disk and still counts
+                        if self.release(digest):
+                            total -= size
+                    self.db.commit()
+
+            return removed
+
+    def urls(self):
+        """
+        Every url with a cached snapshot
+        """
+        with self.lock:
+            return [x[0] for x in self.db.execute("SELECT url FROM pages ORDER BY url")]
+
+    def __contains__(self, url):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self.db.close()
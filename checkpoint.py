@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from results import ResultPage
+
+# Where the checkpoint of an unfinished run is kept unless told otherwise
+DEFAULT_CHECKPOINT_PATH = '~/projects/ifsc-scraper/data/checkpoint.jsonl'
+
+
+class CheckpointLog():
+    """
+    Append-only log of work finished during a scrape run
+    Each competition's subcategory links and each extracted result page is written (and
+    fsynced) as soon as it is done, so a crashed run can be restarted without loading those
+    pages again. Pages are marked saved once their results are in the store, and the log is
+    cleared when the run finishes
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH):
+        """
+        input:
+            path - Path of the json lines log
+        """
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+
+        # link of a competition page -> comp tuple with subcategory links
+        self.comps = {}
+        # link of a complete result page -> (category index, ResultPage)
+        self.pages = {}
+
+        if os.path.exists(self.path):
+            self.read()
+
+    def read(self):
+        """
+        Load the records of a previous run
+        """
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line was cut off by a crash, everything before it is still good
+                    break
+
+                if record['type'] == 'comp':
+                    self.comps[record['link']] = tuple(record['comp'][:3]) + tuple(tuple(x) for x in record['comp'][3:])
+                elif record['type'] == 'page':
+                    self.pages[record['link']] = (record['category'], ResultPage.from_record(record['page']))
+                elif record['type'] == 'saved':
+                    for link in record['links']:
+                        self.pages.pop(link, None)
+
+    def write(self, record):
+        """
+        Durably append a record to the log
+        """
+        line = json.dumps(record) + '\n'
+
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add_comp(self, comp):
+        """
+        Record a competition together with its subcategory links
+        input:
+            comp - Touple of comp name, date, link, followed by (subcategory name, url) touples
+        output:
+            N/A
+        """
+        self.comps[comp[2]] = comp
+        self.write({'type': 'comp', 'link': comp[2], 'comp': list(comp)})
+
+    def add_page(self, link, category, page):
+        """
+        Record the results extracted from one complete result page
+        input:
+            link - Link of the complete result page
+            category - Index of the category list the page belongs to (lead, speed, boulder, combined)
+            page - ResultPage returned by get_data_on_page
+        output:
+            N/A
+        """
+        self.pages[link] = (category, page)
+        self.write({'type': 'page', 'link': link, 'category': category, 'page': page.to_record()})
+
+    def mark_saved(self, links):
+        """
+        Record that the results of some pages are in the store, so they are no longer kept in
+        memory and aren't restored if the run is resumed
+        input:
+            links - Links of complete result pages whose results were saved
+        output:
+            N/A
+        """
+        links = [x for x in links if x in self.pages]
+        if not links:
+            return
+
+        for link in links:
+            self.pages.pop(link, None)
+        self.write({'type': 'saved', 'links': links})
+
+    def unsaved_links(self, comp_link):
+        """
+        Pages of a competition whose results were extracted but not saved yet
+        input:
+            comp_link - Link of the competition page
+        output:
+            Set of complete result page links
+        """
+        comp = self.comps.get(comp_link, ())
+
+        return {subcat[1] for subcat in comp[3:] if subcat[1] in self.pages}
+
+    def clear(self):
+        """
+        Forget everything, called once a run's results have been saved
+        """
+        with self.lock:
+            self.comps = {}
+            self.pages = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
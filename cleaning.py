@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# Header variants the IFSC site has used for each round, per category
+# Each canonical round name maps to the headers that get merged into it, in the order their
+# values are joined. Rounds are consolidated in the order listed
+ALIASES = {
+    'lead': {
+        'Semifinal': ['1/2 Final', 'Semi-Final', 'Semi Final', 'SemiFinal', 'Semi-final', '1/2 - Final',
+                      '1/2-Final', 'Semi - Final', 'Semifinal'],
+        'Qualification 1': ['1. Qualification 1', '1. Qualification', 'Qualification 1', '1. Qualification:',
+                            '1.Qualification', 'Group A Qualification', '1 Qualification'],
+        'Qualification 2': ['2. Qualification', '2. Qualification 2', 'Qualification 2', 'Group B Qualification'],
+    },
+    'speed': {
+        '1/8 - Final': ['1/8 - Final', '1_8 - Final'],
+    },
+    'boulder': {
+        'Semifinal': ['Semi-Final', 'Semi Final', 'Semifinal', 'semi-Final', 'SemiFinal', 'Semi final',
+                      'Semi-final', 'Semi - Final', '1/2-Final'],
+        'Qualification 1': ['1. Qualification (2)', '1. Qualification', 'Qualification (Group 1)',
+                            'Qualification (group A)', 'A Qualification', 'A. Qualification',
+                            'Qualification A', 'Qualification Group A', 'Qualification 1'],
+        'Qualification 2': ['2. Qualification (2)', '2. Qualification', 'Qualification (Group 2)',
+                            'B Qualification', 'Qualification (group B)', 'B. Qualification',
+                            'Qualification B', 'Qualification Group B', 'Qualification 2'],
+    },
+    'combined': {},
+}
+
+
+def join_columns(df, cols):
+    """
+    Join the non-null values of several columns into one comma separated string per row
+    Works a column at a time, the result is the same as
+    df[cols].apply(lambda x: ','.join(x.dropna().astype(str)), axis=1)
+    input:
+        df - pandas dataframe
+        cols - Columns to join, in order
+    output:
+        Series of joined strings, '' where every column is null
+    """
+    sub = df[cols]
+
+    # A row of all-numeric columns is upcast to their common dtype before being turned into
+    # strings (an int next to a float prints as 5.0), do the same so the text matches
+    dtypes = list(sub.dtypes)
+    if dtypes and all(pd.api.types.is_numeric_dtype(x) for x in dtypes):
+        sub = sub.astype(np.result_type(*dtypes))
+
+    joined = pd.Series('', index=df.index, dtype=object)
+    started = pd.Series(False, index=df.index)
+
+    for col in cols:
+        values = sub[col]
+        present = values.notna()
+        text = values.astype(str)
+
+        # Rows that already have a value need a separator first
+        joined = joined.mask(present & started, joined + ',' + text)
+        joined = joined.mask(present & ~started, text)
+        started = started | present
+
+    return joined
+
+
+def consolidate_columns(df, aliases):
+    """
+    Merge every known header variant of a round into a single column
+    input:
+        df - pandas dataframe of results
+        aliases - Dict of canonical column name to header variants, e.g. ALIASES['lead']
+    output:
+        df with each group of variants replaced by one canonical column at the end
+    """
+    for canonical, variants in aliases.items():
+        # Only the variants that are actually in this df
+        cols = [x for x in variants if x in df.columns]
+
+        joined = join_columns(df, cols)
+        df = df.drop(cols, axis=1)
+        df[canonical] = joined
+
+    return df
+
+
+def clean_boulder(boulder_df):
+    """
+    Cleans up the columns of the boulder df
+    input:
+        boulder_df - pandas dataframe containing info about bouldering comps
+    output:
+        cleaned boulder df
+    """
+    # Consolidate semifinal and qualification columns
+    return consolidate_columns(boulder_df, ALIASES['boulder'])
+
+
+def clean_combined(combined_df):
+    """
+    Cleans up the columns of the combined df
+    input:
+        combined_df - pandas dataframe containing info about combined comps
+    output:
+        cleaned combined df
+    """
+    # No cleaning needed as of 10/16/2019
+    return consolidate_columns(combined_df, ALIASES['combined'])
+
+
+def clean_lead(lead_df):
+    """
+    Cleans up the columns of the lead df
+    input:
+        lead_df - pandas dataframe containing info about lead comps
+    output:
+        cleaned lead df
+    """
+    # Consolidate semifinal and qualification columns
+    lead_df = consolidate_columns(lead_df, ALIASES['lead'])
+
+    # Drop this random nan column is it's there
+    try:
+        lead_df = lead_df.drop(['Unnamed: 18'], axis=1)
+    except:
+        pass
+
+    return lead_df
+
+
+def clean_speed(speed_df):
+    """
+    Cleans up the columns of the speed df
+    input:
+        speed_df - pandas dataframe containing info about speed comps
+    output:
+        cleaned speed df
+    """
+    # Consolidate 1/8 final columns
+    return consolidate_columns(speed_df, ALIASES['speed'])
+
+
+# Cleaning pipeline of each category, they don't depend on each other
+CLEANERS = {
+    'lead': clean_lead,
+    'speed': clean_speed,
+    'boulder': clean_boulder,
+    'combined': clean_combined,
+}
@@ -0,0 +1,342 @@
+import argparse
+import os
+import time
+
+# Each command imports only what it uses, so commands that don't scrape never import selenium
+# or launch a browser
+
+# Where the result csv files are read from and written to unless told otherwise
+DEFAULT_DATA_PATH = '~/projects/ifsc-scraper/data/'
+
+
+def index_paths(args):
+    """
+    Paths of the athlete index, aggregates, and ledger that go with the store
+    Paths given on the command line are used as they are. Otherwise a store other than the default
+    gets its own files inside its directory, so a scratch store never changes the real ones
+    output:
+        Touple of athlete index, aggregates, and ledger paths
+    """
+    from storage import DEFAULT_STORE_DIR
+    from athletes import DEFAULT_ATHLETE_INDEX_PATH
+    from aggregates import DEFAULT_AGGREGATES_PATH
+    from ledger import DEFAULT_LEDGER_PATH
+
+    own = os.path.abspath(os.path.expanduser(args.store)) != os.path.abspath(os.path.expanduser(DEFAULT_STORE_DIR))
+
+    paths = []
+    for given, default, name in [(args.athletes, DEFAULT_ATHLETE_INDEX_PATH, 'athletes.sqlite'),
+                                 (args.aggregates, DEFAULT_AGGREGATES_PATH, 'aggregates.sqlite'),
+                                 (args.ledger, DEFAULT_LEDGER_PATH, 'ledger.sqlite')]:
+        if given is not None:
+            paths.append(given)
+        elif own:
+            paths.append(os.path.join(args.store, name))
+        else:
+            paths.append(default)
+
+    return tuple(paths)
+
+
+def open_indexes(args):
+    """
+    Open the athlete index, aggregates, and ledger that go with the store, see index_paths
+    """
+    from athletes import AthleteIndex
+    from aggregates import AggregateStore
+    from ledger import ScrapeLedger
+
+    athletes_path, aggregates_path, ledger_path = index_paths(args)
+
+    return AthleteIndex(athletes_path), AggregateStore(aggregates_path), ScrapeLedger(ledger_path)
+
+
+def scrape(args):
+    """
+    Scrape the website and save the new results
+    """
+    from metrics import RunMetrics
+    from storage import PartitionedStore
+    from scraper import IFSCScraper
+
+    athletes, aggregates, ledger = open_indexes(args)
+    scraper = IFSCScraper(backend=args.backend, workers=args.workers, store=PartitionedStore(args.store),
+                          metrics=RunMetrics(progress=args.progress), athletes=athletes, aggregates=aggregates,
+                          ledger=ledger)
+
+    metrics_path = scraper.scrape(only_new=not args.all, batch_size=args.batch_size, arrow_dir=args.arrow_out)
+    if metrics_path is not None:
+        print('Run metrics saved to ' + metrics_path)
+
+    scraper.close()
+
+
+def merge(args):
+    """
+    Clean and store the results distributed workers have finished
+    """
+    from distributed import merge as merge_partials
+    from storage import PartitionedStore
+    from workqueue import WorkQueue
+
+    queue = WorkQueue(args.queue)
+    athletes, aggregates, ledger = open_indexes(args)
+
+    merged = merge_partials(queue, args.partials, PartitionedStore(args.store), athletes, aggregates, ledger,
+                            processes=args.processes)
+    print(str(merged) + ' comps merged')
+
+    for x in (athletes, aggregates, ledger, queue):
+        x.close()
+
+
+def clean(args):
+    """
+    Clean the result csv files again and replace their competitions in the store
+    """
+    from storage import CATEGORIES, PartitionedStore
+    from athletes import AthleteIndex
+    from aggregates import AggregateStore
+    from postprocess import save_results
+
+    paths = [os.path.join(os.path.expanduser(args.data), x + '_results.csv') for x in CATEGORIES]
+    missing = [x for x in paths if not os.path.exists(x)]
+    if missing:
+        raise SystemExit('Missing result files: ' + ', '.join(missing))
+
+    athletes_path, aggregates_path, _ = index_paths(args)
+    athletes = AthleteIndex(athletes_path)
+    aggregates = AggregateStore(aggregates_path)
+
+    # csv files are read in the worker processes too, each category is cleaned on its own core
+    written = save_results(paths, PartitionedStore(args.store), athletes, aggregates, processes=args.processes)
+    print(str(len(written)) + ' partitions written')
+
+    athletes.close()
+    aggregates.close()
+
+
+def backfill(args):
+    """
+    Plan and scrape every competition in a range of seasons, then report coverage
+    """
+    from storage import CATEGORIES, PartitionedStore
+    from workqueue import WorkQueue
+    from backfill import coverage, execute, parse_seasons, plan, print_report, write_report
+
+    seasons = parse_seasons(args.seasons)
+    disciplines = CATEGORIES if args.disciplines is None else [x.strip() for x in args.disciplines.split(',')]
+    unknown = [x for x in disciplines if x not in CATEGORIES]
+    if unknown:
+        raise SystemExit('Unknown disciplines: ' + ', '.join(unknown))
+
+    store = PartitionedStore(args.store)
+    queue = WorkQueue(args.plan, lease_seconds=args.lease)
+
+    if not args.report_only:
+        from scheduler import RequestScheduler
+        from scraper import IFSCScraper
+
+        # Selenium scrapes concurrency comps with a browser each, http fetches up to concurrency pages at once
+        scheduler = RequestScheduler()
+        fetcher = None
+        if args.backend == 'http':
+            from http_fetch import HTTPFetcher
+            fetcher = HTTPFetcher(concurrency=args.concurrency, scheduler=scheduler)
+        athletes, aggregates, ledger = open_indexes(args)
+        scraper = IFSCScraper(backend=args.backend, workers=args.concurrency if args.backend == 'selenium' else 1,
+                              fetcher=fetcher, store=store, scheduler=scheduler, athletes=athletes,
+                              aggregates=aggregates, ledger=ledger)
+
+        counts = plan(scraper, queue, seasons, disciplines, only_new=not args.all)
+        print(str(counts['found']) + ' comps found, ' + str(counts['complete']) + ' already complete, '
+              + str(counts['planned']) + ' added to the plan')
+
+        if not args.plan_only:
+            changed = execute(scraper, queue, args.concurrency, only_new=not args.all)
+            if changed and args.arrow_out is not None:
+                store.export_arrow(args.arrow_out, changed)
+
+        scraper.close()
+
+    report = coverage(queue, store, seasons, disciplines)
+    print_report(report)
+    print('Coverage report saved to ' + write_report(report, args.report))
+
+    queue.close()
+
+
+def live(args):
+    """
+    Keep the results of competitions in progress up to date
+    """
+    from datetime import date
+    from metrics import RunMetrics
+    from storage import PartitionedStore
+    from scraper import IFSCScraper
+    from live import LiveRefresh
+
+    athletes, aggregates, ledger = open_indexes(args)
+    scraper = IFSCScraper(backend=args.backend, store=PartitionedStore(args.store), metrics=RunMetrics(progress=args.progress),
+                          athletes=athletes, aggregates=aggregates, ledger=ledger)
+    refresh = LiveRefresh(scraper, poll_interval=args.interval, comps_every=args.comps_every, arrow_dir=args.arrow_out,
+                          today=date.fromisoformat(args.today) if args.today else None)
+
+    try:
+        print(str(refresh.run(max_polls=args.max_polls)) + ' partitions updated')
+    finally:
+        metrics_path = scraper.metrics.write({'scheduler': scraper.scheduler.summary()})
+        if metrics_path is not None:
+            print('Run metrics saved to ' + metrics_path)
+        scraper.close()
+
+
+def build_athlete_index(store_dir, path):
+    """
+    Rebuild the athlete index from the store, run in its own process by reindex
+    """
+    from storage import PartitionedStore
+    from athletes import AthleteIndex
+
+    athletes = AthleteIndex(path)
+    count = athletes.build(PartitionedStore(store_dir))
+    athletes.close()
+
+    return 'athlete index: ' + str(count) + ' rows'
+
+
+def build_aggregates(store_dir, path):
+    """
+    Rebuild the aggregate tables from the store, run in its own process by reindex
+    """
+    from storage import PartitionedStore
+    from aggregates import AggregateStore
+
+    aggregates = AggregateStore(path)
+    count = aggregates.build(PartitionedStore(store_dir))
+    aggregates.close()
+
+    return 'aggregates: ' + str(count) + ' placings'
+
+
+def reindex(args):
+    """
+    Rebuild the athlete index and aggregate tables from the store, both at once
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    athletes_path, aggregates_path, _ = index_paths(args)
+
+    builders = [(build_athlete_index, athletes_path), (build_aggregates, aggregates_path)]
+    if args.processes == 1:
+        results = [x(args.store, path) for x, path in builders]
+    else:
+        with ProcessPoolExecutor(max_workers=len(builders)) as pool:
+            results = [x.result() for x in [pool.submit(x, args.store, path) for x, path in builders]]
+
+    for result in results:
+        print(result)
+
+
+def export(args):
+    """
+    Write every category in the store out as a csv file, an arrow file, or both
+    """
+    from storage import PartitionedStore
+
+    store = PartitionedStore(args.store)
+
+    if args.format in ('csv', 'all'):
+        store.export_csv(args.out)
+        print('Exported csv files to ' + os.path.expanduser(args.out))
+
+    if args.format in ('arrow', 'all'):
+        store.export_arrow(args.arrow_out)
+        print('Exported arrow files to ' + os.path.expanduser(args.arrow_out))
+
+
+def main():
+    from storage import DEFAULT_ARROW_DIR, DEFAULT_STORE_DIR
+    from distributed import DEFAULT_PARTIAL_DIR
+    from workqueue import DEFAULT_QUEUE_PATH
+    from backfill import DEFAULT_PLAN_PATH, DEFAULT_REPORT_PATH
+
+    parser = argparse.ArgumentParser(description='Scrape IFSC results and process the saved data')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('scrape', help='Scrape new results and save them')
+    command.add_argument('--backend', default='selenium', choices=['selenium', 'http', 'replay'],
+                         help='How pages are loaded')
+    command.add_argument('--all', action='store_true', help='Scrape every comp, not only the ones that are new')
+    command.add_argument('--batch-size', type=int, default=5, help='Comps scraped before their results are saved')
+    command.add_argument('--workers', type=int, default=1, help='Browsers loading pages at the same time')
+    command.add_argument('--progress', type=float, default=60, help='Seconds between progress lines')
+    command.add_argument('--arrow-out', default=DEFAULT_ARROW_DIR, help='Directory the arrow files are published to')
+    command.set_defaults(func=scrape)
+
+    command = commands.add_parser('backfill', help='Scrape every competition in a range of seasons')
+    command.add_argument('--seasons', required=True, help="Seasons to cover, e.g. '2010-2019' or '2015,2017'")
+    command.add_argument('--disciplines', default=None, help="Comma separated categories, e.g. 'lead,boulder'")
+    command.add_argument('--backend', default='selenium', choices=['selenium', 'http', 'replay'],
+                         help='How pages are loaded')
+    command.add_argument('--concurrency', type=int, default=4, help='Comps scraped at the same time')
+    command.add_argument('--all', action='store_true', help='Plan and scrape comps that are already complete too')
+    command.add_argument('--plan', default=DEFAULT_PLAN_PATH, help='Path of the plan database, kept between runs')
+    command.add_argument('--lease', type=int, default=600, help='Seconds a comp is held without renewing it')
+    command.add_argument('--report', default=DEFAULT_REPORT_PATH, help='Path the coverage report is written to')
+    command.add_argument('--plan-only', action='store_true', help='Build the plan without scraping it')
+    command.add_argument('--report-only', action='store_true', help='Only report the coverage of the plan')
+    command.add_argument('--arrow-out', default=DEFAULT_ARROW_DIR, help='Directory the arrow files are published to')
+    command.set_defaults(func=backfill)
+
+    command = commands.add_parser('live', help='Poll competitions in progress and store results as they change')
+    command.add_argument('--backend', default='selenium', choices=['selenium', 'http', 'replay'],
+                         help='How pages are loaded')
+    command.add_argument('--interval', type=float, default=30, help='Seconds between polls')
+    command.add_argument('--comps-every', type=int, default=10, help='Polls between looking for new live comps')
+    command.add_argument('--max-polls', type=int, default=None, help='Stop after this many polls')
+    command.add_argument('--today', default=None, help='Date to find live comps for (YYYY-MM-DD), default today')
+    command.add_argument('--progress', type=float, default=300, help='Seconds between progress lines')
+    command.add_argument('--arrow-out', default=DEFAULT_ARROW_DIR, help='Directory the arrow files are published to')
+    command.set_defaults(func=live)
+
+    command = commands.add_parser('merge', help='Store the results distributed workers have finished')
+    command.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='Path of the shared queue database')
+    command.add_argument('--partials', default=DEFAULT_PARTIAL_DIR, help='Directory the workers wrote results to')
+    command.add_argument('--processes', type=int, default=None, help='Processes to clean with, default one per category')
+    command.set_defaults(func=merge)
+
+    command = commands.add_parser('clean', help='Clean the result csv files again and store them')
+    command.add_argument('--data', default=DEFAULT_DATA_PATH, help='Directory holding <category>_results.csv files')
+    command.add_argument('--processes', type=int, default=None, help='Processes to clean with, default one per category')
+    command.set_defaults(func=clean)
+
+    command = commands.add_parser('reindex', help='Rebuild the athlete index and aggregates from the store')
+    command.add_argument('--processes', type=int, default=None, help='1 to rebuild one after the other')
+    command.set_defaults(func=reindex)
+
+    command = commands.add_parser('export', help='Write the store out as csv and arrow files')
+    command.add_argument('--format', default='all', choices=['csv', 'arrow', 'all'], help='Which files to write')
+    command.add_argument('--out', default=DEFAULT_DATA_PATH, help='Directory to write <category>_results.csv files to')
+    command.add_argument('--arrow-out', default=DEFAULT_ARROW_DIR,
+                         help='Directory to write <category>_results.arrow files to')
+    command.set_defaults(func=export)
+
+    for name, command in commands.choices.items():
+        command.add_argument('--store', default=DEFAULT_STORE_DIR, help='Directory of the partitioned store')
+        if name == 'export':
+            continue
+
+        # Kept inside the store's directory when --store is given and these aren't
+        command.add_argument('--athletes', default=None, help='Path of the athlete index that goes with the store')
+        command.add_argument('--aggregates', default=None, help='Path of the aggregates that go with the store')
+        command.add_argument('--ledger', default=None, help='Path of the ledger that goes with the store')
+
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    args.func(args)
+    print(args.command + ' took {:.1f}s'.format(time.monotonic() - start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from athletes import normalize_names
+
+# Columns that identify a result row: the same athlete placing the same in the same comp and category
+FINGERPRINT_COLUMNS = ['Competition Title', 'Category', 'LAST', 'FIRST', 'Nation', 'Rank']
+
+
+def normalize_values(values):
+    """
+    Normalize a column the way athletes are matched (accents removed, lower case, whitespace
+    collapsed), only doing the string work once per distinct value
+    input:
+        values - Series
+    output:
+        numpy array of normalized strings, '' for missing values
+    """
+    codes, uniques = pd.factorize(values)
+    normalized = normalize_names(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+
+    # Missing values have code -1
+    return np.append(normalized, '')[codes]
+
+
+def normalize_ranks(ranks):
+    """
+    Ranks are strings when scraped and numbers when read from csv, '5', 5, and 5.0 should match
+    """
+    numbers = pd.to_numeric(ranks, errors='coerce')
+    whole = numbers.notna() & (numbers == numbers.round())
+
+    text = pd.Series(normalize_values(ranks), index=ranks.index)
+
+    return text.mask(whole, numbers[whole].astype('int64').astype(str)).to_numpy(dtype=object)
+
+
+def fingerprints(df):
+    """
+    Stable 64 bit fingerprint of every row from its normalized competition, category, athlete, and rank
+    Titles that only differ in whitespace or case get the same fingerprint
+    input:
+        df - pandas dataframe of results
+    output:
+        Series of uint64 fingerprints with df's index
+    """
+    parts = {}
+    for col in FINGERPRINT_COLUMNS:
+        if col not in df.columns:
+            parts[col] = np.full(len(df), '', dtype=object)
+        elif col == 'Rank':
+            parts[col] = normalize_ranks(df[col])
+        else:
+            parts[col] = normalize_values(df[col])
+
+    keys = pd.util.hash_pandas_object(pd.DataFrame(parts), index=False)
+    keys.index = df.index
+
+    return keys
+
+
+def drop_duplicate_rows(df):
+    """
+    Drop rows whose fingerprint appears again later in df, so the last version of a row wins
+    """
+    if len(df) == 0:
+        return df
+
+    return df[~fingerprints(df).duplicated(keep='last').to_numpy()]
+
+
+def merge_results(new_df, old_df):
+    """
+    Combine newly scraped results with historical ones, the new version of a row wins
+    Only old rows from competitions that appear in new_df can be duplicates, so only those are
+    fingerprinted, keeping the cost close to the number of new rows
+    input:
+        new_df - Newly scraped results
+        old_df - Historical results
+    output:
+        New rows followed by the old rows they don't replace
+    """
+    new_df = drop_duplicate_rows(new_df)
+    if len(new_df) == 0 or len(old_df) == 0 or 'Competition Title' not in new_df.columns:
+        return concat_rows(new_df, old_df)
+
+    new_keys = fingerprints(new_df)
+
+    # Old rows from the same competitions, whatever their whitespace
+    titles = set(normalize_values(new_df['Competition Title']))
+    candidates = np.isin(normalize_values(old_df['Competition Title']), list(titles))
+
+    keep_old = np.ones(len(old_df), dtype=bool)
+    keep_old[candidates] = ~fingerprints(old_df[candidates]).isin(new_keys).to_numpy()
+
+    return concat_rows(new_df, old_df[keep_old])
+
+
+def concat_rows(first, second):
+    """
+    Stack two dfs, leaving out an empty one so it can't change the dtypes of the other
+    """
+    frames = [x for x in (first, second) if len(x) > 0]
+    if not frames:
+        return pd.concat([first, second], ignore_index=True)
+
+    return pd.concat(frames, ignore_index=True)
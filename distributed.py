@@ -0,0 +1,259 @@
+import argparse
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+from ledger import ScrapeLedger
+from storage import CATEGORIES, PartitionedStore
+from athletes import AthleteIndex
+from aggregates import AggregateStore
+from postprocess import save_results
+from workqueue import WorkQueue, worker_name, DEFAULT_QUEUE_PATH
+
+# Where workers write the results of each item until they are merged, unless told otherwise
+DEFAULT_PARTIAL_DIR = '~/projects/ifsc-scraper/data/partials/'
+
+
+def coordinate(scraper, queue, only_new=True):
+    """
+    Find the competitions to scrape and their subcategory links, and push one item per competition
+    A competition is never split between workers since each category of it is saved as one partition
+    input:
+        scraper - IFSCScraper used to read the competition pages
+        queue - WorkQueue to push to
+        only_new - Skip comps the ledger says are complete
+    output:
+        Number of items pushed
+    """
+    if scraper.ledger is None:
+        scraper.ledger = ScrapeLedger()
+    scraper.only_new = only_new
+
+    comp_info = scraper.get_comp_links()
+    if only_new:
+        comp_info = scraper.check_for_new(comp_info)
+
+    comps = scraper.get_complete_result_links(comp_info)
+
+    # Comp pages that couldn't be loaded are left for the next coordinator run
+    failed = scraper.scheduler.requeue()
+
+    pushed = 0
+    for comp in comps:
+        if comp[2] in failed:
+            print('Not queueing ' + comp[0] + ', its page failed to load: ' + str(failed[comp[2]]))
+            continue
+        pushed += queue.push(comp[2], list(comp))
+
+    return pushed
+
+
+def partial_path(partial_dir, item_id, category):
+    """
+    File a worker writes one category of an item's results to
+    """
+    return os.path.join(os.path.expanduser(partial_dir), str(item_id), category + '.parquet')
+
+
+def write_partials(partial_dir, item_id, dfs):
+    """
+    Save the raw results of an item, one file per category that has any
+    Files are written under a temporary name and renamed, so merge() never reads half a file
+    input:
+        partial_dir - Directory shared by the workers and merge()
+        item_id - Queue item the results are for
+        dfs - List of lead, speed, boulder, and combined dfs from make_df_from_data
+    output:
+        N/A
+    """
+    for category, df in zip(CATEGORIES, dfs):
+        if len(df) == 0:
+            continue
+
+        path = partial_path(partial_dir, item_id, category)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = path + '.' + str(os.getpid()) + '.tmp'
+        df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+
+
+def read_partials(partial_dir, item_ids, category):
+    """
+    Load one category of the raw results of several items
+    output:
+        DataFrame, empty if none of the items had results in this category
+    """
+    frames = []
+    for item_id in item_ids:
+        path = partial_path(partial_dir, item_id, category)
+        if os.path.exists(path):
+            frames.append(pd.read_parquet(path))
+
+    if not frames:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def work(scraper, queue, partial_dir=DEFAULT_PARTIAL_DIR, worker=None, idle_timeout=60, poll=5, max_items=None):
+    """
+    Lease competitions from the queue and scrape them until there is nothing left to do
+    The lease is renewed in the background while a competition is being scraped
+    input:
+        scraper - IFSCScraper to scrape with, shouldn't share the coordinator's ledger or checkpoint
+        queue - WorkQueue to lease from
+        partial_dir - Directory shared with merge() where results are written
+        worker - Name of this worker, defaults to the host name and process id
+        idle_timeout - Seconds to wait for more work while other workers still hold items
+        poll - Seconds between checks for more work
+        max_items - Stop after this many items, None to keep going
+    output:
+        Number of items completed
+    """
+    worker = worker_name() if worker is None else worker
+
+    # What was scraped is passed to merge() with the results, so each worker keeps its own ledger
+    scraper.ledger = ScrapeLedger(':memory:')
+    scraper.checkpoint = None
+    scraper.only_new = False
+
+    completed = 0
+    idle_since = time.monotonic()
+    while max_items is None or completed < max_items:
+        leased = queue.lease(worker)
+        if leased is None:
+            # Other workers' items may still come back if they die
+            if queue.remaining() == 0 or time.monotonic() - idle_since > idle_timeout:
+                break
+            time.sleep(poll)
+            continue
+
+        item_id, comp = leased
+        comp = tuple(comp[:3]) + tuple(tuple(x) for x in comp[3:])
+
+        # Keep the lease alive until we're done
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_lease, args=(queue, item_id, worker, stop), daemon=True)
+        heartbeat.start()
+
+        try:
+            cat_data = scraper.get_data_for_comp(comp)
+
+            # Pages that failed every retry, hand the comp back for another attempt
+            failed = scraper.scheduler.requeue()
+            if failed:
+                scraper.unsaved.clear()
+                queue.fail(item_id, worker, str(len(failed)) + ' pages failed: ' + ', '.join(sorted(failed)))
+                continue
+
+            write_partials(partial_dir, item_id, scraper.make_df_from_data(cat_data))
+            scraper.record_saved([comp])
+            queue.complete(item_id, worker, {'title': comp[0], 'subcategories': scraper.ledger.subcategories_of(comp[0])})
+            completed += 1
+        except Exception as e:
+            print('Failed to scrape ' + comp[0] + ': ' + repr(e))
+            queue.fail(item_id, worker, repr(e))
+        finally:
+            stop.set()
+            heartbeat.join()
+            idle_since = time.monotonic()
+
+    return completed
+
+
+def renew_lease(queue, item_id, worker, stop):
+    """
+    Renew a lease a few times per lease period until stop is set
+    """
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.renew(item_id, worker):
+            print('Lost the lease on item ' + str(item_id))
+            return
+
+
+def merge(queue, partial_dir=DEFAULT_PARTIAL_DIR, store=None, athletes=None, aggregates=None, ledger=None,
+          batch_size=5, processes=None):
+    """
+    Clean and store the results of every finished item, and record them in the ledger
+    No pages are loaded, so this doesn't need a scraper or a browser
+    input:
+        queue - WorkQueue the items came from
+        partial_dir - Directory the workers wrote results to
+        store - PartitionedStore the results are saved to, defaults to PartitionedStore()
+        athletes - AthleteIndex to update, defaults to AthleteIndex()
+        aggregates - AggregateStore to update, defaults to AggregateStore()
+        ledger - ScrapeLedger the merged subcategories are recorded in, defaults to ScrapeLedger()
+        batch_size - Number of items merged at once
+        processes - Number of processes the categories of a batch are cleaned in, see postprocess.process_results
+    output:
+        Number of items merged
+    """
+    store = PartitionedStore() if store is None else store
+    athletes = AthleteIndex() if athletes is None else athletes
+    aggregates = AggregateStore() if aggregates is None else aggregates
+    ledger = ScrapeLedger() if ledger is None else ledger
+
+    items = queue.done()
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        item_ids = [x[0] for x in batch]
+
+        save_results([read_partials(partial_dir, item_ids, category) for category in CATEGORIES],
+                     store, athletes, aggregates, processes=processes)
+
+        for _, comp, result in batch:
+            for subcategory in result['subcategories']:
+                ledger.record_subcategory(result['title'], *subcategory)
+
+        queue.mark_merged(item_ids)
+
+        for item_id in item_ids:
+            shutil.rmtree(os.path.dirname(partial_path(partial_dir, item_id, '')), ignore_errors=True)
+
+    return len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape with several workers sharing a work queue')
+    parser.add_argument('role', choices=['coordinator', 'worker', 'merge', 'status'])
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='Path of the shared queue database')
+    parser.add_argument('--partials', default=DEFAULT_PARTIAL_DIR, help='Directory shared by workers and merge')
+    parser.add_argument('--backend', default='selenium', choices=['selenium', 'http'], help='How pages are loaded')
+    parser.add_argument('--all', action='store_true', help='Queue every comp, not only the ones that are new')
+    parser.add_argument('--lease', type=int, default=600, help='Seconds a worker holds an item without renewing it')
+    parser.add_argument('--idle-timeout', type=int, default=60, help='Seconds a worker waits for more work')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue, lease_seconds=args.lease)
+
+    if args.role == 'status':
+        print(queue.counts())
+        for key, error in queue.failures():
+            print('failed: ' + key + ': ' + str(error))
+        queue.close()
+        return
+
+    # Merging doesn't load any pages, so it doesn't need a scraper
+    if args.role == 'merge':
+        store, athletes, aggregates, ledger = PartitionedStore(), AthleteIndex(), AggregateStore(), ScrapeLedger()
+        print(str(merge(queue, args.partials, store, athletes, aggregates, ledger)) + ' comps merged')
+        for x in (athletes, aggregates, ledger, queue):
+            x.close()
+        return
+
+    from scraper import IFSCScraper
+
+    scraper = IFSCScraper(backend=args.backend)
+
+    if args.role == 'coordinator':
+        print(str(coordinate(scraper, queue, only_new=not args.all)) + ' comps queued')
+    else:
+        print(str(work(scraper, queue, args.partials, idle_timeout=args.idle_timeout)) + ' comps scraped')
+
+    scraper.close()
+    queue.close()
+
+if __name__ == '__main__':
+    main()
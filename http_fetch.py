@@ -0,0 +1,167 @@
+import asyncio
+import os
+from urllib.parse import quote, urlsplit, urlunsplit
+from parsing import fragment_to_query
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Errors that mean a single page couldn't be fetched
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else (asyncio.TimeoutError,)
+
+
+def recorded_name(url):
+    """
+    File name a response for this url is recorded under, shared with util/replay_server.py
+    input:
+        url - Url that was requested
+    output:
+        File name made from the url's path and query
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+
+    return quote(path, safe='') + '.html'
+
+
+class HTTPFetcher():
+    """
+    Fetch pages over plain http instead of through a browser
+    Uses a single keep-alive aiohttp session with a bounded number of requests in flight,
+    so a whole list of pages can be fetched at the same time
+    The default url_for (parsing.fragment_to_query) hasn't been checked against the live site,
+    pass the url of the data the page's scripts load once it is known
+    """
+
+    def __init__(self, concurrency=8, timeout=20, base_url=None, url_for=fragment_to_query,
+                 record_dir=None, headers=None, scheduler=None):
+        """
+        input:
+            concurrency - Maximum number of requests in flight at once
+            timeout - Seconds before a single request gives up
+            base_url - Send every request to this scheme and host instead, e.g. a local
+                       replay server ('http://localhost:8000')
+            url_for - Function that maps a page link to the url that serves its data
+            record_dir - If set, every response body is saved here for later replay
+            headers - Extra headers sent with every request
+            scheduler - RequestScheduler whose per-host rate limit every request waits for
+        """
+        if aiohttp is None:
+            raise ImportError('HTTPFetcher requires aiohttp (pip install aiohttp)')
+
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.base_url = base_url
+        self.url_for = url_for
+        self.record_dir = record_dir
+        self.headers = headers or {'User-Agent': 'ifsc-webscraper'}
+        self.scheduler = scheduler
+
+        # Pages fetched ahead of time by prefetch(), keyed by link
+        self.pages = {}
+
+        # Session lives on our own event loop so the connection pool is reused between calls
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+
+    def request_url(self, link):
+        """
+        Url actually requested for a page link
+        """
+        url = self.url_for(link)
+
+        if self.base_url is not None:
+            base = urlsplit(self.base_url)
+            parts = urlsplit(url)
+            url = urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ''))
+
+        return url
+
+    async def get(self, semaphore, link):
+        """
+        Fetch the body of a single page
+        """
+        url = self.request_url(link)
+
+        async with semaphore:
+            if self.scheduler is not None:
+                await self.scheduler.throttle_async(link)
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                body = await response.text()
+
+        if self.record_dir is not None:
+            with open(os.path.join(self.record_dir, recorded_name(url)), 'w') as f:
+                f.write(body)
+
+        return body
+
+    async def gather(self, links):
+        """
+        Fetch every link at once, bounded by the concurrency limit
+        """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        return await asyncio.gather(*[self.get(semaphore, x) for x in links], return_exceptions=True)
+
+    def fetch_all(self, links):
+        """
+        Fetch a list of pages concurrently
+        input:
+            links - List of page links
+        output:
+            List of page bodies in the same order, or the exception raised for that page
+        """
+        if self.record_dir is not None:
+            os.makedirs(self.record_dir, exist_ok=True)
+
+        return self.loop.run_until_complete(self.gather(links))
+
+    def fetch(self, link):
+        """
+        Fetch a single page, using the prefetched copy if there is one
+        input:
+            link - Page link
+        output:
+            Page body, raises on failure
+        """
+        if link in self.pages:
+            return self.pages.pop(link)
+
+        body = self.fetch_all([link])[0]
+        if isinstance(body, Exception):
+            raise body
+
+        return body
+
+    def prefetch(self, links):
+        """
+        Fetch pages concurrently ahead of time so later fetch() calls return immediately
+        Failed pages are left out and will be retried by fetch()
+        input:
+            links - List of page links
+        output:
+            N/A
+        """
+        links = [x for x in dict.fromkeys(links) if x is not None and x not in self.pages]
+
+        for link, body in zip(links, self.fetch_all(links)):
+            if not isinstance(body, Exception):
+                self.pages[link] = body
+
+    def close(self):
+        """
+        Close the connection pool and the event loop
+        """
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+
+        self.loop.close()
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from aggregates import comp_end_date
+
+# Where the ledger is kept unless told otherwise
+DEFAULT_LEDGER_PATH = '~/projects/ifsc-scraper/data/ledger.sqlite'
+
+# Days after a competition's last day its results can still change, after that a subcategory
+# without a final (one that never happened) stops being scraped again
+DEFAULT_GRACE_DAYS = 14
+
+
+def has_final_results(page):
+    """
+    Check whether a result page already has its final round filled in
+    Pages scraped while a competition is still running only have the earlier rounds
+    input:
+        page - ResultPage returned by get_data_on_page
+    output:
+        True if any row has a value in a column starting with 'Final'
+    """
+    finals = [i for i, header in enumerate(page.headers) if header.startswith('Final')]
+
+    for row in page.rows:
+        for i in finals:
+            if i < len(row) and row[i]:
+                return True
+
+    return False
+
+
+def table_hash(page):
+    """
+    Hash of a results table, the same headers and cells always give the same hash
+    input:
+        page - ResultPage
+    output:
+        Hex digest string
+    """
+    text = json.dumps([page.headers, page.rows], ensure_ascii=False, separators=(',', ':'))
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def has_ended(comp_date, title='', days=0, today=None):
+    """
+    Check whether a competition's last day is more than a number of days ago
+    input:
+        comp_date - Competition date string
+        title - Competition title, used for the year if the date can't be read
+        days - Days after the last day that still count as not ended
+        today - datetime.date to compare with, None for the current date
+    output:
+        True if it ended, False if it didn't or its date is unknown
+    """
+    ended = comp_end_date(comp_date, title)
+    if ended.startswith('0000'):
+        return False
+
+    today = date.today() if today is None else today
+
+    return today > date.fromisoformat(ended) + timedelta(days=days)
+
+
+class ScrapeLedger():
+    """
+    Indexed record of every (competition, subcategory) that has been scraped, with when it was
+    scraped, how many rows it had, and whether its final round was finished at the time
+    Competitions are complete once every one of their subcategories is, and completeness is
+    kept on the competition row so checking a competition is a single primary key lookup
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH, grace_days=DEFAULT_GRACE_DAYS):
+        """
+        input:
+            path - Path of the sqlite database
+            grace_days - Days after a competition's last day that its subcategories can still change,
+                         see record_page
+        """
+        self.path = os.path.expanduser(path)
+        self.grace_days = grace_days
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        # Pooled workers share one ledger
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS competitions (
+                title TEXT PRIMARY KEY,
+                date TEXT,
+                link TEXT,
+                subcategories INTEGER,
+                complete INTEGER NOT NULL DEFAULT 0,
+                first_seen REAL NOT NULL,
+                last_checked REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS table_hashes (
+                link TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                changed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS subcategories (
+                title TEXT NOT NULL,
+                subcategory TEXT NOT NULL,
+                link TEXT,
+                category TEXT,
+                rows INTEGER NOT NULL,
+                complete INTEGER NOT NULL,
+                scraped_at REAL NOT NULL,
+                hash TEXT,
+                PRIMARY KEY (title, subcategory)
+            );
+        """)
+
+        # Ledgers made before tables were hashed
+        columns = [x[1] for x in self.db.execute("PRAGMA table_info(subcategories)")]
+        if 'hash' not in columns:
+            self.db.execute("ALTER TABLE subcategories ADD COLUMN hash TEXT")
+
+        self.db.commit()
+
+    def record_comp(self, title, date, link, subcategories):
+        """
+        Record a competition page visit and how many subcategories it lists
+        input:
+            title - Competition title
+            date - Competition date
+            link - Link to the competition page
+            subcategories - List of subcategory names on the page
+        output:
+            N/A
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("""
+                INSERT INTO competitions (title, date, link, subcategories, first_seen, last_checked)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (title) DO UPDATE SET
+                    date = excluded.date, link = excluded.link,
+                    subcategories = excluded.subcategories, last_checked = excluded.last_checked
+                """, (title, date, link, len(subcategories), now, now))
+            self.update_complete(title)
+            self.db.commit()
+
+    def record_subcategory(self, title, subcategory, link, category, rows, complete, digest=None):
+        """
+        Record that a subcategory's complete results were scraped
+        input:
+            title - Competition title
+            subcategory - Subcategory name, e.g. 'IFSC Men lead'
+            link - Link to the complete result page
+            category - Category name, None for a subcategory that was skipped
+            rows - Number of result rows
+            complete - Whether the subcategory is done, see record_page
+            digest - table_hash of the results table
+        output:
+            N/A
+        """
+        with self.lock:
+            self.db.execute("""
+                INSERT OR REPLACE INTO subcategories (title, subcategory, link, category, rows, complete, scraped_at, hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (title, subcategory, link, category, rows, int(complete), time.time(), digest))
+            self.update_complete(title)
+            self.db.commit()
+
+    def record_page(self, title, comp_date, subcategory, link, category, page):
+        """
+        Record a scraped complete result page and work out whether it still needs scraping again
+        A subcategory is complete once its final round has results. A final that never happened
+        would keep it incomplete forever, so it is also complete once its competition ended more
+        than grace_days ago, or once it ended and the table is the same as the last time it was scraped
+        input:
+            title - Competition title
+            comp_date - Competition date
+            subcategory - Subcategory name
+            link - Link to the complete result page
+            category - Category name
+            page - ResultPage returned by get_data_on_page
+        output:
+            True if the subcategory was recorded as complete
+        """
+        digest = table_hash(page)
+
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM subcategories WHERE title = ? AND subcategory = ?",
+                                  (title, subcategory)).fetchone()
+            unchanged = row is not None and row[0] == digest
+
+            complete = (has_final_results(page) or has_ended(comp_date, title, self.grace_days)
+                        or (unchanged and has_ended(comp_date, title)))
+            self.record_subcategory(title, subcategory, link, category, len(page), complete, digest)
+
+        return complete
+
+    def record_skipped(self, title, subcategory, link):
+        """
+        Record a subcategory that isn't scraped, e.g. one of a type the scraper doesn't know,
+        so it doesn't keep its competition incomplete
+        """
+        self.record_subcategory(title, subcategory, link, None, 0, True)
+
+    def update_complete(self, title):
+        """
+        Recompute whether every subcategory of a competition is complete
+        """
+        self.db.execute("""
+            UPDATE competitions SET complete = (
+                subcategories IS NOT NULL AND subcategories > 0 AND subcategories <= (
+                    SELECT COUNT(*) FROM subcategories s
+                    WHERE s.title = competitions.title AND s.complete = 1))
+            WHERE title = ?
+            """, (title,))
+
+    def is_complete(self, title):
+        """
+        Check whether a competition has been fully scraped
+        input:
+            title - Competition title
+        output:
+            True if it has nothing left to scrape
+        """
+        with self.lock:
+            row = self.db.execute("SELECT complete FROM competitions WHERE title = ?", (title,)).fetchone()
+
+        return row is not None and bool(row[0])
+
+    def is_subcategory_complete(self, title, subcategory):
+        """
+        Check whether a subcategory was scraped after its final round finished
+        """
+        with self.lock:
+            row = self.db.execute("SELECT complete FROM subcategories WHERE title = ? AND subcategory = ?",
+                                  (title, subcategory)).fetchone()
+
+        return row is not None and bool(row[0])
+
+    def subcategories_of(self, title):
+        """
+        Everything recorded about a competition's subcategories, in the order record_subcategory takes it
+        input:
+            title - Competition title
+        output:
+            List of (subcategory, link, category, rows, complete, hash) touples
+        """
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT subcategory, link, category, rows, complete, hash FROM subcategories WHERE title = ?
+                ORDER BY scraped_at
+                """, (title,)).fetchall()
+
+        return [(x[0], x[1], x[2], x[3], bool(x[4]), x[5]) for x in rows]
+
+    def table_hash(self, link):
+        """
+        Hash of the results table last stored from a complete result page, see record_table_hash
+        output:
+            Hash string, None if the page's table hasn't been stored by a live refresh
+        """
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM table_hashes WHERE link = ?", (link,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def record_table_hash(self, link, digest):
+        """
+        Remember the hash of the results table stored from a complete result page
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO table_hashes VALUES (?, ?, ?)", (link, digest, time.time()))
+            self.db.commit()
+
+    def incomplete(self):
+        """
+        Competitions that were seen but still have subcategories left to scrape
+        output:
+            List of (title, date, link) touples
+        """
+        with self.lock:
+            return self.db.execute("SELECT title, date, link FROM competitions WHERE complete = 0").fetchall()
+
+    def seed(self, titles):
+        """
+        Mark competitions scraped before the ledger existed as complete
+        Their subcategories aren't known, so they are never revisited
+        input:
+            titles - Iterable of competition titles
+        output:
+            N/A
+        """
+        now = time.time()
+        with self.lock:
+            self.db.executemany("""
+                INSERT OR IGNORE INTO competitions (title, complete, first_seen, last_checked)
+                VALUES (?, 1, ?, ?)
+                """, [(x, now, now) for x in titles])
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
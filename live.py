@@ -0,0 +1,188 @@
+import time
+from datetime import date, timedelta
+from storage import CATEGORIES, DEFAULT_ARROW_DIR, PartitionedStore
+from athletes import AthleteIndex
+from aggregates import AggregateStore, comp_end_date
+from ledger import ScrapeLedger, table_hash
+
+
+def is_live(comp, today, lookahead_days=7, grace_days=1):
+    """
+    Check whether a competition could have results coming in today
+    Only the last day of a competition is known for sure, so a competition counts as live from
+    lookahead_days before its last day until grace_days after it, to catch late corrections
+    input:
+        comp - Touple of comp name, date, and link
+        today - datetime.date
+        lookahead_days - Days before the last day a competition can start
+        grace_days - Days after the last day results are still polled
+    output:
+        True if the competition should be polled
+    """
+    ended = date.fromisoformat(comp_end_date(comp[1], comp[0]))
+
+    return ended - timedelta(days=lookahead_days) <= today <= ended + timedelta(days=grace_days)
+
+
+class LiveRefresh():
+    """
+    Keeps the stored results of competitions in progress up to date with as little work as possible
+    Each poll only loads the complete result pages of live competitions, hashes every table,
+    and only when a table differs from the one last stored is its category of that
+    competition rebuilt and written, which replaces one partition and updates the athlete
+    index and aggregates for that competition alone
+    """
+
+    def __init__(self, scraper, poll_interval=30, comps_every=10, lookahead_days=7, grace_days=1,
+                 arrow_dir=DEFAULT_ARROW_DIR, today=None):
+        """
+        input:
+            scraper - IFSCScraper to load pages with, its store, athlete index, aggregates, and
+                      ledger are created if it doesn't have them
+            poll_interval - Seconds from the start of one poll to the start of the next
+            comps_every - Polls between looking for new live competitions and subcategories
+            lookahead_days, grace_days - Window around a competition's last day it is polled in, see is_live
+            arrow_dir - Directory the changed categories are published to as arrow files, None to not publish them
+            today - datetime.date to decide which competitions are live, None for the current date
+        """
+        self.scraper = scraper
+        self.poll_interval = poll_interval
+        self.comps_every = comps_every
+        self.lookahead_days = lookahead_days
+        self.grace_days = grace_days
+        self.arrow_dir = arrow_dir
+        self.today = today
+
+        if scraper.ledger is None:
+            scraper.ledger = ScrapeLedger()
+        if scraper.store is None:
+            scraper.store = PartitionedStore()
+        if scraper.athletes is None:
+            scraper.athletes = AthleteIndex()
+        if scraper.aggregates is None:
+            scraper.aggregates = AggregateStore()
+
+        # Pages change between polls, so they aren't checkpointed
+        scraper.checkpoint = None
+
+        # Live comps with their subcategory links, from find_comps
+        self.comps = []
+        self.polls = 0
+
+    def find_comps(self):
+        """
+        Look up which competitions are live and the complete result links of their subcategories
+        Subcategories appear on a competition page as their rounds start, so this is done again every few polls
+        output:
+            List of comp touples followed by (subcategory name, url) touples
+        """
+        today = date.today() if self.today is None else self.today
+        comps = [x for x in self.scraper.get_comp_links()
+                 if is_live(x, today, self.lookahead_days, self.grace_days)]
+
+        self.comps = self.scraper.get_complete_result_links(comps)
+
+        return self.comps
+
+    def poll(self):
+        """
+        Load every complete result page of the live competitions once and store the tables that changed
+        A category of a competition is only rewritten when every one of its pages loaded, since its
+        partition holds all of its subcategories
+        output:
+            List of manifest entries that were written
+        """
+        if self.polls % self.comps_every == 0:
+            self.find_comps()
+        self.polls += 1
+
+        scraper = self.scraper
+        metrics = scraper.metrics
+
+        # Fetch this poll's pages ahead of time when we aren't using a browser
+        scraper.prefetch([subcat[1] for comp in self.comps for subcat in comp[3:]])
+
+        # Pages of every category that changed, and the (comp, subcategory, page, hash) to record once stored
+        cat_data = [[], [], [], []]
+        stored = []
+
+        for comp in self.comps:
+            pages = {}
+            differs = set()
+            failed = set()
+
+            for subcat in comp[3:]:
+                cat_type = subcat[0][:-16]
+                index, category = scraper.category_of(cat_type)
+                if index is None or subcat[1] is None:
+                    continue
+
+                if not scraper.load_page(subcat[1], page_type='results'):
+                    failed.add(index)
+                    continue
+
+                page = scraper.get_data_on_page([('Competition Title', comp[0]), ('Competition Date', comp[1]),
+                                                 ('Category', category)])
+                digest = table_hash(page)
+                pages.setdefault(index, []).append((subcat, page, digest))
+
+                if digest != scraper.ledger.table_hash(subcat[1]):
+                    differs.add(index)
+
+            metrics.count('live.unchanged_categories', len(set(pages) - differs))
+
+            # A category is rebuilt from all of its pages, so it waits for a poll where they all load
+            for index in sorted(differs - failed):
+                metrics.count('live.changed_categories')
+                cat_data[index] += [page for _, page, _ in pages[index]]
+                stored += [(comp, subcat, page, digest) for subcat, page, digest in pages[index]]
+
+        written = []
+        if stored:
+            written = scraper.save_results(scraper.make_df_from_data(cat_data))
+
+            # Hashes are only recorded once their tables are stored
+            for comp, subcat, page, digest in stored:
+                index, category = scraper.category_of(subcat[0][:-16])
+                scraper.ledger.record_page(comp[0], comp[1], subcat[0][:-16], subcat[1], category, page)
+                scraper.ledger.record_table_hash(subcat[1], digest)
+
+        # Pages that failed every retry are just tried again next poll
+        scraper.scheduler.requeue()
+
+        if written and self.arrow_dir is not None:
+            with metrics.stage('export'):
+                categories = {x['category'] for x in written}
+                scraper.store.export_arrow(self.arrow_dir, [x for x in CATEGORIES if x in categories])
+
+        metrics.count('live.polls')
+        metrics.count('live.partitions_written', len(written))
+
+        return written
+
+    def run(self, max_polls=None, stop_when_idle=True):
+        """
+        Poll until there is nothing live, or for a number of polls
+        input:
+            max_polls - Stop after this many polls, None for no limit
+            stop_when_idle - Stop once no competition is live
+        output:
+            Number of partitions written
+        """
+        count = 0
+        while max_polls is None or self.polls < max_polls:
+            start = time.monotonic()
+
+            written = self.poll()
+            count += len(written)
+            print(time.strftime('%H:%M:%S') + ' poll ' + str(self.polls) + ': ' + str(len(self.comps))
+                  + ' live comps, ' + str(len(written)) + ' partitions updated')
+
+            if stop_when_idle and not self.comps:
+                break
+
+            # Wait out the rest of the interval
+            if max_polls is None or self.polls < max_polls:
+                time.sleep(max(0, self.poll_interval - (time.monotonic() - start)))
+
+        return count
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Where the metrics of each run are written unless told otherwise
+DEFAULT_METRICS_DIR = '~/projects/ifsc-scraper/data/metrics/'
+
+
+class RunMetrics():
+    """
+    Timings and counters for a single scrape run
+    Stages are timed with stage() and summed across every call (and every pooled worker),
+    counters track things like pages fetched and timeouts. Everything is written to a json
+    file at the end of the run
+    """
+
+    def __init__(self, directory=DEFAULT_METRICS_DIR, progress=None):
+        """
+        input:
+            directory - Directory the metrics file is written to, None to not write one
+            progress - Print a progress line at most every this many seconds, None for no progress
+        """
+        self.directory = directory
+        self.progress = progress
+
+        # Pooled workers share one set of metrics
+        self.lock = threading.Lock()
+
+        # stage -> {'count', 'total', 'max'} in seconds
+        self.timings = {}
+        # name -> count
+        self.counters = {}
+
+        self.started = time.time()
+        self.last_progress = time.monotonic()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the body of a with block as one call of a stage
+        input:
+            name - Stage name, e.g. 'load_page.wait'
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - start)
+
+    def add_time(self, name, seconds):
+        """
+        Add one timed call to a stage
+        """
+        with self.lock:
+            stats = self.timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def count(self, name, amount=1):
+        """
+        Increase a counter, printing a progress line if one is due
+        input:
+            name - Counter name, e.g. 'pages'
+            amount - How much to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+        if self.progress is not None and time.monotonic() - self.last_progress >= self.progress:
+            self.last_progress = time.monotonic()
+            print(self.progress_line())
+
+    def progress_line(self):
+        """
+        One line summary of the run so far
+        """
+        with self.lock:
+            elapsed = time.time() - self.started
+            pages = self.counters.get('pages', 0)
+            rows = self.counters.get('rows', 0)
+            timeouts = self.counters.get('timeouts', 0)
+            waited = self.timings.get('load_page.wait', {}).get('total', 0.0)
+
+        return ('{:.0f}s: {} pages ({:.2f}/s), {} rows, {} timeouts, {:.0f}s waiting for pages'
+                .format(elapsed, pages, pages / elapsed if elapsed > 0 else 0.0, rows, timeouts, waited))
+
+    def summary(self):
+        """
+        Everything measured so far
+        output:
+            Dict with run start and duration, per stage timings (with means), and counters
+        """
+        with self.lock:
+            timings = {name: dict(stats) for name, stats in self.timings.items()}
+            counters = dict(self.counters)
+
+        for stats in timings.values():
+            stats['mean'] = stats['total'] / stats['count']
+
+        # Rates for the stages that produce rows
+        for name in ('extract', 'build_df'):
+            if name in timings and timings[name]['total'] > 0:
+                timings[name]['rows_per_second'] = counters.get('rows', 0) / timings[name]['total']
+
+        return {
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'timings': timings,
+            'counters': counters,
+        }
+
+    def write(self, extra=None):
+        """
+        Write the summary to a new json file in the metrics directory
+        input:
+            extra - Dict of more sections to include, e.g. readiness wait stats
+        output:
+            Path of the file written, None if there is no metrics directory
+        """
+        if self.directory is None:
+            return None
+
+        directory = os.path.expanduser(self.directory)
+        os.makedirs(directory, exist_ok=True)
+
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+
+        # Runs started in the same second (distributed workers, backfills) each get their own file
+        name = ('run-' + time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)) + '-' + str(os.getpid())
+                + '-' + uuid.uuid4().hex[:6] + '.json')
+        path = os.path.join(directory, name)
+        with open(path, 'x') as f:
+            json.dump(summary, f, indent=1)
+
+        return path
@@ -0,0 +1,266 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import re
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Tags that never have children or a closing tag
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+             'param', 'source', 'track', 'wbr'}
+
+# Tags that are implicitly closed when one of the listed tags opens
+IMPLICIT_CLOSE = {
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+    'tr': {'td', 'th', 'tr'},
+    'option': {'option'},
+}
+
+# Tags that render on their own line, the same way a browser's innerText would
+BLOCK_TAGS = {'br', 'div', 'p', 'li', 'tr'}
+
+
+class EmptyPageError(ValueError):
+    """
+    A loaded page doesn't have the comps or results it should, e.g. it was read before (or
+    without) the site's scripts filling them in
+    """
+
+
+class Node():
+    """
+    Minimal element from a parsed html page
+    """
+
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.parent = parent
+        self.children = []
+
+    def iter(self, tag=None):
+        """
+        Yield this node and every element below it in document order, optionally only one tag
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if tag is None or node.tag == tag:
+                yield node
+            stack.extend(reversed([x for x in node.children if isinstance(x, Node)]))
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    @property
+    def text(self):
+        """
+        Text content with whitespace collapsed, close to what selenium's .text returns
+        """
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+                continue
+            if node.tag in ('script', 'style'):
+                continue
+            if node.tag in BLOCK_TAGS:
+                parts.append('\n')
+            stack.extend(reversed(node.children))
+
+        lines = [' '.join(x.split()) for x in ''.join(parts).split('\n')]
+
+        return '\n'.join(x for x in lines if x)
+
+
+class TreeBuilder(HTMLParser):
+    """
+    Build a Node tree out of an html document
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('document', [])
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        # Close elements like <td> and <option> that don't need an end tag
+        closes = IMPLICIT_CLOSE.get(tag)
+        if closes:
+            while self.stack[-1].tag in closes:
+                self.stack.pop()
+
+        node = Node(tag, attrs, self.stack[-1])
+        self.stack[-1].children.append(node)
+
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.stack[-1].children.append(Node(tag, attrs, self.stack[-1]))
+
+    def handle_endtag(self, tag):
+        # Ignore stray end tags that don't match anything open
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                break
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+
+def parse_html(html):
+    """
+    Parse an html document
+    input:
+        html - html string
+    output:
+        Root Node of the document
+    """
+    builder = TreeBuilder()
+    builder.feed(html)
+    builder.close()
+
+    return builder.root
+
+
+def parse_comp_options(html):
+    """
+    Find the options of the compChooser select on the last result page
+    input:
+        html - html of the last result page
+    output:
+        List of touples of comp name, date, and comp id
+    """
+    root = parse_html(html) if isinstance(html, str) else html
+
+    for select in root.iter('select'):
+        if select.get('class') == 'compChooser':
+            return [(x.text, x.get('title'), x.get('value')) for x in select.iter('option')]
+
+    return []
+
+
+def parse_subcategory_links(html, base_url=None):
+    """
+    Find the subcategory headers and links to their complete results on a competition page
+    input:
+        html - html of a competition page
+        base_url - Url of the page, used to make relative links absolute
+    output:
+        List of touples of subcategory name and url
+    """
+    root = parse_html(html) if isinstance(html, str) else html
+
+    links = []
+    for th in root.iter('th'):
+        if th.get('colspan') != '4':
+            continue
+        anchors = list(th.iter('a'))
+        href = anchors[0].get('href') if anchors else None
+        if href is not None and base_url is not None:
+            href = absolute_url(base_url, href)
+        links.append((th.text, href))
+
+    return links
+
+
+def lxml_text(element):
+    """
+    Text content of an lxml element, collapsed the same way as Node.text
+    """
+    parts = []
+    collect_lxml_text(element, parts)
+
+    lines = [' '.join(x.split()) for x in ''.join(parts).split('\n')]
+
+    return '\n'.join(x for x in lines if x)
+
+
+def collect_lxml_text(node, parts):
+    """
+    Append the text below an lxml element to parts, skipping scripts, styles and comments
+    """
+    if not isinstance(node.tag, str) or node.tag in ('script', 'style'):
+        return
+
+    if node.tag in BLOCK_TAGS:
+        parts.append('\n')
+    if node.text:
+        parts.append(node.text)
+
+    for child in node:
+        collect_lxml_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+def parse_result_table(html):
+    """
+    Pull the headers and cell text out of a complete result page
+    Like the browser path, the first <tr> gives the headers and every later <tr> is a row
+    Uses lxml when it is installed and falls back to the standard library parser
+    input:
+        html - html of a complete result page
+    output:
+        List of header strings, list of rows where each row is a list of cell strings
+    """
+    if lxml is not None and isinstance(html, str):
+        if not html.strip():
+            return [], []
+
+        table_rows = lxml.html.document_fromstring(html).iter('tr')
+        header_row = next(table_rows, None)
+        if header_row is None:
+            return [], []
+
+        headers = [lxml_text(x) for x in header_row.iter('th')]
+        rows = [[lxml_text(x) for x in tr.iter('td')] for tr in table_rows]
+
+        return headers, rows
+
+    root = parse_html(html) if isinstance(html, str) else html
+
+    table_rows = list(root.iter('tr'))
+    if not table_rows:
+        return [], []
+
+    headers = [x.text for x in table_rows[0].iter('th')]
+    rows = [[x.text for x in tr.iter('td')] for tr in table_rows[1:]]
+
+    return headers, rows
+
+
+def absolute_url(base_url, href):
+    """
+    Resolve a possibly relative link against the page it was found on
+    """
+    return urljoin(base_url, href)
+
+
+def fragment_to_query(link):
+    """
+    The results pages select a competition through the url fragment (#!comp=123), which is
+    never sent to the server. Turn it into a query string so a plain http request can ask for it
+    This mapping is unverified: nothing shows the site answers a ?comp= query, and its result
+    tables are filled in by the page's scripts, so a plain request may only get the empty page.
+    A fetched page without a results table counts as a failed load, and one without comps raises
+    input:
+        link - Url that may contain a #! fragment
+    output:
+        Url with the fragment moved into the query string
+    """
+    match = re.match(r'^([^#]*)#!(.*)$', link)
+    if match is None:
+        return link
+
+    base, fragment = match.groups()
+    separator = '&' if '?' in base else '?'
+
+    return base + separator + fragment
@@ -0,0 +1,114 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from selenium.common.exceptions import WebDriverException
+
+
+class BrowserPool():
+    """
+    Pool of scraper workers, each with its own browser, that visit pages at the same time
+    Workers are created lazily and replaced when their browser crashes
+    """
+
+    def __init__(self, factory, size, max_restarts=2, owner=None):
+        """
+        input:
+            factory - Callable taking no arguments that returns a new worker (an IFSCScraper)
+            size - Number of workers to run at once
+            max_restarts - Times a single item is retried on a fresh worker after a crash
+            owner - Scraper that created the pool, used as one of its size workers so its browser
+                    isn't left idle while the pool runs. Its browser is replaced in place after a
+                    crash and left running by close()
+        """
+        self.factory = factory
+        self.size = size
+        self.max_restarts = max_restarts
+        self.owner = owner
+
+        # Idle workers, filled lazily as tasks need them
+        self.idle = queue.Queue()
+        self.workers = []
+        if owner is not None:
+            self.idle.put(owner)
+
+        # Number of workers replaced after a crash
+        self.restarts = 0
+
+    def acquire(self):
+        """
+        Take an idle worker, creating a new one if none are free
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            worker = self.factory()
+            self.workers.append(worker)
+            return worker
+
+    def restart(self, worker):
+        """
+        Shut down a crashed worker and return a fresh one in its place
+        """
+        self.restarts += 1
+
+        # The owner is still used outside the pool, so it keeps its place with a new browser
+        if worker is self.owner:
+            worker.recycle_browser('crash')
+            return worker
+
+        try:
+            worker.browser.quit()
+        except WebDriverException:
+            pass
+
+        self.workers.remove(worker)
+
+        new_worker = self.factory()
+        self.workers.append(new_worker)
+
+        return new_worker
+
+    def run(self, func, item):
+        """
+        Run func(worker, item) on an idle worker, restarting the worker if its browser dies
+        """
+        worker = self.acquire()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return func(worker, item)
+                except WebDriverException as e:
+                    if attempt >= self.max_restarts:
+                        raise
+                    attempt += 1
+                    print('Restarting crashed browser: ' + str(e).strip())
+                    worker = self.restart(worker)
+        finally:
+            self.idle.put(worker)
+
+    def map(self, func, items):
+        """
+        Apply func(worker, item) to every item using the pool
+        input:
+            func - Function taking a worker and one item
+            items - List of items to process
+        output:
+            List of results in the same order as items
+        """
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(lambda item: self.run(func, item), items))
+
+    def close(self):
+        """
+        Quit every worker's browser, except the owner's
+        """
+        for worker in self.workers:
+            try:
+                worker.browser.quit()
+            except WebDriverException:
+                pass
+
+        self.workers = []
+        self.idle = queue.Queue()
+        if self.owner is not None:
+            self.idle.put(self.owner)
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from cleaning import CLEANERS
+from scores import type_results
+from storage import CATEGORIES
+from metrics import RunMetrics
+
+
+def process_category(category, df):
+    """
+    Clean and type the results of one category, on its own so it can run in a worker process
+    input:
+        category - Result category
+        df - Raw results, or the path of a csv file to read them from
+    output:
+        Typed df
+    """
+    if isinstance(df, str):
+        df = pd.read_csv(os.path.expanduser(df), dtype=str)
+
+    return type_results(category, CLEANERS[category](df))
+
+
+def process_results(dfs, processes=None):
+    """
+    Clean and type every category, each category in its own process
+    The four category pipelines don't share anything, so they run at the same time on separate cores
+    input:
+        dfs - List of lead, speed, boulder, and combined dfs (or csv paths to read them from)
+        processes - Number of worker processes, None for one per category up to the number of cores,
+                    1 to do everything in this process
+    output:
+        List of typed dfs in the same order, empty dfs are passed through as they are
+    """
+    jobs = [(category, df) for category, df in zip(CATEGORIES, dfs) if isinstance(df, str) or len(df) > 0]
+
+    if processes is None:
+        processes = min(len(jobs), os.cpu_count() or 1)
+
+    if processes <= 1 or len(jobs) <= 1:
+        done = {category: process_category(category, df) for category, df in jobs}
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {category: pool.submit(process_category, category, df) for category, df in jobs}
+            done = {category: future.result() for category, future in futures.items()}
+
+    return [done.get(category, df) for category, df in zip(CATEGORIES, dfs)]
+
+
+def save_results(dfs, store, athletes=None, aggregates=None, metrics=None, processes=1):
+    """
+    Clean, type, and store results, index their athletes, and update the aggregates
+    Only the competitions in dfs are written, nothing already stored is rewritten
+    input:
+        dfs - List of lead, speed, boulder, and combined dfs (or csv paths to read them from)
+        store - PartitionedStore to append to
+        athletes - AthleteIndex to update, None to leave it
+        aggregates - AggregateStore to update, None to leave it
+        metrics - RunMetrics the stages are timed in
+        processes - Number of processes the categories are cleaned in, see process_results
+    output:
+        List of manifest entries that were written
+    """
+    metrics = RunMetrics(None) if metrics is None else metrics
+
+    with metrics.stage('clean'):
+        dfs = process_results(dfs, processes)
+
+    written = []
+    for category, df in zip(CATEGORIES, dfs):
+        if len(df) == 0:
+            continue
+
+        with metrics.stage('write'):
+            entries = store.append(category, df)
+        if athletes is not None:
+            with metrics.stage('index'):
+                athletes.update_partitions(store, entries)
+        if aggregates is not None:
+            with metrics.stage('aggregate'):
+                aggregates.update_partitions(store, entries)
+        written += entries
+
+    return written
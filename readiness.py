@@ -0,0 +1,154 @@
+import time
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+
+
+class ElementCountStable():
+    """
+    WebDriverWait condition that is met once the number of elements matching an xpath
+    has reached a minimum and has stopped changing for a short settle period
+    Optionally also waits for an element from the previously loaded page to go stale,
+    since results pages only change their url fragment and keep the old DOM around
+    """
+
+    def __init__(self, xpath, minimum=1, settle=0.5, previous=None):
+        """
+        input:
+            xpath - xpath of the elements to count
+            minimum - Number of elements needed before the page can be considered ready
+            settle - Seconds the count must stay unchanged
+            previous - Element from the previous page that must go stale first (or None)
+        """
+        self.xpath = xpath
+        self.minimum = minimum
+        self.settle = settle
+        self.previous = previous
+
+        self.last_count = None
+        self.changed_at = None
+
+    def __call__(self, browser):
+        # Old content still attached, page hasn't been swapped out yet
+        if self.previous is not None:
+            try:
+                self.previous.is_enabled()
+                return False
+            except StaleElementReferenceException:
+                self.previous = None
+
+        count = len(browser.find_elements_by_xpath(self.xpath))
+        now = time.monotonic()
+
+        # Count changed, restart the settle window
+        if count != self.last_count:
+            self.last_count = count
+            self.changed_at = now
+            return False
+
+        return count >= self.minimum and now - self.changed_at >= self.settle
+
+
+# Condition settings per page type
+# xpath - elements whose count tells us the data has been rendered
+# minimum - how many of them must be present
+PAGE_CONDITIONS = {
+    # compChooser options are populated
+    'last_result': {'xpath': "//select[@class='compChooser']/option", 'minimum': 1},
+    # Subcategory headers with links to complete results are present
+    'competition': {'xpath': "//th[@colspan='4']", 'minimum': 1},
+    # Header row plus at least one result row, and the row count has stopped changing
+    'results': {'xpath': "//tr", 'minimum': 2},
+}
+
+# Wait for the main page section when we don't know what kind of page we're on
+DEFAULT_XPATH = "//div[@class='uk-section-primary uk-section uk-section-xsmall']"
+
+
+class PageReadiness():
+    """
+    Waits until pages are ready to be scraped using conditions specific to each page type
+    and keeps a record of how long each wait took
+    """
+
+    def __init__(self, conditions=None, settle=0.5, poll=0.1):
+        """
+        input:
+            conditions - Dict of page type to condition settings, defaults to PAGE_CONDITIONS
+            settle - Seconds an element count must stay unchanged before the page is ready
+            poll - Seconds between checks of the condition
+        """
+        self.conditions = dict(PAGE_CONDITIONS) if conditions is None else conditions
+        self.settle = settle
+        self.poll = poll
+
+        # List of (page type, link, seconds waited, timed out) for every wait
+        self.wait_log = []
+
+    def marker(self, browser, page_type):
+        """
+        Grab an element from the currently loaded page that will go stale once the next
+        page of this type replaces it
+        input:
+            browser - Selenium webdriver
+            page_type - Type of the page about to be loaded
+        output:
+            Element or None if there is nothing to watch
+        """
+        if page_type not in self.conditions:
+            return None
+
+        found = browser.find_elements_by_xpath(self.conditions[page_type]['xpath'])
+
+        return found[0] if found else None
+
+    def wait(self, browser, link, page_type=None, timeout=20, previous=None):
+        """
+        Block until the page is ready or the timeout is reached
+        input:
+            browser - Selenium webdriver
+            link - Link of the page being loaded, used for the wait log
+            page_type - Key into the conditions, or None to only wait for the main section
+            timeout - Seconds to wait before raising TimeoutException
+            previous - Element from the previous page, see marker()
+        output:
+            Seconds spent waiting
+        """
+        if page_type in self.conditions:
+            settings = self.conditions[page_type]
+            condition = ElementCountStable(settings['xpath'], settings.get('minimum', 1),
+                                           settings.get('settle', self.settle), previous)
+        else:
+            condition = ElementCountStable(DEFAULT_XPATH, settle=0)
+
+        start = time.monotonic()
+        try:
+            WebDriverWait(browser, timeout, poll_frequency=self.poll).until(condition)
+        except TimeoutException:
+            self.wait_log.append((page_type, link, time.monotonic() - start, True))
+            raise
+
+        waited = time.monotonic() - start
+        self.wait_log.append((page_type, link, waited, False))
+
+        return waited
+
+    def summary(self):
+        """
+        Summarize the wait log per page type
+        input:
+            N/A
+        output:
+            Dict of page type to dict with count, total, mean and max seconds and timeouts
+        """
+        summary = {}
+        for page_type, _, waited, timed_out in self.wait_log:
+            stats = summary.setdefault(page_type, {'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0})
+            stats['count'] += 1
+            stats['total'] += waited
+            stats['max'] = max(stats['max'], waited)
+            stats['timeouts'] += int(timed_out)
+
+        for stats in summary.values():
+            stats['mean'] = stats['total'] / stats['count']
+
+        return summary
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+
+class ResultPage():
+    """
+    Results table of one complete result page
+    The competition info (title, date, category) is kept once for the page instead of on every
+    row, and rows are the cell strings as they were read, without a header attached to each cell
+    """
+
+    __slots__ = ('meta', 'headers', 'rows')
+
+    def __init__(self, meta, headers, rows):
+        """
+        input:
+            meta - List of (name, value) touples shared by every row, later values win
+            headers - List of column headers
+            rows - List of rows, each a list of cell strings in header order
+        """
+        self.meta = dict(meta)
+        self.headers = list(headers)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_record(self):
+        """
+        json serializable copy of the page, see from_record
+        """
+        return {'meta': list(self.meta.items()), 'headers': self.headers, 'rows': self.rows}
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Rebuild a page saved with to_record
+        """
+        return cls(record['meta'], record['headers'], record['rows'])
+
+    def column_values(self):
+        """
+        The page's cells a column at a time
+        A row shorter than the headers has no value for the columns it is missing, and when a
+        header is repeated the last cell under it wins, same as turning each row into a dict.
+        Headers that no row has a cell under are left out
+        output:
+            Dict of header to list of values in the order the headers first appear, np.nan where a row has no value
+        """
+        width = max((len(row) for row in self.rows), default=0)
+
+        positions = {}
+        for i, header in enumerate(self.headers[:width]):
+            positions.setdefault(header, []).append(i)
+
+        columns = {}
+        for header, indexes in positions.items():
+            if len(indexes) == 1:
+                i = indexes[0]
+                columns[header] = [row[i] if i < len(row) else np.nan for row in self.rows]
+            else:
+                columns[header] = [next((row[i] for i in reversed(indexes) if i < len(row)), np.nan)
+                                   for row in self.rows]
+
+        return columns
+
+
+class ColumnBuilder():
+    """
+    Collects result pages into per-column buffers and builds a DataFrame from them in one go
+    Competition info is stored as one value and a row count per page, and handed to pandas as
+    categoricals, so title and date strings aren't repeated on every row
+    The DataFrame is the same as one built from a dict per row (competition info, then the
+    row's cells under their headers): columns are in the order a row first has them, and a table
+    column named like a piece of competition info wins over it where the row has a cell
+    """
+
+    def __init__(self):
+        # Column name -> list of values, every buffer is as long as the rows added so far
+        self.columns = {}
+        # Competition info column name -> (dict of distinct value to code, list of (code, row count) runs)
+        self.meta = {}
+        # Every column name in the order a row first had it
+        self.order = {}
+        self.length = 0
+
+    def add(self, page):
+        """
+        Append the rows of a ResultPage
+        """
+        count = len(page)
+        if count == 0:
+            return
+
+        table = page.column_values()
+
+        # Rows have their competition info first, then their cells
+        for name in list(page.meta) + list(table):
+            self.order.setdefault(name)
+
+        # Competition info a table column also fills can't be kept as runs any more
+        for name in table:
+            if name in self.meta:
+                self.to_plain(name)
+
+        for name, value in page.meta.items():
+            if name in table:
+                # The table's cell wins, rows without one keep the competition info
+                self.plain(name).extend([value if x is np.nan else x for x in table.pop(name)])
+            elif name in self.columns:
+                self.columns[name].extend([value] * count)
+            else:
+                if name not in self.meta:
+                    # Column only starts now, earlier rows have no value for it
+                    self.meta[name] = ({}, [(-1, self.length)] if self.length else [])
+                codes, runs = self.meta[name]
+                runs.append((-1 if value is None else codes.setdefault(value, len(codes)), count))
+
+        for name, (_, runs) in self.meta.items():
+            if name not in page.meta:
+                runs.append((-1, count))
+
+        for name, values in table.items():
+            self.plain(name).extend(values)
+
+        self.length += count
+
+        # Columns this page didn't have
+        for values in self.columns.values():
+            if len(values) < self.length:
+                values.extend([np.nan] * (self.length - len(values)))
+
+    def plain(self, name):
+        """
+        Value buffer of a table column, started with missing values for the rows before it
+        """
+        if name not in self.columns:
+            self.columns[name] = [np.nan] * self.length
+
+        return self.columns[name]
+
+    def to_plain(self, name):
+        """
+        Turn a competition info column into a plain value buffer
+        """
+        codes, runs = self.meta.pop(name)
+        values = list(codes)
+
+        self.columns[name] = [x for code, length in runs for x in [np.nan if code == -1 else values[code]] * length]
+
+    def frame(self):
+        """
+        Build the DataFrame, columns in the order rows first had them
+        output:
+            DataFrame with a row per result row added
+        """
+        data = {}
+        for name in self.order:
+            if name in self.meta:
+                # Code -1 is a missing value
+                codes, runs = self.meta[name]
+                data[name] = pd.Categorical.from_codes(np.repeat([x[0] for x in runs], [x[1] for x in runs]),
+                                                       categories=pd.Index(list(codes), dtype=object))
+            else:
+                data[name] = self.columns[name]
+
+        return pd.DataFrame(data)
@@ -0,0 +1,196 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket():
+    """
+    Rate limit of a number of requests per second, allowing short bursts
+    Tokens are reserved rather than waited for, so the same bucket works for threads (which
+    sleep) and the http fetcher's event loop (which awaits)
+    """
+
+    def __init__(self, rate, burst):
+        """
+        input:
+            rate - Requests per second on average
+            burst - Requests that can be made at once after being idle
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, going into debt if there are none left
+        output:
+            Seconds the caller has to wait before making its request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RequestScheduler():
+    """
+    Every page load goes through the scheduler, which paces requests to each host with a token
+    bucket and retries failed loads with exponential backoff and jitter
+    Pages that still fail are remembered with the reason, so the run can carry on and requeue
+    them at the end instead of stopping
+    """
+
+    def __init__(self, rate=5.0, burst=10, retries=3, backoff=1.0, max_backoff=30.0, jitter=0.5, host_rates=None):
+        """
+        input:
+            rate - Requests per second to a single host, None for no limit
+            burst - Requests to a host that can be made at once after being idle
+            retries - Times a failed page is tried again before giving up on it
+            backoff - Seconds to wait before the first retry, doubled for every retry after it
+            max_backoff - Longest wait between retries
+            jitter - Fraction of the wait added or removed at random, so parallel workers
+                     don't all retry at the same moment
+            host_rates - Dict of host to (rate, burst) for hosts that need their own limit
+        """
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.host_rates = host_rates or {}
+
+        # Pooled workers share one scheduler
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+        # Every failed attempt as (link, attempt, reason, time)
+        self.failures = []
+        # link -> reason for pages that failed every attempt and haven't been requeued
+        self.failed = {}
+
+    def bucket(self, link):
+        """
+        Token bucket for the host of a link, None if the host isn't limited
+        """
+        host = urlsplit(link).netloc
+        rate, burst = self.host_rates.get(host, (self.rate, self.burst))
+        if rate is None:
+            return None
+
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(rate, burst)
+            return self.buckets[host]
+
+    def delay(self, link):
+        """
+        Reserve a request to a link's host
+        output:
+            Seconds to wait before sending it
+        """
+        bucket = self.bucket(link)
+
+        return 0.0 if bucket is None else bucket.reserve()
+
+    def throttle(self, link):
+        """
+        Block until a request to a link's host is allowed
+        """
+        wait = self.delay(link)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def throttle_async(self, link):
+        """
+        Same as throttle(), for the http fetcher's event loop
+        """
+        wait = self.delay(link)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff_delay(self, attempt):
+        """
+        Seconds to wait before retrying after a given attempt (counting from 0)
+        """
+        wait = self.backoff * 2 ** attempt * (1 + random.uniform(-self.jitter, self.jitter))
+
+        return min(self.max_backoff, wait)
+
+    def run(self, link, func, retry_on, on_retry=None, throttle=True):
+        """
+        Load a page, retrying it if it fails
+        input:
+            link - Link of the page, used for rate limiting and to record failures
+            func - Function taking no arguments that makes one attempt at loading the page
+            retry_on - Exception type or touple of types that mean the attempt failed
+            on_retry - Function called with the exception before every retry, e.g. to replace a crashed browser
+            throttle - Wait for the host's rate limit, turned off when the page doesn't need a request
+        output:
+            True if the page loaded, False if every attempt failed
+        """
+        reason = None
+        for attempt in range(self.retries + 1):
+            if throttle:
+                self.throttle(link)
+
+            try:
+                func()
+            except retry_on as e:
+                reason = type(e).__name__ + (': ' + str(e).strip() if str(e).strip() else '')
+                with self.lock:
+                    self.failures.append((link, attempt, reason, time.time()))
+
+                if attempt == self.retries:
+                    break
+
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            with self.lock:
+                self.failed.pop(link, None)
+            return True
+
+        with self.lock:
+            self.failed[link] = reason
+        return False
+
+    def requeue(self):
+        """
+        Hand back the pages that failed every attempt so they can be tried again, and forget them
+        output:
+            Dict of link to the reason it last failed
+        """
+        with self.lock:
+            failed = self.failed
+            self.failed = {}
+
+        return failed
+
+    def summary(self):
+        """
+        Failure counts for the run
+        output:
+            Dict with the number of failed attempts, the failures per reason, and the pages still failing
+        """
+        with self.lock:
+            reasons = {}
+            for _, _, reason, _ in self.failures:
+                # Only the exception type, messages contain links and timings
+                kind = reason.split(':')[0]
+                reasons[kind] = reasons.get(kind, 0) + 1
+
+            return {
+                'failed_attempts': len(self.failures),
+                'reasons': reasons,
+                'failed_pages': dict(self.failed),
+            }
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+
+# Round columns holding scores for each category, after cleaning
+ROUND_COLUMNS = {
+    'lead': ['Qualification', 'Qualification 1', 'Qualification 2', 'Semifinal', 'Final'],
+    'boulder': ['Qualification', 'Qualification 1', 'Qualification 2', 'Semifinal', 'Final'],
+    'speed': ['Qualification', '1/8 - Final', '1/4 - Final', '1/2 - Final', 'Small final', 'Final'],
+    'combined': [],
+}
+
+# Columns repeated on every row of a comp, stored as categoricals
+CATEGORICAL_COLUMNS = ['Competition Title', 'Competition Date', 'Category', 'Nation']
+
+# Plain numeric columns and the dtype they are stored as
+NUMERIC_COLUMNS = {
+    'Rank': 'Int16',
+    'StartNr': 'Int16',
+    'Points': 'float32',
+    'Final Points': 'float32',
+}
+
+
+def first_value(scores):
+    """
+    Consolidated round columns can hold several comma separated scores, use the first one
+    """
+    return scores.astype('string').str.split(',').str[0].str.strip()
+
+
+def parse_boulder(scores):
+    """
+    Parse boulder scores like '3T4z89' (3 tops, 4 zones, 8 attempts to top, 9 attempts to zone)
+    The attempt counts are printed next to each other, so they are split at the point that
+    gives valid counts (at least as many attempts as tops/zones, no leading zeros) with the
+    two numbers closest together
+    input:
+        scores - Series of score strings
+    output:
+        DataFrame with tops, zones, top attempts, and zone attempts columns
+    """
+    parts = first_value(scores).str.extract(r'^(\d+)T(\d+)z(\d+)$')
+    tops = pd.to_numeric(parts[0])
+    zones = pd.to_numeric(parts[1])
+    digits = parts[2].astype('string')
+
+    top_attempts = pd.Series(np.nan, index=scores.index)
+    zone_attempts = pd.Series(np.nan, index=scores.index)
+    best_gap = pd.Series(np.inf, index=scores.index)
+
+    max_len = digits.str.len().max()
+    max_len = 0 if pd.isna(max_len) else int(max_len)
+
+    # Try every split point of the attempt digits
+    for k in range(1, max_len):
+        top_str = digits.str[:k]
+        zone_str = digits.str[k:]
+
+        valid = (zone_str.str.len() > 0).fillna(False)
+        for part in (top_str, zone_str):
+            valid &= ((part.str.len() == 1) | ~part.str.startswith('0')).fillna(False)
+
+        ta = pd.to_numeric(top_str, errors='coerce')
+        za = pd.to_numeric(zone_str, errors='coerce')
+        valid &= (ta >= tops) & (za >= zones) & ((tops > 0) | (ta == 0)) & ((zones > 0) | (za == 0))
+
+        gap = (ta - za).abs()
+        better = valid & (gap < best_gap)
+
+        top_attempts = top_attempts.mask(better, ta)
+        zone_attempts = zone_attempts.mask(better, za)
+        best_gap = best_gap.mask(better, gap)
+
+    return pd.DataFrame({
+        'tops': tops.astype('Int8'),
+        'zones': zones.astype('Int8'),
+        'top attempts': top_attempts.astype('Int16'),
+        'zone attempts': zone_attempts.astype('Int16'),
+    })
+
+
+def parse_lead(scores):
+    """
+    Parse lead scores like '46+', '39', 'Top', or with a round rank appended like '50+1.' and '44 2.'
+    Older qualification results only give a rank and points, e.g. '12. [45.50]'
+    input:
+        scores - Series of score strings
+    output:
+        DataFrame with height, plus, top, and round rank columns
+    """
+    scores = first_value(scores)
+
+    parts = scores.str.extract(r'^(?:(?P<top>Top)|(?P<height>\d+(?:\.\d+)?)(?P<plus>\+)?)\s*(?:(?P<rank>\d+)\.)?$')
+    ranked = scores.str.extract(r'^(?P<rank>\d+)\.\s*\[[\d.]+\]$')
+
+    parsed = parts['top'].notna() | parts['height'].notna()
+    rank = pd.to_numeric(parts['rank']).fillna(pd.to_numeric(ranked['rank']))
+
+    return pd.DataFrame({
+        'height': pd.to_numeric(parts['height']).astype('float32'),
+        'plus': (parts['plus'] == '+').astype('boolean').mask(~parsed),
+        'top': (parts['top'] == 'Top').astype('boolean').mask(~parsed),
+        'rank': rank.astype('Int16'),
+    })
+
+
+def parse_speed(scores):
+    """
+    Parse speed scores, which are either a time like '7.232' or a marker like 'fall',
+    'false start', or 'Wildcard'
+    input:
+        scores - Series of score strings
+    output:
+        DataFrame with time, fall, false start, and wildcard columns
+    """
+    scores = first_value(scores)
+    text = scores.str.lower()
+    present = scores.notna() & (scores != '')
+
+    return pd.DataFrame({
+        'time': pd.to_numeric(scores.where(scores.str.match(r'^\d+(?:\.\d+)?$')), errors='coerce').astype('float32'),
+        'fall': (text == 'fall').astype('boolean').mask(~present),
+        'false start': (text == 'false start').astype('boolean').mask(~present),
+        'wildcard': (text == 'wildcard').astype('boolean').mask(~present),
+    })
+
+
+# Score parser for each category
+PARSERS = {
+    'lead': parse_lead,
+    'boulder': parse_boulder,
+    'speed': parse_speed,
+}
+
+
+def compact_dtypes(df):
+    """
+    Store repeated strings as categoricals and plain numbers as small numeric types
+    input:
+        df - pandas dataframe of results
+    output:
+        df with compact dtypes
+    """
+    df = df.copy()
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    for col, dtype in NUMERIC_COLUMNS.items():
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            if dtype.startswith('Int'):
+                # Non-integer values (shouldn't happen, but e.g. '15.5') become missing
+                values = values.where(values == values.round())
+            df[col] = values.astype(dtype)
+
+    return df
+
+
+def type_results(category, df):
+    """
+    Add parsed numeric columns for every round score and compact the dtypes of a cleaned df
+    The original score strings are kept, parsed columns are named '<round> <field>',
+    e.g. 'Final tops' or 'Semifinal height'
+    input:
+        category - Result category
+        df - Cleaned pandas dataframe of results
+    output:
+        Typed df
+    """
+    parser = PARSERS.get(category)
+
+    parsed = []
+    if parser is not None:
+        for col in ROUND_COLUMNS[category]:
+            if col in df.columns:
+                parsed.append(parser(df[col]).add_prefix(col + ' '))
+
+    if parsed:
+        df = pd.concat([df] + parsed, axis=1)
+
+    return compact_dtypes(df)
@@ -1,12 +1,28 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from http_fetch import HTTPFetcher, FETCH_ERRORS
+from cache import PageCache
+from storage import CATEGORIES, DEFAULT_ARROW_DIR, PartitionedStore
+from checkpoint import CheckpointLog
+from cleaning import clean_boulder, clean_combined, clean_lead, clean_speed
+from athletes import AthleteIndex
+from aggregates import AggregateStore
+from ledger import ScrapeLedger
+from dedupe import merge_results
+from metrics import RunMetrics
+from scheduler import RequestScheduler
+from parsing import EmptyPageError, parse_comp_options, parse_subcategory_links, parse_result_table
+from results import ResultPage, ColumnBuilder
+import postprocess
 import pandas as pd
 import numpy as np
 import time
 
+# Fragment selecting a season on the last result page, assumed to work like #!comp= but not
+# checked against the live site
+SEASON_FRAGMENT = '#!season='
+
+# Selenium is only imported once a browser is launched, so the http and replay backends and
+# post-processing start without it
+
 class IFSCScraper():
     """
     Define a class for the scraper that will be used to gather data from the IFSC website
@@ -14,25 +30,139 @@ class IFSCScraper():
     Includes methods that allow for scraping different pages and different information
     """
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, readiness=None, workers=1, backend='selenium', fetcher=None,
+                 bulk_extract=True, cache=None, store=None, checkpoint=None, ledger=None, athletes=None,
+                 metrics=None, profile=None, scheduler=None, aggregates=None):
         """
         Initialize a scraper object with its own browser instance
         Input:
             debug - Indicates whether this is a debug instance for quicker development
+            readiness - PageReadiness used to decide when a page is loaded, defaults to PageReadiness()
+                        for the selenium backend
+            workers - Number of browsers used to visit competition and result pages at the same time,
+                      this scraper's own browser is one of them
+            backend - 'selenium' to load pages in Chrome, 'http' to fetch them without a browser,
+                      'replay' to read every page from the cache without going online
+            fetcher - HTTPFetcher used by the http backend, defaults to HTTPFetcher()
+            bulk_extract - Read result tables from a single page_source snapshot instead of
+                           asking the browser for every cell
+            cache - PageCache that every loaded page is saved to, and read from in replay mode
+            store - PartitionedStore that scrape() appends new results to, defaults to PartitionedStore()
+            checkpoint - CheckpointLog that finished pages are recorded in, defaults to CheckpointLog()
+                         when scrape() is run
+            ledger - ScrapeLedger of what has been scraped, defaults to ScrapeLedger() when
+                     check_for_new() is run
+            athletes - AthleteIndex kept up to date with every stored result, defaults to
+                       AthleteIndex() when scrape() is run
+            metrics - RunMetrics that stage timings and counters are recorded in, defaults to RunMetrics()
+            profile - BrowserProfile the selenium backend launches Chrome with and decides when to
+                      replace it, defaults to a headless BrowserProfile()
+            scheduler - RequestScheduler every page load goes through, for rate limiting and retries,
+                        defaults to RequestScheduler()
+            aggregates - AggregateStore of stats kept up to date with every stored result, defaults to
+                         AggregateStore() when scrape() is run
         """
 
         self.debug = debug
+        self.bulk_extract = bulk_extract
+
+        # Per page type readiness conditions, also records how long each wait took
+        self.readiness = readiness
+
+        # html of the current page, fetched, replayed, or snapshotted from the browser by read_page
+        self.page_html = None
+        # What read_page parsed out of page_html, so checking a page and then reading it parses it once
+        self.parsed = (None, {})
+        self.fetcher = None
+        self.pool = None
+
+        # Raw page snapshots
+        self.cache = cache
+
+        # Where scrape() saves results, created when first needed
+        self.store = store
+
+        # Record of finished pages so an interrupted run can pick up where it left off
+        self.checkpoint = checkpoint
+
+        # Record of every subcategory scraped, across runs
+        self.ledger = ledger
+
+        # Skip subcategories the ledger says are done, turned off to rebuild everything
+        self.only_new = True
+
+        # Scraper whose pool this one is a worker in, its settings apply to every worker
+        self.owner = None
+
+        # Pages extracted but not stored yet, keyed by link, they go into the ledger once their batch is saved
+        self.unsaved = {}
+
+        # Index of where each athlete's results are stored
+        self.athletes = athletes
 
-        # Add incognito arg to webdriver
-        option = webdriver.ChromeOptions()
-        option.add_argument(" — incognito")
+        # Precomputed stats, rankings, and ratings
+        self.aggregates = aggregates
+
+        # Where the run spends its time
+        self.metrics = RunMetrics() if metrics is None else metrics
+
+        # Paces page loads and retries the ones that fail
+        self.scheduler = RequestScheduler() if scheduler is None else scheduler
+
+        if backend == 'replay':
+            # Everything comes out of the cache, no browser or network
+            self.browser = None
+            if self.cache is None:
+                self.cache = PageCache()
+            return
+        elif backend == 'http':
+            # Fetch pages over plain http, no browser needed
+            self.browser = None
+            self.fetcher = HTTPFetcher(scheduler=self.scheduler) if fetcher is None else fetcher
+            return
+        elif backend != 'selenium':
+            raise ValueError('Unknown backend: ' + str(backend))
+
+        from browser import BrowserProfile
+        from readiness import PageReadiness
+        from pool import BrowserPool
+
+        if self.readiness is None:
+            self.readiness = PageReadiness()
+
+        # Headless incognito Chrome with images, fonts, stylesheets, and trackers blocked
+        self.profile = BrowserProfile() if profile is None else profile
 
         # Create new instance of Chrome
-        self.browser = webdriver.Chrome(options=option)
+        self.browser = self.profile.launch()
+
+        # Pages loaded since the browser was launched, it gets replaced once there are too many
+        self.browser_pages = 0
+
+        # Browsers for visiting comp and result pages in parallel, this one is the first of them
+        # and the pool only launches the others
+        if workers > 1:
+            self.pool = BrowserPool(self.new_worker, workers, owner=self)
 
         time.sleep(1)
 
 
+    def new_worker(self):
+        """
+        Create a scraper with its own browser for the pool, sharing this scraper's settings
+        input:
+            N/A
+        output:
+            IFSCScraper
+        """
+        worker = IFSCScraper(debug=self.debug, readiness=self.readiness, bulk_extract=self.bulk_extract,
+                             cache=self.cache, checkpoint=self.checkpoint, ledger=self.ledger,
+                             metrics=self.metrics, profile=self.profile, scheduler=self.scheduler)
+        worker.unsaved = self.unsaved
+        worker.owner = self
+
+        return worker
+
     def get_last_result_html(self):
         """
         Returns the html for the world competition last result page
@@ -46,14 +176,14 @@ class IFSCScraper():
         # Page url
         url = 'https://www.ifsc-climbing.org/index.php/world-competition/last-result'
 
-        self.load_page(url)
+        self.load_page(url, page_type='last_result')
 
 
-    def get_comp_links(self):
+    def get_comp_links(self, season=None):
         """
         Parse the world-competition/last-result page to find and return comp names, dates, and links
         input:
-            N/A
+            season - Year to list the competitions of, None for the ones the page shows by default
         output:
             List of touples containing comp names, dates, and url strings for each competition result page
         """
@@ -61,21 +191,30 @@ class IFSCScraper():
         # Page url
         url = 'https://www.ifsc-climbing.org/index.php/world-competition/last-result'
 
-        self.load_page(url)
+        # Assumes the page picks its season from the url fragment the way it picks a comp, see SEASON_FRAGMENT
+        page_url = url if season is None else url + SEASON_FRAGMENT + str(season)
+
+        if not self.load_page(page_url, page_type='last_result'):
+            return []
 
-        comp_list = self.browser.find_elements_by_xpath("//select[@class='compChooser']")
+        # Options of the compChooser select
+        options = self.read_page(parse_comp_options)
 
+        # An empty list would look like a season without comps, so say why instead
+        if not options:
+            raise EmptyPageError('No comps listed on ' + page_url + ', the page may have been read without running '
+                                 'its scripts (see parsing.fragment_to_query)')
 
         # List of comp names
-        comp_list = [x.find_elements_by_tag_name('option') for x in comp_list]
-        comp_list = comp_list[0]
-        comp_names = [x.text for x in comp_list]
-        
+        comp_names = [x[0] for x in options]
+
         # List of comp dates
-        comp_dates = [x.get_attribute('title') for x in comp_list]
+        comp_dates = [x[1] for x in options]
+
+        # List of comp ids
+        comp_links = [x[2] for x in options]
 
         # List of links to comps
-        comp_links = [x.get_attribute('value') for x in comp_list]
         comp_links = [url + '#!comp=' + x for x in comp_links]
         
 
@@ -92,43 +231,56 @@ class IFSCScraper():
         """
 
         if self.debug:
-            limit = 3
-            curr = 0
+            comp_info = comp_info[:4]
 
-        # Hold new comp info
-        new_info = []
+        # Fetch comp pages ahead of time when we aren't using a browser
+        self.prefetch([comp[-1] for comp in comp_info])
 
-        # Iterate through comps and visit each link
-        for comp in comp_info:
-            # Extract link
-            comp_link = comp[-1]
-            
-            self.load_page(comp_link)
+        # Visit each comp, in parallel if we have a pool of browsers
+        return self.map_comps(IFSCScraper.get_result_links_for_comp, comp_info)
+
+    def get_result_links_for_comp(self, comp):
+        """
+        Visit a single competition page and add the complete result links for its subcategories
+        input:
+            comp: Touple of comp name, date, and link to page for comp results
+        output:
+            Touple of comp name, date, link, followed by (subcategory name, url) touples
+        """
+        # Extract link
+        comp_link = comp[-1]
+
+        # Links were already found in an earlier run
+        if self.checkpoint is not None and comp_link in self.checkpoint.comps:
+            return self.checkpoint.comps[comp_link]
+
+        # Left without subcategories, the run tries it again at the end
+        if not self.load_page(comp_link, page_type='competition'):
+            return comp
+
+        # Subcategory headers and the links to their complete results
+        links = self.read_page(parse_subcategory_links, comp_link)
 
-            # List of subcategories of competitions
-            cat_list = self.browser.find_elements_by_xpath("//th[@colspan='4']")
-            temp = [x.find_elements_by_tag_name('a') for x in cat_list]
-            cat_list = [x.text for x in cat_list]
+        # List of subcategories of competitions
+        cat_list = [x[0] for x in links]
 
-            # List of links to subcategories
-            cat_links = [x[0].get_attribute('href') for x in temp]
+        # List of links to subcategories
+        cat_links = [x[1] for x in links]
 
-            # Package info as tuples
-            new_tuple = [((name, link),) for name, link in zip(cat_list, cat_links)]
+        # Package info as tuples
+        new_tuple = [((name, link),) for name, link in zip(cat_list, cat_links)]
 
-            # Add tuples to current info
-            for tup in new_tuple:
-                comp += tup
+        # Add tuples to current info
+        for tup in new_tuple:
+            comp += tup
 
-            new_info.append(comp)
+        if self.checkpoint is not None:
+            self.checkpoint.add_comp(comp)
 
-            if self.debug:
-                curr += 1
-                if curr > limit:
-                    break
+        if self.ledger is not None:
+            self.ledger.record_comp(comp[0], comp[1], comp_link, cat_list)
 
-        return new_info
-    
+        return comp
 
     def get_sub_comp_info(self, comp_info):
         """
@@ -139,67 +291,215 @@ class IFSCScraper():
             List of tuples containing info about each comp
         """
 
-        if self.debug:
-            lim = 3
-            cnt = 0
-
         # Hold new comp info
         lead_data = []
         speed_data = []
         boulder_data = []
         combined_data = []
 
-        # Iterate through comps
-        for comp in comp_info:
-            # Preserve info about this comp
-            this_comp_info = [('Competition Title', comp[0]), ('Competition Date', comp[1])]
-            # Iterate through subcategories
-            for subcat in comp[3:]:
-                # Subcategory type
-                cat_type = subcat[0][:-16]
-
-                # Open link
-                link = subcat[1]
-
-                # Load subcategory
-                self.load_page(link)
-
-                # Lead
-                if cat_type[-4:] == 'lead':
-                    this_comp_info.append(('Category', cat_type[-4:]))
-                    this_lead_data = self.get_data_on_page(this_comp_info)
-                    lead_data.append(this_lead_data)
-                # Speed
-                elif cat_type[-5:] == 'speed':
-                    this_comp_info.append(('Category', cat_type[-5:]))
-                    this_speed_data = self.get_data_on_page(this_comp_info)
-                    speed_data.append(this_speed_data)
-                # Bouldering
-                elif cat_type[-7:] == 'boulder' or cat_type[-10:] == 'bouldering':
-                    this_comp_info.append(('Category', cat_type[-7:]))
-                    this_boulder_data = self.get_data_on_page(this_comp_info)
-                    boulder_data.append(this_boulder_data)
-                # Combined
-                elif cat_type[-8:] == 'combined':
-                    this_comp_info.append(('Category', cat_type[-8:]))
-                    this_combined_data = self.get_data_on_page(this_comp_info)
-                    combined_data.append(this_combined_data)
-                else:
-                    # Find out what category this actually was so we can find edge cases
-                    print(cat_type)
-
-                if self.debug:
-                    cnt += 1
-                    if cnt > lim:
-                        break
-                
+        # Fetch result pages ahead of time when we aren't using a browser
+        self.prefetch([subcat[1] for comp in comp_info for subcat in comp[3:]])
+
+        # Visit each comp, in parallel if we have a pool of browsers
+        comp_results = self.map_comps(IFSCScraper.get_data_for_comp, comp_info)
+
+        # Merge results back together in comp order
+        for comp_lead, comp_speed, comp_boulder, comp_combined in comp_results:
+            lead_data += comp_lead
+            speed_data += comp_speed
+            boulder_data += comp_boulder
+            combined_data += comp_combined
+
         return [lead_data, speed_data, boulder_data, combined_data]
 
+    def get_data_for_comp(self, comp):
+        """
+        Visit the complete result page of every subcategory in a competition and gather the results
+        input:
+            comp: Touple of comp info followed by (subcategory name, url) touples
+        output:
+            List of lead, speed, boulder, and combined data for this comp, a category with a page
+            that failed to load is left empty
+        """
+        # Hold this comp's data for lead, speed, boulder, and combined
+        cat_data = [[], [], [], []]
+
+        # Preserve info about this comp
+        this_comp_info = [('Competition Title', comp[0]), ('Competition Date', comp[1])]
+
+        subcats = comp[3:]
+        if self.debug:
+            subcats = subcats[:4]
+
+        # Results are saved per category, so a category is only skipped once all of its
+        # subcategories in this comp were scraped with their finals done
+        done = self.completed_categories(comp[0], subcats)
+
+        # Categories with a page that failed to load, and the pages kept for the ledger
+        failed = set()
+        pages = []
+
+        # Iterate through subcategories
+        for subcat in subcats:
+            # Subcategory type
+            cat_type = subcat[0][:-16]
+
+            # Open link
+            link = subcat[1]
+
+            # Results were already extracted in an earlier run
+            if self.checkpoint is not None and link in self.checkpoint.pages:
+                index, this_data = self.checkpoint.pages[link]
+                cat_data[index].append(this_data)
+                pages.append((index, (comp[0], comp[1], cat_type, link, self.category_of(cat_type)[1], this_data)))
+                self.metrics.count('checkpoint_pages')
+                continue
+
+            index, category = self.category_of(cat_type)
+            if index is None:
+                # Find out what category this actually was so we can find edge cases
+                print(cat_type)
+
+                # Recorded as skipped so it doesn't keep the comp incomplete
+                if self.ledger is not None:
+                    self.ledger.record_skipped(comp[0], cat_type, link)
+                continue
+
+            if index in done:
+                self.metrics.count('skipped_pages')
+                continue
+
+            # Load subcategory, failed pages are tried again at the end of the run
+            if not self.load_page(link, page_type='results'):
+                failed.add(index)
+                continue
+
+            this_comp_info.append(('Category', category))
+            this_data = self.get_data_on_page(this_comp_info)
+            cat_data[index].append(this_data)
+
+            # Save the page's results straight away so a crash doesn't lose them
+            if self.checkpoint is not None:
+                self.checkpoint.add_page(link, index, this_data)
+
+            pages.append((index, (comp[0], comp[1], cat_type, link, category, this_data)))
+
+        # A category is saved as one partition, so one that lost a page waits for the requeue pass
+        # or the next run instead of replacing its stored results with part of them. Its loaded
+        # pages stay in the checkpoint
+        for index in failed:
+            cat_data[index] = []
+            self.metrics.count('held_categories')
+
+        # Recorded in the ledger by record_saved once they are stored
+        for index, page in pages:
+            if index not in failed:
+                self.unsaved[page[3]] = page
+
+        return cat_data
+
+    def record_saved(self, comps):
+        """
+        Record the pages of comps whose results were just stored in the ledger, and drop them from the checkpoint
+        A run that stops before a batch is stored leaves its comps incomplete, so they are scraped again
+        input:
+            comps - List of comp touples followed by (subcategory name, url) touples
+        output:
+            N/A
+        """
+        links = [subcat[1] for comp in comps for subcat in comp[3:] if subcat[1] in self.unsaved]
+
+        for link in links:
+            page = self.unsaved.pop(link)
+            if self.ledger is not None:
+                self.ledger.record_page(*page)
+
+        if self.checkpoint is not None:
+            self.checkpoint.mark_saved(links)
+
+    def completed_categories(self, title, subcats):
+        """
+        Find the categories of a comp that don't need scraping again
+        input:
+            title - Competition title
+            subcats - List of (subcategory name, url) touples
+        output:
+            Set of category indexes whose subcategories are all complete in the ledger
+        """
+        # Pool workers follow only_new as it is set on the scraper that owns the pool
+        only_new = self.only_new if self.owner is None else self.owner.only_new
+        if self.ledger is None or not only_new:
+            return set()
+
+        done = set()
+        pending = set()
+        for subcat in subcats:
+            cat_type = subcat[0][:-16]
+            index, _ = self.category_of(cat_type)
+
+            # Pages restored from the checkpoint weren't stored, so their category is scraped in full
+            unsaved = self.checkpoint is not None and subcat[1] in self.checkpoint.pages
+            if self.ledger.is_subcategory_complete(title, cat_type) and not unsaved:
+                done.add(index)
+            else:
+                pending.add(index)
+
+        return done - pending
+
+    def category_of(self, cat_type):
+        """
+        Work out which category a subcategory belongs to
+        input:
+            cat_type - Subcategory header with the trailing 'Complete Result' text removed
+        output:
+            Index into [lead, speed, boulder, combined] and category name, (None, None) if unknown
+        """
+        # Lead
+        if cat_type[-4:] == 'lead':
+            return 0, cat_type[-4:]
+        # Speed
+        elif cat_type[-5:] == 'speed':
+            return 1, cat_type[-5:]
+        # Bouldering
+        elif cat_type[-7:] == 'boulder' or cat_type[-10:] == 'bouldering':
+            return 2, cat_type[-7:]
+        # Combined
+        elif cat_type[-8:] == 'combined':
+            return 3, cat_type[-8:]
+
+        return None, None
+
+    def map_comps(self, method, comp_info):
+        """
+        Apply a per-comp scraper method to every comp, using the browser pool if there is one
+        input:
+            method - Unbound IFSCScraper method taking a single comp
+            comp_info - List of comp tuples
+        output:
+            List of results in the same order as comp_info
+        """
+        if self.pool is None:
+            return [method(self, comp) for comp in comp_info]
+
+        return self.pool.map(method, comp_info)
+
+    def prefetch(self, links):
+        """
+        Fetch a batch of pages concurrently so the following load_page calls don't have to wait
+        Only does anything for the http backend
+        input:
+            links - List of links that are about to be loaded
+        output:
+            N/A
+        """
+        if self.fetcher is not None:
+            self.fetcher.prefetch(links)
+
     def make_df_from_data(self, comp_data):
         """
         Takes the scraped data available in list format and converts it to dataframes
         input:
-            comp_data: List of lists of tuples specifying competition results for different categories
+            comp_data: Lists of ResultPages for lead, speed, boulder, and combined
         output:
             List of dataframes containing data
         """
@@ -211,17 +511,18 @@ class IFSCScraper():
         # for head in lead_data[0][0]:
         #     lead_headers.append(head[0])
 
-        # Create lead df
-        lead_df = self.build_df(lead_data)
+        with self.metrics.stage('build_df'):
+            # Create lead df
+            lead_df = self.build_df(lead_data)
 
-        # Create speed df
-        speed_df = self.build_df(speed_data)
+            # Create speed df
+            speed_df = self.build_df(speed_data)
 
-        # Create boulder df
-        boulder_df = self.build_df(boulder_data)
+            # Create boulder df
+            boulder_df = self.build_df(boulder_data)
 
-        # Create combined df
-        combined_df = self.build_df(combined_data)
+            # Create combined df
+            combined_df = self.build_df(combined_data)
 
         return [lead_df, speed_df, boulder_df, combined_df]
 
@@ -229,341 +530,503 @@ class IFSCScraper():
         """
         Given the data for a category, build a df for it
         input:
-            cat_data - Data scraped for a particular category
+            cat_data - List of ResultPages scraped for a particular category
         output:
             df of the data
         """
-        # Iterate through competitions, build list of dicts for df
-        data_list = []
-        for comp in cat_data:
-            # Iterate through results per comp
-            for result in comp:
-                # Convert to dict
-                this_dict = dict(result)
-                data_list.append(this_dict)
-        
-        # Convert to df
-        df = pd.DataFrame(data_list)
+        # Append every page's cells straight into per-column buffers
+        builder = ColumnBuilder()
+        for page in cat_data:
+            builder.add(page)
 
-        return df
+        # Convert to df
+        return builder.frame()
 
 
     def get_data_on_page(self, prior_info):
         """
-        Helper function that scrapes the data from a complete result page and returns it in a tuple
+        Helper function that scrapes the data from a complete result page
         input:
             prior_info - Comp name, date, subcategory
         output:
-            touple representing the table of results on the page
+            ResultPage holding the table of results on the page
+        """
+
+        with self.metrics.stage('extract'):
+            headers, rows = self.read_table()
+
+            # Fix name, on a copy since read_page keeps what it parsed
+            headers = list(headers)
+            headers[1] = 'LAST'
+            headers.insert(2, 'FIRST')
+
+            # Comp info is kept once for the whole page
+            ret_data = ResultPage(prior_info, headers, rows)
+
+        self.metrics.count('rows', len(ret_data))
+
+        return ret_data
+
+    def read_page(self, parse, *args):
+        """
+        Read something off the loaded page, the same way for every backend
+        The page's html is what was fetched or replayed, or one page_source snapshot of the browser,
+        and it is parsed once per parsing function however often it is read
+        input:
+            parse - Function from parsing.py taking the page's html first
+            args - More arguments for parse
+        output:
+            Whatever parse returns
+        """
+        html = self.current_html()
+        if self.parsed[0] is not html:
+            self.parsed = (html, {})
+
+        key = (parse,) + args
+        if key not in self.parsed[1]:
+            self.parsed[1][key] = parse(html, *args)
+
+        return self.parsed[1][key]
+
+    def current_html(self):
+        """
+        html of the loaded page, the browser is asked for it once per page
+        """
+        if self.page_html is None:
+            # One round trip for the whole page, then everything is parsed locally
+            self.page_html = self.browser.page_source
+
+        return self.page_html
+
+    def read_table(self):
         """
+        Headers and rows of the results table on the loaded page, read cell by cell from the
+        browser when bulk_extract is turned off
+        """
+        if self.browser is not None and not self.bulk_extract:
+            return self.get_table_by_cell()
+
+        return self.read_page(parse_result_table)
+
+    def check_page(self, link, page_type):
+        """
+        Make sure a loaded results page has a results table, raises EmptyPageError if it doesn't
+        A page read before (or without) the site's scripts filling it in then counts as a failed
+        load, which is retried and requeued like any other, instead of stopping the run
+        """
+        if page_type == 'results' and len(self.read_page(parse_result_table)[0]) < 2:
+            raise EmptyPageError('No results table on ' + link + ', the page may have been read without running '
+                                 'its scripts (see parsing.fragment_to_query)')
 
+    def get_table_by_cell(self):
+        """
+        Read the results table from the browser one element at a time
+        Much slower than parsing page_source since every cell is a separate webdriver call
+        input:
+            N/A
+        output:
+            List of header strings, list of rows where each row is a list of cell strings
+        """
         # Get table from webpage
         result_list = self.browser.find_elements_by_tag_name('tr')
-        
+
         # Get headers
         result_headers = [x.find_elements_by_tag_name('th') for x in result_list]
         headers = [x.text for x in result_headers[0]]
-        # Fix name
-        headers[1] = 'LAST'
-        headers.insert(2, 'FIRST')
-        
+
         # Get table rows
         rows = [x.find_elements_by_tag_name('td') for x in result_list]
-        rows = rows[1:]
-
-        # Package data to be returned
-        ret_data = []
+        rows = [[x.text for x in row] for row in rows[1:]]
 
-        # Split rows into tuples and add to list
-        for row in rows:
-            add_this = [x for x in prior_info] + [(header, x.text) for header, x in zip(headers, row)]
-            ret_data.append(add_this)
+        return headers, rows
 
-        return ret_data
-
-    def load_page(self, link, timeout=20, wait_after=10):
+    def load_page(self, link, page_type=None, timeout=20, wait_after=0):
         """
-        Helper function that loads a page and waits for timeout
+        Helper function that loads a page and waits until it is ready to be scraped
+        Loads go through the scheduler, which paces requests to the site and retries pages
+        that fail, replacing the browser first if it crashed
         input:
             link - Link to the page we wish to load
+            page_type - Kind of page ('last_result', 'competition', 'results') which decides
+                        what we wait for, None only waits for the main page section
             timeout - Seconds to wait before timing out
-            wait_after - Seconds to wait after loading
+            wait_after - Extra seconds to sleep after the page is ready
         output:
-            N/A
+            True if the page loaded, False if every attempt failed
+        """
+
+        self.metrics.count('pages')
+
+        if self.fetcher is None and self.browser is None:
+            # Replay a snapshot, trying again wouldn't change anything
+            with self.metrics.stage('load_page.navigate'):
+                self.page_html = self.cache.get(link, expire=False)
+            if self.page_html is None:
+                print("No cached copy of page " + link)
+                self.metrics.count('cache_misses')
+                self.page_html = ''
+                return False
+
+            try:
+                self.check_page(link, page_type)
+            except EmptyPageError as e:
+                print(str(e))
+                self.metrics.count('failed_pages')
+                self.page_html = ''
+                return False
+            return True
+
+        if self.browser is None:
+            # The fetcher waits for the scheduler's rate limit itself, prefetched pages don't need a request
+            loaded = self.scheduler.run(link, lambda: self.fetch_page(link, page_type), FETCH_ERRORS + (EmptyPageError,),
+                                        on_retry=self.before_retry, throttle=False)
+        else:
+            from selenium.common.exceptions import WebDriverException
+            loaded = self.scheduler.run(link, lambda: self.navigate(link, page_type, timeout),
+                                        (WebDriverException, EmptyPageError), on_retry=self.before_retry)
+
+        if not loaded:
+            print("Giving up on page " + link + " for now: " + str(self.scheduler.failed.get(link)))
+            self.metrics.count('failed_pages')
+            self.page_html = ''
+            return False
+
+        if wait_after:
+            with self.metrics.stage('load_page.sleep'):
+                time.sleep(wait_after)
+
+        return True
+
+    def fetch_page(self, link, page_type=None):
+        """
+        Make one attempt at fetching a page over http, raises one of FETCH_ERRORS if it fails, or
+        EmptyPageError if it doesn't have its data
+        """
+        try:
+            with self.metrics.stage('load_page.navigate'):
+                self.page_html = self.fetcher.fetch(link)
+        except FETCH_ERRORS:
+            self.metrics.count('fetch_errors')
+            raise
+
+        self.check_page(link, page_type)
+
+        if self.cache is not None:
+            self.cache.put(link, self.page_html)
+
+    def navigate(self, link, page_type, timeout):
+        """
+        Make one attempt at loading a page in the browser, raises TimeoutException if it doesn't
+        become ready in time, another WebDriverException if the browser crashed, or EmptyPageError
+        if it has no results table
         """
+        from selenium.common.exceptions import TimeoutException
+
+        self.page_html = None
+
+        # Swap in a fresh browser before this one grows too big
+        reason = self.profile.needs_recycle(self.browser, self.browser_pages)
+        if reason is not None:
+            self.recycle_browser(reason)
+        self.browser_pages += 1
+
+        # Remember something from the current page so we can tell when it has been replaced
+        previous = self.readiness.marker(self.browser, page_type)
 
         # Visit link
-        self.browser.get(link)
+        with self.metrics.stage('load_page.navigate'):
+            self.browser.get(link)
 
-        # Attempt to open link
+        # Wait until the data on the page has been rendered
         try:
-            WebDriverWait(self.browser, timeout).until(EC.visibility_of_element_located((By.XPATH,
-            "//div[@class='uk-section-primary uk-section uk-section-xsmall']")))
+            with self.metrics.stage('load_page.wait'):
+                self.readiness.wait(self.browser, link, page_type, timeout, previous)
         except TimeoutException:
             print("Timed out waiting for page " + link + " to load")
+            self.metrics.count('timeouts')
+            raise
+
+        self.check_page(link, page_type)
+
+        # Keep a snapshot of the rendered page
+        if self.cache is not None:
+            self.cache.put(link, self.current_html())
+
+    def before_retry(self, error):
+        """
+        Called by the scheduler before a failed page is tried again
+        A timeout or an empty page leaves the browser usable, anything else means it has to be replaced
+        """
+        self.metrics.count('retries')
+
+        if self.browser is None:
+            return
+
+        from selenium.common.exceptions import TimeoutException
+        if not isinstance(error, (TimeoutException, EmptyPageError)):
+            self.recycle_browser('crash')
+
+    def recycle_browser(self, reason=None):
+        """
+        Quit the browser and launch a new one with the same profile, releasing everything the old
+        one had built up over many pages
+        input:
+            reason - Why the browser is being replaced, only used for the metrics
+        output:
+            N/A
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        try:
             self.browser.quit()
+        except WebDriverException:
+            pass
 
-        # Wait for page to load
-        time.sleep(wait_after)
+        self.browser = self.profile.launch()
+        self.browser_pages = 0
+        self.metrics.count('recycles')
+        if reason is not None:
+            self.metrics.count('recycles.' + reason)
 
     def check_for_new(self, comp_info):
         """
-        After retrieving info about individual competitions, load previous data and compare to see
-        if there are any new comps
+        After retrieving info about individual competitions, check the ledger to see if there are
+        any new comps, or comps that had unfinished rounds when they were last scraped
         input:
             comp_info - tuple of info about comps scraped from the results page
         output:
             list of info in tuple form about comps that are new and should be scraped
         """
 
-        try:
-            # Load unique names of already scraped competitions
-            unique_names = pd.read_csv('~/projects/ifsc-scraper/data/name_df.csv')
-            # Convert to list
-            unique_names = list(unique_names['Competition Title'])
-        except:
-            print('No comp names saved')
-            unique_names = []
+        # Record of everything already scraped
+        if self.ledger is None:
+            self.ledger = ScrapeLedger()
 
         # List of new competition info
         new_comp_info = []
 
         # Check if each comp is new
         for comp in comp_info:
-            # Check if comp has been scraped or not
-            if comp[0] in unique_names:
+            # Check if comp has been fully scraped or not, and that none of its pages are still
+            # waiting in the checkpoint to be stored
+            unsaved = self.checkpoint is not None and self.checkpoint.unsaved_links(comp[2])
+            if self.ledger.is_complete(comp[0]) and not unsaved:
                 # Don't add it to new info
                 pass
             else:
-                # New comp, add to be scraped
+                # New comp, or one that was still running last time, add to be scraped
                 new_comp_info.append(comp)
-            
+
         # Return list of new comps
         return new_comp_info
 
-    def merge_dfs(self, gathered_dfs):
+    def merge_dfs(self, gathered_dfs, data_path='~/projects/ifsc-scraper/data/'):
         """
         Merge newly gathered dfs with old dfs
+        Rows that were scraped again replace their old version, matched on normalized competition,
+        category, athlete, and rank so whitespace changes in titles don't duplicate them
         input:
             gathered_dfs - pandas dataframes that have been gathered this run
+            data_path - Directory holding the existing result csv files
         output:
             merged dfs
         """
         # Split into dfs
         lead_df, speed_df, boulder_df, combined_df = gathered_dfs
 
-        # Merge each df with the exisiting data
-        old_lead_df = pd.read_csv('~/projects/ifsc-scraper/data/lead_results.csv')
-        old_speed_df = pd.read_csv('~/projects/ifsc-scraper/data/speed_results.csv')
-        old_boulder_df = pd.read_csv('~/projects/ifsc-scraper/data/boulder_results.csv')
-        old_combined_df = pd.read_csv('~/projects/ifsc-scraper/data/combined_results.csv')
+        with self.metrics.stage('merge'):
+            # Merge each df with the exisiting data
+            old_lead_df = pd.read_csv(data_path + 'lead_results.csv')
+            old_speed_df = pd.read_csv(data_path + 'speed_results.csv')
+            old_boulder_df = pd.read_csv(data_path + 'boulder_results.csv')
+            old_combined_df = pd.read_csv(data_path + 'combined_results.csv')
 
-        lead_df = pd.concat([lead_df, old_lead_df], ignore_index=True)
-        speed_df = pd.concat([speed_df, old_speed_df], ignore_index=True)
-        boulder_df = pd.concat([boulder_df, old_boulder_df], ignore_index=True)
-        combined_df = pd.concat([combined_df, old_combined_df], ignore_index=True)
+            lead_df = merge_results(lead_df, old_lead_df)
+            speed_df = merge_results(speed_df, old_speed_df)
+            boulder_df = merge_results(boulder_df, old_boulder_df)
+            combined_df = merge_results(combined_df, old_combined_df)
 
         return [lead_df, speed_df, boulder_df, combined_df]
 
     def clean_boulder(self, boulder_df):
         """
-        Cleans up the columns of the boulder df
-        input:
-            boulder_df - pandas dataframe containing info about bouldering comps
-        output:
-            cleaned boulder df
-        """
-        # Names of the possible columns for semifinals
-        semifinal_cols = ['Semi-Final', 'Semi Final', 'Semifinal', 'semi-Final', 'SemiFinal',
-        'Semi final', 'Semi-final', 'Semi - Final', '1/2-Final']
-
-        # Remove column names that aren't in this df
-        for col in list(semifinal_cols):
-            if col not in list(boulder_df):
-                semifinal_cols.remove(col)
-
-        # Consolidate columns
-        boulder_df['New Semifinal'] = boulder_df[semifinal_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        boulder_df = boulder_df.drop(semifinal_cols, axis=1)
-        boulder_df = boulder_df.rename(columns={'New Semifinal':'Semifinal'})
-
-        # Qualification 1 columns
-        qual_cols = ['1. Qualification (2)', '1. Qualification', 'Qualification (Group 1)',
-                 'Qualification (group A)', 'A Qualification', 'A. Qualification',
-                 'Qualification A', 'Qualification Group A', 'Qualification 1']
-
-        # Remove column names that aren't in this df
-        for col in list(qual_cols):
-            if col not in list(boulder_df):
-                qual_cols.remove(col)
-
-        # Consolidate columns
-        boulder_df['New Qualification 1'] = boulder_df[qual_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        boulder_df = boulder_df.drop(qual_cols, axis=1)
-        boulder_df = boulder_df.rename(columns={'New Qualification 1':'Qualification 1'})
-
-
-        # Qualification 2 columns
-        qual_cols = ['2. Qualification (2)', '2. Qualification', 'Qualification (Group 2)',
-                 'B Qualification', 'Qualification (group B)', 'B. Qualification',
-                 'Qualification B', 'Qualification Group B', 'Qualification 2']
-
-        # Remove column names that aren't in this df
-        for col in list(qual_cols):
-            if col not in list(boulder_df):
-                qual_cols.remove(col)
-
-        # Consolidate columns
-        boulder_df['New Qualification 2'] = boulder_df[qual_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        boulder_df = boulder_df.drop(qual_cols, axis=1)
-        boulder_df = boulder_df.rename(columns={'New Qualification 2':'Qualification 2'})
-
-
-        return boulder_df
+        Cleans up the columns of the boulder df, see cleaning.clean_boulder
+        """
+        return clean_boulder(boulder_df)
 
     def clean_combined(self, combined_df):
         """
-        Cleans up the columns of the combined df
-        input:
-            combined_df - pandas dataframe containing info about combined comps
-        output:
-            cleaned combined df
+        Cleans up the columns of the combined df, see cleaning.clean_combined
         """
-        # No cleaning needed as of 10/16/2019
-        return combined_df
+        return clean_combined(combined_df)
 
     def clean_lead(self, lead_df):
         """
-        Cleans up the columns of the lead df
+        Cleans up the columns of the lead df, see cleaning.clean_lead
+        """
+        return clean_lead(lead_df)
+
+    def clean_speed(self, speed_df):
+        """
+        Cleans up the columns of the speed df, see cleaning.clean_speed
+        """
+        return clean_speed(speed_df)
+
+    def close(self):
+        """
+        Shut down the browser, any pooled browsers, and the http connection pool
         input:
-            lead_df - pandas dataframe containing info about lead comps
+            N/A
         output:
-            cleaned lead df
+            N/A
         """
+        if self.pool is not None:
+            self.pool.close()
 
-        # Names of the possible columns for semifinals
-        semifinal_cols = ['1/2 Final', 'Semi-Final', 'Semi Final', 'SemiFinal', 'Semi-final', '1/2 - Final', '1/2-Final', 'Semi - Final', 'Semifinal']
+        if self.fetcher is not None:
+            self.fetcher.close()
 
-        # Remove column names that aren't in this df
-        for col in list(semifinal_cols):
-            if col not in list(lead_df):
-                semifinal_cols.remove(col)
-        
-        # Consolidate columns
-        lead_df['New Semifinal'] = lead_df[semifinal_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        lead_df = lead_df.drop(semifinal_cols, axis=1)
-        lead_df = lead_df.rename(columns={'New Semifinal':'Semifinal'})
-
-        # Names of the possible columns for qualification 1
-        qual_cols = ['1. Qualification 1', '1. Qualification',
-        'Qualification 1', '1. Qualification:', '1.Qualification',
-        'Group A Qualification', '1 Qualification', 'Qualification 1']
-        
-        # Remove column names that aren't in this df
-        for col in list(qual_cols):
-            if col not in list(lead_df):
-                qual_cols.remove(col)
-
-        # Consolidate columns
-        lead_df['New Qualification'] = lead_df[qual_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        lead_df = lead_df.drop(qual_cols, axis=1)
-        lead_df = lead_df.rename(columns={'New Qualification':'Qualification 1'})
-        
-        # Names of the possible columns for qualification 2
-        qual_cols = ['2. Qualification', '2. Qualification 2', 'Qualification 2', 'Group B Qualification', 'Qualification 2']
-
-        # Remove column names that aren't in this df
-        for col in list(qual_cols):
-            if col not in list(lead_df):
-                qual_cols.remove(col)
-
-        lead_df['New Qualification'] = lead_df[qual_cols].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        lead_df = lead_df.drop(qual_cols, axis=1)
-        lead_df = lead_df.rename(columns={'New Qualification':'Qualification 2'})
-
-        # Drop this random nan column is it's there
-        try:
-            lead_df = lead_df.drop(['Unnamed: 18'], axis=1)
-        except:
-            pass
+        if self.cache is not None:
+            self.cache.close()
 
-        return lead_df
+        if self.ledger is not None:
+            self.ledger.close()
 
-    def clean_speed(self, speed_df):
+        if self.athletes is not None:
+            self.athletes.close()
+
+        if self.aggregates is not None:
+            self.aggregates.close()
+
+        if self.browser is not None:
+            self.browser.quit()
+
+    def stream_results(self, comp_info, batch_size=5):
         """
-        Cleans up the columns of the speed df
+        Scrape comps a batch at a time, handing back each batch's results as soon as they are
+        extracted so they can be saved before the next batch is loaded
         input:
-            speed_df - pandas dataframe containing info about speed comps
+            comp_info - List of comp name, date, and link touples from get_comp_links
+            batch_size - Number of comps scraped per batch
         output:
-            cleaned speed df
+            Generator of (comps with their subcategory links, [lead_df, speed_df, boulder_df, combined_df])
+            for every batch
         """
+        if self.debug:
+            comp_info = comp_info[:4]
 
-        # Names of the possible columns for 1/8 finals
-        eighths = ['1/8 - Final', '1_8 - Final']
-
-        # Remove column names that aren't in this df
-        for col in list(eighths):
-            if col not in list(speed_df):
-                eighths.remove(col)
+        for start in range(0, len(comp_info), batch_size):
+            comps = self.get_complete_result_links(comp_info[start:start + batch_size])
+            self.metrics.count('batches')
 
-        speed_df['New Eighths'] = speed_df[eighths].apply(
-            lambda x: ','.join(x.dropna().astype(str)),
-            axis=1
-        )
-        speed_df = speed_df.drop(eighths, axis=1)
-        speed_df = speed_df.rename(columns={'New Eighths':'1/8 - Final'})
+            yield comps, self.make_df_from_data(self.get_sub_comp_info(comps))
 
-        return speed_df
+    def save_results(self, dfs):
+        """
+        Clean, type, and store one batch of results, index their athletes, and update the aggregates
+        input:
+            dfs - List of lead, speed, boulder, and combined dfs from make_df_from_data
+        output:
+            List of manifest entries that were written
+        """
+        # Batches are small, so they are cleaned in this process instead of starting a process pool
+        return postprocess.save_results(dfs, self.store, self.athletes, self.aggregates, self.metrics, processes=1)
 
-    def scrape(self):
+    def scrape(self, only_new=True, batch_size=5, requeue_passes=1, arrow_dir=DEFAULT_ARROW_DIR):
         """
         Scrape the website, build dataframes, save dataframes
+        Comps are scraped and saved a few at a time, so memory use doesn't grow with the size of
+        the run. Only the new results are cleaned and written, each competition as its own partition
         input:
-            N/A
+            only_new - Skip comps that have already been scraped, turn off to rebuild
+                       everything (e.g. from a replayed cache)
+            batch_size - Number of comps scraped before their results are saved
+            requeue_passes - Times the comps with pages that failed every retry are scraped again
+                             at the end of the run
+            arrow_dir - Directory the categories that changed are published to as arrow files for
+                        downstream readers (see storage.open_arrow), None to not publish them
         output:
-            N/A
+            Path of the metrics file written for this run, None if metrics aren't written
         """
-        lead_df, speed_df, boulder_df, combined_df = self.make_df_from_data(self.get_sub_comp_info(self.get_complete_result_links(self.check_for_new(self.get_comp_links()))))
-
-        # Merge new data with old data
-        lead_df, speed_df, boulder_df, combined_df = self.merge_dfs([lead_df, speed_df, boulder_df, combined_df])
-
-        # Clean data before saving
-        lead_df = self.clean_lead(lead_df)
-        speed_df = self.clean_speed(speed_df)
-        boulder_df = self.clean_boulder(boulder_df)
-        combined_df = self.clean_combined(combined_df)
-
-        lead_df.to_csv('lead_results.csv', index=False)
-        speed_df.to_csv('speed_results.csv', index=False)
-        boulder_df.to_csv('boulder_results.csv', index=False)
-        combined_df.to_csv('combined_results.csv', index=False)
+        # Pick up from an interrupted run if there is one
+        if self.checkpoint is None:
+            self.checkpoint = CheckpointLog()
+
+        # Record of what has been scraped
+        if self.ledger is None:
+            self.ledger = ScrapeLedger()
+        self.only_new = only_new
+
+        with self.metrics.stage('get_comp_links'):
+            comp_info = self.get_comp_links()
+        if only_new:
+            comp_info = self.check_for_new(comp_info)
+        self.metrics.count('comps', len(comp_info))
+
+        if self.store is None:
+            self.store = PartitionedStore()
+        if self.athletes is None:
+            self.athletes = AthleteIndex()
+        if self.aggregates is None:
+            self.aggregates = AggregateStore()
+
+        # Categories with new partitions, their arrow files are published again at the end
+        changed = set()
+
+        for attempt in range(requeue_passes + 1):
+            # Comp each page belongs to, so failed pages can be traced back to their comp
+            owners = {}
+
+            # Save each batch before scraping the next, then record it in the ledger and let the
+            # checkpoint drop its rows
+            for comps, dfs in self.stream_results(comp_info, batch_size):
+                changed.update(x['category'] for x in self.save_results(dfs))
+                self.record_saved(comps)
+
+                for comp in comps:
+                    owners[comp[2]] = comp[:3]
+                    owners.update((subcat[1], comp[:3]) for subcat in comp[3:])
+
+            failed = self.scheduler.requeue()
+            if not failed or attempt == requeue_passes:
+                # Pages still failing stay incomplete in the ledger and are picked up next run
+                self.scheduler.failed.update(failed)
+                break
+
+            # Whole comps are scraped again since each category of a comp is saved as one partition
+            comp_info = list(dict.fromkeys(owners[x] for x in failed if x in owners))
+            print('Requeueing ' + str(len(failed)) + ' failed pages from ' + str(len(comp_info)) + ' comps')
+            self.metrics.count('requeued_pages', len(failed))
+
+        # Everything that loaded is saved, categories still missing pages aren't in the ledger,
+        # so the next run starts fresh and scrapes them again
+        self.checkpoint.clear()
+        self.unsaved.clear()
+
+        if arrow_dir is not None and changed:
+            with self.metrics.stage('export'):
+                self.store.export_arrow(arrow_dir, [x for x in CATEGORIES if x in changed])
+
+        # Browsers restarted after crashing count as retries
+        if self.pool is not None:
+            self.metrics.count('retries', self.pool.restarts)
+
+        readiness = self.readiness.summary() if self.readiness is not None else {}
+
+        return self.metrics.write({'readiness': readiness, 'scheduler': self.scheduler.summary()})
 
 
 def main():
-    # Create scraper object
-    scraper = IFSCScraper()
+    # Create scraper object, printing progress every minute
+    scraper = IFSCScraper(metrics=RunMetrics(progress=60))
 
     # Run scraper
-    scraper.scrape()
+    metrics_path = scraper.scrape()
+    if metrics_path is not None:
+        print('Run metrics saved to ' + metrics_path)
+
+    # Shut down browsers
+    scraper.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
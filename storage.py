@@ -0,0 +1,396 @@
+import hashlib
+import json
+import os
+import re
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scores import NUMERIC_COLUMNS, PARSERS, ROUND_COLUMNS, compact_dtypes, type_results
+from dedupe import drop_duplicate_rows, normalize_values
+from athletes import normalize_name
+
+# Result categories, in the order used everywhere else in the scraper
+CATEGORIES = ['lead', 'speed', 'boulder', 'combined']
+
+# Where partitions are written unless told otherwise
+DEFAULT_STORE_DIR = '~/projects/ifsc-scraper/data/store'
+
+# Where the arrow files for downstream readers are published unless told otherwise
+DEFAULT_ARROW_DIR = '~/projects/ifsc-scraper/data/arrow'
+
+# Columns every category's arrow file starts with, in this order
+ARROW_BASE_COLUMNS = ['Competition Title', 'Competition Date', 'Category', 'Rank', 'StartNr', 'LAST', 'FIRST',
+                      'Nation', 'Points', 'Final Points']
+
+# Round columns of the combined results, which have no score parser
+COMBINED_ROUND_COLUMNS = ['Qualification lead', 'Qualification speed', 'Qualification boulder',
+                          'Final lead', 'Final speed', 'Final boulder']
+
+# Arrow type of each pandas dtype the typed results use
+ARROW_TYPES = {
+    'float32': pa.float32(),
+    'boolean': pa.bool_(),
+    'Int8': pa.int8(),
+    'Int16': pa.int16(),
+}
+
+
+def season_of(date, title=''):
+    """
+    Season (year) a competition belongs to
+    input:
+        date - Competition date string, e.g. '4  - 6 October 2019'
+        title - Competition title, used if the date has no year in it
+    output:
+        Year as an int, or None if it can't be found
+    """
+    for text in (date, title):
+        years = re.findall(r'(?:19|20)\d\d', str(text))
+        if years:
+            return int(years[-1])
+
+    return None
+
+
+def partition_name(competition):
+    """
+    File name for a competition's partition, readable but unique per title
+    """
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', competition).strip('-')[:60]
+    digest = hashlib.sha1(competition.encode('utf-8')).hexdigest()[:8]
+
+    return slug + '-' + digest + '.parquet'
+
+
+def arrow_schema(category, extra_columns=(), previous=None):
+    """
+    Fixed schema of a category's arrow file, so readers can rely on column names, order, and types
+    Known columns always come first, even when no stored result has them yet. Columns the scraper
+    doesn't know about come after them as strings: the ones already published keep their place,
+    and new ones are added at the end, so the schema only ever grows at the end
+    input:
+        category - Result category
+        extra_columns - Other columns found in the stored partitions
+        previous - Schema of the file published before, None if there isn't one
+    output:
+        pyarrow Schema
+    """
+    fields = []
+    for col in ARROW_BASE_COLUMNS:
+        if col in NUMERIC_COLUMNS:
+            fields.append(pa.field(col, ARROW_TYPES[NUMERIC_COLUMNS[col]]))
+        else:
+            fields.append(pa.field(col, pa.string()))
+
+    rounds = ROUND_COLUMNS[category] if category != 'combined' else COMBINED_ROUND_COLUMNS
+    fields += [pa.field(col, pa.string()) for col in rounds]
+
+    # Parsed score columns, named and typed the way type_results makes them
+    parser = PARSERS.get(category)
+    if parser is not None:
+        parsed = parser(pd.Series([], dtype=object))
+        for col in ROUND_COLUMNS[category]:
+            fields += [pa.field(col + ' ' + name, ARROW_TYPES[str(dtype)]) for name, dtype in parsed.dtypes.items()]
+
+    known = {x.name for x in fields}
+    published = [x for x in (previous.names if previous is not None else []) if x not in known]
+    fields += [pa.field(col, pa.string()) for col in published]
+    fields += [pa.field(col, pa.string()) for col in sorted(set(extra_columns) - known - set(published))]
+
+    return pa.schema(fields)
+
+
+def conform_table(table, schema):
+    """
+    Cast a partition's columns to a schema, adding the columns it doesn't have as nulls
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            if pa.types.is_dictionary(column.type):
+                column = column.cast(column.type.value_type)
+            columns.append(column.cast(field.type))
+        else:
+            columns.append(pa.nulls(len(table), field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def published_schema(path):
+    """
+    Schema of an arrow file that was already published, None if there is no readable file
+    """
+    try:
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).schema
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+
+def open_arrow(category, directory=DEFAULT_ARROW_DIR, columns=None):
+    """
+    Memory map a category's arrow file, nothing is read or copied until the data is used and
+    processes reading the same file share its pages
+    input:
+        category - Result category
+        directory - Directory the arrow files were published to
+        columns - Columns to keep, None for all
+    output:
+        pyarrow Table, call to_pandas() on it for a DataFrame
+    """
+    path = os.path.join(os.path.expanduser(directory), category + '_results.arrow')
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    return table if columns is None else table.select(columns)
+
+
+class PartitionedStore():
+    """
+    Columnar store of results, one Parquet file per category and competition
+    A manifest lists every partition with its season and row count, so new competitions are
+    written without touching existing data and readers only open the partitions they need
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        """
+        input:
+            root - Directory holding the partitions and manifest
+        """
+        self.root = os.path.expanduser(root)
+        self.manifest_path = os.path.join(self.root, 'manifest.json')
+
+        os.makedirs(self.root, exist_ok=True)
+
+        # (category, competition) -> partition entry
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                for entry in json.load(f)['partitions']:
+                    self.manifest[(entry['category'], entry['competition'])] = entry
+
+        # (category, normalized title) -> stored titles, to find partitions of the same competition
+        # stored under a title with different whitespace or case
+        self.titles = {}
+        for category, competition in self.manifest:
+            self.titles.setdefault((category, normalize_name(competition)), set()).add(competition)
+
+    def save_manifest(self):
+        """
+        Atomically rewrite the manifest
+        """
+        entries = sorted(self.manifest.values(), key=lambda x: (x['category'], x['competition']))
+
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'partitions': entries}, f, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    def write_partition(self, category, competition, df):
+        """
+        Write one competition's results, replacing any earlier partition for it
+        input:
+            category - Result category
+            competition - Competition title
+            df - Results for this competition only
+        output:
+            Manifest entry for the partition
+        """
+        date = df['Competition Date'].iloc[0] if 'Competition Date' in df else ''
+        season = season_of(date, competition)
+
+        path = os.path.join(category, 'season=' + str(season), partition_name(competition))
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        temp_path = full_path + '.tmp'
+        df.reset_index(drop=True).to_parquet(temp_path, index=False)
+        os.replace(temp_path, full_path)
+
+        entry = {
+            'category': category,
+            'competition': competition,
+            'season': season,
+            'path': path,
+            'rows': len(df),
+            'written_at': time.time(),
+        }
+
+        # Clean up the old file if this competition moved (e.g. its date was fixed)
+        old = self.manifest.get((category, competition))
+        if old is not None and old['path'] != path:
+            try:
+                os.remove(os.path.join(self.root, old['path']))
+            except FileNotFoundError:
+                pass
+
+        self.manifest[(category, competition)] = entry
+        self.titles.setdefault((category, normalize_name(competition)), set()).add(competition)
+
+        return entry
+
+    def remove_partition(self, category, competition):
+        """
+        Delete a competition's partition, the manifest has to be saved afterwards
+        """
+        entry = self.manifest.pop((category, competition), None)
+        if entry is None:
+            return
+
+        self.titles.get((category, normalize_name(competition)), set()).discard(competition)
+        try:
+            os.remove(os.path.join(self.root, entry['path']))
+        except FileNotFoundError:
+            pass
+
+    def append(self, category, df):
+        """
+        Add newly scraped results to the store, one partition per competition in df
+        Competitions that are already stored are replaced, also when they were stored under a title
+        that only differs in whitespace or case, and everything else is left alone. Rows repeated
+        within df (same competition, category, athlete, and rank) are only kept once, the last one wins
+        input:
+            category - Result category
+            df - Cleaned results for this category
+        output:
+            List of manifest entries that were written
+        """
+        if df is None or len(df) == 0:
+            return []
+
+        # Spellings of the same title are one competition, stored under the last spelling seen
+        titles = normalize_values(df['Competition Title'])
+
+        written = []
+        for title, comp_df in df.groupby(titles, sort=False):
+            competition = str(comp_df['Competition Title'].iloc[-1])
+
+            # Older copies of this competition under another spelling of the title
+            for old in list(self.titles.get((category, title), ())):
+                if old != competition:
+                    self.remove_partition(category, old)
+
+            if comp_df['Competition Title'].nunique() > 1:
+                comp_df = comp_df.assign(**{'Competition Title': competition})
+
+            written.append(self.write_partition(category, competition, drop_duplicate_rows(comp_df)))
+
+        self.save_manifest()
+
+        return written
+
+    def partitions(self, category=None, seasons=None, competitions=None):
+        """
+        Manifest entries matching the filters
+        input:
+            category - Only this category, None for all
+            seasons - Iterable of seasons to keep, None for all
+            competitions - Iterable of competition titles to keep, None for all
+        output:
+            List of manifest entries
+        """
+        seasons = set(seasons) if seasons is not None else None
+        competitions = set(competitions) if competitions is not None else None
+
+        return [x for x in self.manifest.values()
+                if (category is None or x['category'] == category)
+                and (seasons is None or x['season'] in seasons)
+                and (competitions is None or x['competition'] in competitions)]
+
+    def load(self, category, seasons=None, competitions=None, columns=None):
+        """
+        Read the results of one category, only opening the partitions that are needed
+        input:
+            category - Result category
+            seasons - Iterable of seasons to load, None for all
+            competitions - Iterable of competition titles to load, None for all
+            columns - Columns to read, None for all
+        output:
+            DataFrame of results
+        """
+        entries = self.partitions(category, seasons, competitions)
+        entries.sort(key=lambda x: x['path'])
+
+        frames = []
+        for entry in entries:
+            path = os.path.join(self.root, entry['path'])
+            if columns is None:
+                frames.append(pd.read_parquet(path))
+            else:
+                # Partitions don't all have the same columns, only ask for what's there
+                present = set(pq.read_schema(path).names)
+                frames.append(pd.read_parquet(path, columns=[x for x in columns if x in present]))
+
+        if not frames:
+            return pd.DataFrame()
+
+        # Categoricals from different partitions don't share categories, so set them up again
+        return compact_dtypes(pd.concat(frames, ignore_index=True, sort=False))
+
+    def import_csv(self, category, path):
+        """
+        Load an existing results csv into the store, parsing scores the same way scrape() does
+        input:
+            category - Result category
+            path - Path of the csv
+        output:
+            List of manifest entries that were written
+        """
+        df = pd.read_csv(os.path.expanduser(path), dtype=str)
+
+        return self.append(category, type_results(category, df))
+
+    def export_csv(self, directory):
+        """
+        Write every category out as a single csv, named like the original result files
+        input:
+            directory - Directory to write <category>_results.csv files to
+        output:
+            N/A
+        """
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        for category in CATEGORIES:
+            self.load(category).to_csv(os.path.join(directory, category + '_results.csv'), index=False)
+
+    def export_arrow(self, directory=DEFAULT_ARROW_DIR, categories=None):
+        """
+        Publish every category as an uncompressed Arrow IPC (Feather v2) file with a fixed schema,
+        named like the csv files with an .arrow extension, see open_arrow
+        Partitions are converted and written one at a time, so memory use stays at one partition.
+        Files are replaced atomically, readers that already have the old file mapped keep it
+        input:
+            directory - Directory to write <category>_results.arrow files to
+            categories - Categories to write, None for all
+        output:
+            List of paths written
+        """
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        written = []
+        for category in (CATEGORIES if categories is None else categories):
+            entries = sorted(self.partitions(category), key=lambda x: x['path'])
+            paths = [os.path.join(self.root, x['path']) for x in entries]
+
+            # Only the footers are read to find every column in use
+            extra = set()
+            for path in paths:
+                extra.update(pq.read_schema(path).names)
+
+            # Columns already published keep their positions for existing readers
+            path = os.path.join(directory, category + '_results.arrow')
+            schema = arrow_schema(category, extra, published_schema(path))
+
+            temp_path = path + '.tmp'
+            with pa.OSFile(temp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    for partition in paths:
+                        writer.write_table(conform_table(pq.read_table(partition), schema))
+            os.replace(temp_path, path)
+
+            written.append(path)
+
+        return written
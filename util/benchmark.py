@@ -0,0 +1,234 @@
+# ------------------------------------------------ #
+# File description:                                #
+#      Offline benchmarks for each stage of the    #
+#      scraper. Pages are replayed from a cache    #
+#      (recorded pages, or fixtures rendered from  #
+#      the bundled csv files) and the cleaning     #
+#      stages run on the csv files, also scaled    #
+#      up 10x and 100x. Reports throughput and     #
+#      peak memory per stage.                      #
+# ------------------------------------------------ #
+
+from html import escape
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+
+from cache import PageCache
+from scraper import IFSCScraper
+from storage import CATEGORIES
+
+# Repo data directory
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data') + os.sep
+
+# Same page the scraper starts from
+LAST_RESULT_URL = 'https://www.ifsc-climbing.org/index.php/world-competition/last-result'
+
+# Columns added by the scraper rather than read from the results table
+META_COLUMNS = ['Competition Title', 'Competition Date', 'Category']
+
+
+def render_results_page(df):
+    """
+    Render a complete result page for one subcategory, laid out the way get_data_on_page reads it:
+    a header row where the second header is the athlete name, then LAST and FIRST as separate cells
+    """
+    columns = [x for x in df.columns if x not in META_COLUMNS + ['LAST', 'FIRST']]
+    headers = ['Rank', 'Name'] + [x for x in columns if x != 'Rank']
+    cells = ['Rank', 'LAST', 'FIRST'] + [x for x in columns if x != 'Rank']
+
+    values = df.reindex(columns=cells).fillna('').astype(str).values
+    rows = ''.join('<tr>' + ''.join('<td>' + escape(x) + '</td>' for x in row) + '</tr>' for row in values)
+
+    return ('<html><body><div class="uk-section-primary uk-section uk-section-xsmall"></div><table>'
+            + '<tr>' + ''.join('<th>' + escape(x) + '</th>' for x in headers) + '</tr>'
+            + rows + '</table></body></html>')
+
+
+def write_fixtures(cache, data_path=DATA_PATH):
+    """
+    Render last result, competition, and complete result pages from the bundled csv files
+    into a cache, so the scraper can replay them
+    input:
+        cache - PageCache to fill
+        data_path - Directory holding the result csv files
+    output:
+        Number of pages written
+    """
+    frames = {x: pd.read_csv(data_path + x + '_results.csv', dtype=str) for x in CATEGORIES}
+    comps = pd.concat([x[['Competition Title', 'Competition Date']] for x in frames.values()]).drop_duplicates('Competition Title')
+
+    options = ''.join('<option value="' + str(i) + '" title="' + escape(str(date)) + '">' + escape(title) + '</option>'
+                      for i, (title, date) in enumerate(comps.values))
+    cache.put(LAST_RESULT_URL, '<html><body><select class="compChooser">' + options + '</select></body></html>')
+    pages = 1
+
+    for i, title in enumerate(comps['Competition Title']):
+        headers = ''
+        for category, df in frames.items():
+            comp_df = df[df['Competition Title'] == title]
+            if len(comp_df) == 0:
+                continue
+
+            link = 'https://www.ifsc-climbing.org/index.php/results/' + str(i) + '/' + category
+            cache.put(link, render_results_page(comp_df))
+            pages += 1
+
+            headers += ('<tr><th colspan="4">IFSC ' + category + '<br><a href="' + link
+                        + '">Complete Result</a></th></tr>')
+
+        cache.put(LAST_RESULT_URL + '#!comp=' + str(i), '<html><body><table>' + headers + '</table></body></html>')
+        pages += 1
+
+    return pages
+
+
+def measure(name, func, count, unit):
+    """
+    Run a stage once, timing it and tracking peak python memory
+    input:
+        name - Stage name
+        func - Function taking no arguments that runs the stage
+        count - Function taking the stage's result and returning how many items it processed
+        unit - What the items are, e.g. 'rows'
+    output:
+        (result, dict of stage stats)
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+
+    result = func()
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = count(result)
+    stats = {
+        'stage': name,
+        'seconds': elapsed,
+        'items': count,
+        'unit': unit,
+        'per_second': count / elapsed if elapsed > 0 else float('inf'),
+        'peak_mb': peak / 2 ** 20,
+    }
+    print('{stage:<28} {items:>9} {unit:<6} {seconds:>9.3f}s {per_second:>12.0f}/s {peak_mb:>9.1f} MB'.format(**stats))
+
+    return result, stats
+
+
+def count_rows(comp_data):
+    """
+    Number of result rows in the output of get_sub_comp_info
+    """
+    return sum(len(page) for cat in comp_data for page in cat)
+
+
+def count_df_rows(dfs):
+    """
+    Number of rows in a list of dfs
+    """
+    return sum(len(x) for x in dfs)
+
+
+def run(cache_dir=None, data_path=DATA_PATH, scales=(1, 10, 100)):
+    """
+    Run every benchmark stage
+    input:
+        cache_dir - PageCache directory of recorded pages to replay, None to render fixtures
+        data_path - Directory holding the result csv files
+        scales - How many copies of the csv data to clean
+    output:
+        List of stage stats
+    """
+    results = []
+    temp_dir = None
+
+    if cache_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        cache = PageCache(temp_dir.name)
+        print('Rendered ' + str(write_fixtures(cache, data_path)) + ' fixture pages')
+    else:
+        cache = PageCache(cache_dir)
+
+    scraper = IFSCScraper(backend='replay', cache=cache)
+
+    # Page parsing and extraction
+    comps, stats = measure('get_comp_links', scraper.get_comp_links, len, 'comps')
+    results.append(stats)
+
+    comp_info, stats = measure('get_complete_result_links', lambda: scraper.get_complete_result_links(comps),
+                               len, 'pages')
+    results.append(stats)
+
+    comp_data, stats = measure('get_sub_comp_info', lambda: scraper.get_sub_comp_info(comp_info), count_rows, 'rows')
+    results.append(stats)
+
+    # Extraction alone, on pages that are already loaded
+    links = [subcat[1] for comp in comp_info for subcat in comp[3:]]
+    pages = [cache.get(x, expire=False) for x in links]
+
+    def extract():
+        count = 0
+        for html in pages:
+            scraper.page_html = html
+            count += len(scraper.get_data_on_page([('Competition Title', ''), ('Competition Date', '')]))
+        return count
+
+    _, stats = measure('get_data_on_page', extract, lambda x: x, 'rows')
+    results.append(stats)
+
+    dfs, stats = measure('make_df_from_data', lambda: scraper.make_df_from_data(comp_data), count_df_rows, 'rows')
+    results.append(stats)
+
+    _, stats = measure('merge_dfs', lambda: scraper.merge_dfs(dfs, data_path), count_df_rows, 'rows')
+    results.append(stats)
+
+    # Cleaning, on the csv data and scaled copies of it
+    cleaners = {
+        'lead': scraper.clean_lead,
+        'speed': scraper.clean_speed,
+        'boulder': scraper.clean_boulder,
+        'combined': scraper.clean_combined,
+    }
+    for category in CATEGORIES:
+        base = pd.read_csv(data_path + category + '_results.csv')
+        for scale in scales:
+            df = pd.concat([base] * scale, ignore_index=True)
+            _, stats = measure('clean_' + category + ' x' + str(scale), lambda: cleaners[category](df),
+                               len, 'rows')
+            results.append(stats)
+            del df
+
+    cache.close()
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scraper stages offline')
+    parser.add_argument('--cache', help='PageCache directory of recorded pages, default renders fixtures from the csv files')
+    parser.add_argument('--data', default=DATA_PATH, help='Directory holding the result csv files')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='Copies of the csv data to clean')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = run(args.cache, args.data, args.scales)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    main()
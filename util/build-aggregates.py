@@ -0,0 +1,32 @@
+# ------------------------------------------------ #
+# File description:                                #
+#      Quick script to compute the aggregate       #
+#      tables (stats, head to heads, and ratings)  #
+#      from everything in the results store.       #
+#      The scraper keeps them up to date itself    #
+#      after that.                                 #
+# ------------------------------------------------ #
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aggregates import AggregateStore
+from storage import PartitionedStore
+
+def main():
+    """
+    Rebuild every aggregate table from the store
+    """
+
+    store = PartitionedStore()
+    aggregates = AggregateStore()
+
+    count = aggregates.build(store)
+    print(str(count) + ' placings counted')
+
+    aggregates.close()
+
+if __name__ == '__main__':
+    main()
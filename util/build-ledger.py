@@ -0,0 +1,33 @@
+# ------------------------------------------------ #
+# File description:                                #
+#      Quick script to seed the scrape ledger with #
+#      the comps already in the results store, so  #
+#      the scraper won't go through them again.    #
+#      The scraper keeps the ledger up to date     #
+#      itself after that.                          #
+# ------------------------------------------------ #
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ledger import ScrapeLedger
+from storage import PartitionedStore
+
+def main():
+    """
+    Mark every competition in the store as complete in the ledger
+    """
+
+    store = PartitionedStore()
+    ledger = ScrapeLedger()
+
+    # Unique names of comps in any category
+    unique_names = {x['competition'] for x in store.partitions()}
+
+    ledger.seed(unique_names)
+    print(str(len(unique_names)) + ' comps added to ledger')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+# ------------------------------------------------ #
+# File description:                                #
+#      One-off script to load the existing result  #
+#      csv files into the partitioned store so     #
+#      later scrapes only append new partitions.   #
+# ------------------------------------------------ #
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import CATEGORIES, PartitionedStore
+
+def main():
+    """
+    Import every <category>_results.csv into the store
+    """
+
+    data_path = '~/projects/ifsc-scraper/data/'
+
+    store = PartitionedStore()
+
+    # Iterate through files and add one partition per competition
+    for category in CATEGORIES:
+        written = store.import_csv(category, data_path + category + '_results.csv')
+        print(category + ': ' + str(len(written)) + ' partitions')
+
+if __name__ == '__main__':
+    main()
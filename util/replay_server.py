@@ -0,0 +1,75 @@
+# ------------------------------------------------ #
+# File description:                                #
+#      Local stand-in for the IFSC site that       #
+#      serves responses recorded by HTTPFetcher    #
+#      (record_dir=...), so the http backend can   #
+#      be run without touching the live site.      #
+# ------------------------------------------------ #
+
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from http_fetch import recorded_name
+
+
+class ReplayHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the recorded response for the requested path and query, 404 if there isn't one
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = os.path.join(self.server.record_dir, recorded_name(self.path))
+
+        if not os.path.exists(path):
+            self.send_error(404, 'No recorded response')
+            return
+
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def serve(record_dir, port=8000, quiet=False):
+    """
+    Create a server for the recorded responses in record_dir
+    input:
+        record_dir - Directory written by HTTPFetcher(record_dir=...)
+        port - Port to listen on, 0 picks a free port
+        quiet - Don't log every request
+    output:
+        ThreadingHTTPServer, call serve_forever() to run it
+    """
+    server = ThreadingHTTPServer(('localhost', port), ReplayHandler)
+    server.record_dir = record_dir
+    server.quiet = quiet
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded IFSC pages')
+    parser.add_argument('record_dir')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = serve(args.record_dir, args.port)
+    print('Serving ' + args.record_dir + ' on http://localhost:' + str(server.server_port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Where the shared work queue is kept unless told otherwise
+DEFAULT_QUEUE_PATH = '~/projects/ifsc-scraper/data/queue.sqlite'
+
+
+def worker_name():
+    """
+    Name identifying this worker process in the queue, unique across machines
+    """
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+class WorkQueue():
+    """
+    Work queue shared by a coordinator and any number of worker processes, kept in sqlite
+    Workers lease items for a limited time and renew the lease while they work, so items
+    held by a worker that died become available again once the lease runs out
+    Items go pending -> leased -> done -> merged, or back to pending when a worker gives up
+    on them, and to failed after too many attempts
+    The database has to be on a filesystem with working locks (a local disk, or a network
+    filesystem that supports them) when workers run on several machines
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=600, max_attempts=3):
+        """
+        input:
+            path - Path of the sqlite database
+            lease_seconds - How long a worker holds an item without renewing it
+            max_attempts - Times an item is leased before it is marked failed
+        """
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # A worker's lease renewal thread shares the connection
+        self.lock = threading.RLock()
+
+        # Waits for other processes' transactions instead of failing straight away
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until);
+        """)
+
+    def push(self, key, payload):
+        """
+        Add an item, or reset one that was already merged or failed so it is done again
+        Items that are still waiting, being worked on, or waiting to be merged are left alone
+        input:
+            key - Unique key of the item, e.g. a competition link
+            payload - json serializable description of the work
+        output:
+            True if the item is now pending because of this call
+        """
+        with self.lock:
+            cursor = self.db.execute("""
+                INSERT INTO items (key, payload, updated) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    payload = excluded.payload, status = 'pending', worker = NULL, lease_until = NULL,
+                    attempts = 0, result = NULL, error = NULL, updated = excluded.updated
+                WHERE status IN ('merged', 'failed')
+                """, (key, json.dumps(payload), time.time()))
+
+        return cursor.rowcount > 0
+
+    def lease(self, worker):
+        """
+        Take the next pending item, or one whose lease has run out
+        input:
+            worker - Name of the worker taking it
+        output:
+            (item id, payload), or None if there is nothing to do right now
+        """
+        now = time.time()
+        with self.lock:
+            # Taken under a write lock so two workers can't lease the same item
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # Items whose worker died and used up their attempts
+                self.db.execute("""
+                    UPDATE items SET status = 'failed', error = 'lease expired', updated = ?
+                    WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+                    """, (now, now, self.max_attempts))
+
+                row = self.db.execute("""
+                    SELECT id, payload FROM items
+                    WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)
+                    ORDER BY id LIMIT 1
+                    """, (now,)).fetchone()
+
+                if row is not None:
+                    self.db.execute("""
+                        UPDATE items SET status = 'leased', worker = ?, lease_until = ?,
+                            attempts = attempts + 1, updated = ?
+                        WHERE id = ?
+                        """, (worker, now + self.lease_seconds, now, row[0]))
+
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1])
+
+    def renew(self, item_id, worker):
+        """
+        Extend a lease while the item is still being worked on
+        output:
+            False if the lease was lost (it ran out and another worker took the item)
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute("""
+                UPDATE items SET lease_until = ?, updated = ?
+                WHERE id = ? AND worker = ? AND status = 'leased'
+                """, (now + self.lease_seconds, now, item_id, worker))
+
+        return cursor.rowcount > 0
+
+    def complete(self, item_id, worker, result=None):
+        """
+        Mark a leased item done, ready to be merged
+        input:
+            item_id - Id from lease()
+            worker - Worker that leased it
+            result - json serializable summary of what was done
+        output:
+            False if the lease had been lost, in which case another worker's result counts
+        """
+        with self.lock:
+            cursor = self.db.execute("""
+                UPDATE items SET status = 'done', lease_until = NULL, result = ?, error = NULL, updated = ?
+                WHERE id = ? AND worker = ? AND status = 'leased'
+                """, (json.dumps(result), time.time(), item_id, worker))
+
+        return cursor.rowcount > 0
+
+    def fail(self, item_id, worker, error):
+        """
+        Give up on a leased item, putting it back to be tried again unless it has run out of attempts
+        """
+        with self.lock:
+            self.db.execute("""
+                UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    worker = NULL, lease_until = NULL, error = ?, updated = ?
+                WHERE id = ? AND worker = ? AND status = 'leased'
+                """, (self.max_attempts, str(error), time.time(), item_id, worker))
+
+    def done(self):
+        """
+        Items that are finished and waiting to be merged
+        output:
+            List of (item id, payload, result) touples
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT id, payload, result FROM items WHERE status = 'done' ORDER BY id").fetchall()
+
+        return [(x[0], json.loads(x[1]), json.loads(x[2]) if x[2] else None) for x in rows]
+
+    def mark_merged(self, item_ids):
+        """
+        Record that finished items have been merged
+        """
+        with self.lock:
+            self.db.executemany("UPDATE items SET status = 'merged', updated = ? WHERE id = ? AND status = 'done'",
+                                [(time.time(), x) for x in item_ids])
+
+    def remaining(self):
+        """
+        Number of items still waiting or being worked on
+        """
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM items WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def counts(self):
+        """
+        Number of items in each status
+        output:
+            Dict of status to count
+        """
+        with self.lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def items(self):
+        """
+        Every item in the queue
+        output:
+            List of (key, payload, status, error) touples
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT key, payload, status, error FROM items ORDER BY id").fetchall()
+
+        return [(x[0], json.loads(x[1]), x[2], x[3]) for x in rows]
+
+    def failures(self):
+        """
+        Items that ran out of attempts
+        output:
+            List of (key, error) touples
+        """
+        with self.lock:
+            return self.db.execute("SELECT key, error FROM items WHERE status = 'failed' ORDER BY id").fetchall()
+
+    def close(self):
+        self.db.close()